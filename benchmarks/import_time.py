@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+冷启动基准测试
+在全新的解释器中反复导入 web_listener_new，统计导入耗时；
+--eager 额外构建所有延迟组件，模拟改为延迟初始化之前的启动开销；
+--top N 输出 python -X importtime 中耗时最多的模块
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SNIPPET = '''
+import sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import web_listener_new as w
+imported = time.perf_counter()
+if {eager!r}:
+    w.create_app()
+    for component in (w.db_manager, w.search_index, w.summary_cache, w.chunk_store, w.summarizer, w.client):
+        try:
+            component.instance()
+        except Exception:
+            pass
+print(imported - started, time.perf_counter() - started)
+'''
+
+
+def measure(runs, eager):
+    """
+    Returns:
+        [(导入秒数, 含初始化的总秒数), ...]
+    """
+    results = []
+    # 在临时目录中运行，避免读写真实的配置和数据库
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', _SNIPPET.format(root=ROOT, eager=eager)],
+                cwd=workdir, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            imported, total = output.split()
+            results.append((float(imported), float(total)))
+    return results
+
+
+def top_imports(n):
+    """python -X importtime 中累计耗时最多的 n 个模块"""
+    with tempfile.TemporaryDirectory() as workdir:
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {ROOT!r}); import web_listener_new'],
+            cwd=workdir, capture_output=True, text=True, check=True
+        ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # 格式: import time: 自身微秒 | 累计微秒 | 模块名
+        self_us, cumulative_us, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='web_listener_new 冷启动基准测试')
+    parser.add_argument('--runs', type=int, default=10, help='重复次数 (默认: 10)')
+    parser.add_argument('--eager', action='store_true', help='同时构建所有延迟组件')
+    parser.add_argument('--top', type=int, default=0, help='输出耗时最多的 N 个导入模块')
+    args = parser.parse_args()
+
+    results = measure(args.runs, args.eager)
+    imports = [imported for imported, _ in results]
+    totals = [total for _, total in results]
+    print(f"导入耗时: 中位数 {statistics.median(imports) * 1000:.1f} ms, 最小 {min(imports) * 1000:.1f} ms")
+    if args.eager:
+        print(f"含初始化: 中位数 {statistics.median(totals) * 1000:.1f} ms, 最小 {min(totals) * 1000:.1f} ms")
+
+    if args.top:
+        print(f"\n累计耗时最多的 {args.top} 个模块:")
+        for cumulative_us, self_us, name in top_imports(args.top):
+            print(f"  {cumulative_us / 1000:8.1f} ms  (自身 {self_us / 1000:6.1f} ms)  {name}")
+
+
+if __name__ == '__main__':
+    main()
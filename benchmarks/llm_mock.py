@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大模型网关基准测试
+在本地启动几个 OpenAI 兼容的模拟服务（可设置延迟和失败率），
+并发地通过 LLMGateway 发起请求，输出吞吐量、延迟、连接复用、切换和对冲次数
+
+单独启动一个模拟服务供手工测试：
+    python benchmarks/llm_mock.py --serve 8089 --latency 0.5 --fail-rate 0.1
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from llm_gateway import LLMGateway, Provider  # noqa: E402
+
+
+def make_handler(latency, fail_rate, chunks=10):
+    """创建模拟 /v1/chat/completions 的请求处理器"""
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            time.sleep(latency * random.uniform(0.5, 1.5))
+            if random.random() < fail_rate:
+                self._send_json(503, {'error': {'message': 'overloaded'}})
+                return
+            if not request.get('stream'):
+                self._send_json(200, {'choices': [{'message': {'role': 'assistant', 'content': '总结' * chunks}}]})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for _ in range(chunks):
+                self._write_chunk(f"data: {json.dumps({'choices': [{'delta': {'content': '总结'}}]})}\n\n")
+            self._write_chunk('data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+
+        def _write_chunk(self, text):
+            data = text.encode('utf-8')
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    return MockHandler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # 客户端放弃请求（对冲、首段超时）时断开连接是预期行为
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_mock(latency=0.05, fail_rate=0.0, port=0):
+    """在后台线程启动模拟服务，返回 (服务, 根地址)"""
+    server = MockServer(('127.0.0.1', port), make_handler(latency, fail_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+
+def run(gateway, requests, concurrency, stream):
+    """并发发起 requests 次请求，返回 (每秒请求数, 延迟列表, 失败次数)"""
+    messages = [{'role': 'user', 'content': '请总结以下内容'}]
+
+    def call(_):
+        started = time.perf_counter()
+        try:
+            if stream:
+                ok = bool(''.join(gateway.chat_stream(messages, max_tokens=100)))
+            else:
+                ok = bool(gateway.chat(messages, max_tokens=100))
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, [latency for latency, _ in results], sum(1 for _, ok in results if not ok)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='大模型网关基准测试（本地模拟服务）')
+    parser.add_argument('--serve', type=int, help='只启动一个模拟服务并监听该端口')
+    parser.add_argument('--latency', type=float, default=0.05, help='主提供方的平均响应秒数 (默认: 0.05)')
+    parser.add_argument('--fail-rate', type=float, default=0.2, help='主提供方的失败率 (默认: 0.2)')
+    parser.add_argument('--backup-latency', type=float, default=0.05, help='备用提供方的平均响应秒数 (默认: 0.05)')
+    parser.add_argument('--requests', type=int, default=200, help='请求次数 (默认: 200)')
+    parser.add_argument('--concurrency', type=int, default=16, help='客户端并发数 (默认: 16)')
+    parser.add_argument('--max-concurrency', type=int, default=4, help='网关同时请求数上限 (默认: 4)')
+    parser.add_argument('--hedge-after', type=float, default=0.0, help='对冲/切换的延迟阈值秒数 (默认: 0，只在出错时切换)')
+    parser.add_argument('--rpm', type=int, default=0, help='每个提供方每分钟请求数上限 (默认: 0，不限)')
+    parser.add_argument('--stream', action='store_true', help='使用流式请求')
+    args = parser.parse_args()
+
+    if args.serve:
+        server, base_url = start_mock(args.latency, args.fail_rate, args.serve)
+        print(f"模拟服务已启动: {base_url}/chat/completions")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    primary, primary_url = start_mock(args.latency, args.fail_rate)
+    backup, backup_url = start_mock(args.backup_latency, 0.0)
+    gateway = LLMGateway(
+        [Provider('primary', primary_url, model='mock', rpm=args.rpm),
+         Provider('backup', backup_url, model='mock', rpm=args.rpm)],
+        max_concurrency=args.max_concurrency, hedge_after=args.hedge_after
+    )
+
+    rate, latencies, failed = run(gateway, args.requests, args.concurrency, args.stream)
+    stats = gateway.get_stats()
+    print(f"吞吐量: {rate:.1f} 请求/秒，失败 {failed} 次")
+    print(f"延迟: p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms, "
+          f"平均 {statistics.mean(latencies) * 1000:.1f} ms")
+    print(f"切换 {stats['failovers']} 次，对冲 {stats['hedges']} 次（胜出 {stats['hedge_wins']} 次，"
+          f"无空闲槽位放弃 {stats['hedges_skipped']} 次），"
+          f"排队 {stats['queued']} 次")
+    for name, provider in stats['providers'].items():
+        pool = provider['pool']
+        print(f"  {name}: 请求 {provider['requests']}，成功 {provider['ok']}，失败 {provider['errors']}，"
+              f"限速 {provider['rate_limited']}，新建连接 {pool['created']}，复用 {pool['reused']}")
+    gateway.close()
+    primary.shutdown()
+    backup.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线回放基准测试
+不连接 Telegram：用合成的（或录制的）新消息事件直接调用 message_handler，
+数据库和 AI 总结器换成内存桩；再用 Flask 测试客户端请求读接口和总结接口。
+分别在 10/100/1000 个群组下输出吞吐量和 p50/p99 延迟，便于发现性能回退
+
+录制的事件文件为 JSONL，每行一条消息：
+    {"chat_id": 1, "chat_username": "foo", "chat_title": "Foo", "message_id": 1,
+     "sender_id": 42, "sender_username": "bar", "text": "...", "date": "2024-01-01T00:00:00+00:00"}
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ('btc', 'eth', 'sol', '空投', '合约', '上所', '解锁', '回购', 'gm', '链上', '巨鲸', '清算', '质押', '主网')
+
+
+# ==================== 桩 ====================
+class StubUser:
+    def __init__(self, user_id, username, first_name):
+        self.id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = None
+
+
+class StubChat:
+    def __init__(self, chat_id, username, title):
+        self.id = chat_id
+        self.username = username
+        self.title = title
+
+
+class StubMessage:
+    def __init__(self, message_id, sender, text, date):
+        self.id = message_id
+        self.sender_id = sender.id
+        self.text = text
+        self.date = date
+        self._sender = sender
+
+    async def get_sender(self):
+        return self._sender
+
+
+class StubEvent:
+    """只实现 message_handler 用到的 NewMessage 事件属性"""
+
+    def __init__(self, chat, message):
+        self.chat_id = chat.id
+        self.message = message
+        self._chat = chat
+
+    async def get_chat(self):
+        return self._chat
+
+
+class StubDatabase:
+    """内存数据库：实现监听器和读接口用到的 DatabaseManager 方法"""
+
+    def __init__(self):
+        self.by_username = {}
+        self.next_id = 1
+
+    def save_messages(self, batch):
+        for message_data in batch:
+            row = dict(message_data, id=self.next_id)
+            self.next_id += 1
+            if isinstance(row['message_date'], datetime):
+                row['message_date'] = row['message_date'].isoformat()
+            self.by_username.setdefault((row['chat_username'] or '').lower(), []).append(row)
+
+    def save_message(self, message_data):
+        self.save_messages([message_data])
+
+    def get_messages_by_chat_username(self, username, limit=100):
+        rows = self.by_username.get(username.lower(), [])
+        return rows[::-1][:limit]
+
+    def get_messages_page(self, username, limit=100, before_id=None, after_id=None):
+        rows = [
+            row for row in reversed(self.by_username.get(username.lower(), []))
+            if (before_id is None or row['message_id'] < before_id)
+            and (after_id is None or row['message_id'] > after_id)
+        ]
+        return rows[-limit:] if after_id is not None and before_id is None else rows[:limit]
+
+    def get_messages_in_range(self, username, since_ts=None, until_ts=None, limit=100):
+        rows = [
+            row for row in reversed(self.by_username.get(username.lower(), []))
+            if (since_ts is None or row['message_ts'] >= since_ts)
+            and (until_ts is None or row['message_ts'] < until_ts)
+        ]
+        return rows[:limit]
+
+    def get_group_stats(self):
+        return [{
+            'chat_id': rows[-1]['chat_id'],
+            'chat_title': rows[-1]['chat_title'],
+            'chat_username': rows[-1]['chat_username'],
+            'message_count': len(rows),
+            'last_message_id': rows[-1]['message_id'],
+            'last_message_date': rows[-1]['message_date']
+        } for rows in self.by_username.values() if rows]
+
+
+class StubLLMClient:
+    """返回固定内容的 LLM 客户端，可模拟响应延迟（固定延迟 + 按提示词长度增加的延迟）"""
+
+    def __init__(self, latency=0.0, ms_per_1k_tokens=0.0, chunks=20):
+        self.latency = latency
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+        self.chunks = chunks
+
+    def _delay(self, messages):
+        from prompt_packer import estimate_tokens
+        tokens = sum(estimate_tokens(message['content']) for message in messages)
+        return self.latency + tokens / 1000 * self.ms_per_1k_tokens / 1000
+
+    def chat(self, messages, max_tokens=None):
+        time.sleep(self._delay(messages))
+        return '总结' * self.chunks
+
+    def chat_stream(self, messages, max_tokens=None):
+        delay = self._delay(messages)
+        for _ in range(self.chunks):
+            time.sleep(delay / self.chunks)
+            yield '总结'
+
+
+class StubSummarizer:
+    def __init__(self, client):
+        self.client = client
+        self.prompts = {}
+
+
+# ==================== 事件来源 ====================
+def synthetic_events(group_count, message_count, senders=500, seed=1):
+    """生成均匀分布在 group_count 个群组中的新消息事件"""
+    rng = random.Random(seed)
+    chats = [StubChat(-1000000000000 - i, f'bench_group_{i}', f'Bench Group {i}') for i in range(group_count)]
+    users = [StubUser(10000 + i, f'user{i}', f'User {i}') for i in range(senders)]
+    next_ids = [0] * group_count
+    started = datetime.now(timezone.utc) - timedelta(seconds=message_count)
+    events = []
+    for n in range(message_count):
+        index = rng.randrange(group_count)
+        next_ids[index] += 1
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+        message = StubMessage(next_ids[index], rng.choice(users), text, started + timedelta(seconds=n))
+        events.append(StubEvent(chats[index], message))
+    return chats, events
+
+
+def recorded_events(path):
+    """从 JSONL 文件读取录制的消息事件"""
+    chats = {}
+    users = {}
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            chat = chats.setdefault(row['chat_id'], StubChat(
+                row['chat_id'], row.get('chat_username'), row.get('chat_title')
+            ))
+            sender_id = row.get('sender_id') or 0
+            user = users.setdefault(sender_id, StubUser(sender_id, row.get('sender_username'), row.get('sender_name')))
+            date = datetime.fromisoformat(row['date']) if row.get('date') else datetime.now(timezone.utc)
+            events.append(StubEvent(chat, StubMessage(row['message_id'], user, row.get('text'), date)))
+    return list(chats.values()), events
+
+
+# ==================== 测量 ====================
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize_latencies(values):
+    """延迟列表（秒） -> 毫秒统计"""
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(values) * 1000, 3) if values else 0.0
+    }
+
+
+def reset_listener(w, chats):
+    """为一轮测量准备干净的监听器状态"""
+    w.db_manager = StubDatabase()
+    w.message_writer = w.MessageWriter(w.WRITE_BATCH_SIZE, w.WRITE_FLUSH_MS, w.WRITE_QUEUE_SIZE)
+    w.dispatch_counter = w.DispatchCounter()
+    w.sender_cache = w.SenderCache(w.SENDER_CACHE_SIZE, w.SENDER_CACHE_TTL)
+    w.group_stats.clear()
+    w.group_index.clear()
+    w.monitored_groups[:] = [f'@{chat.username}' if chat.username else str(chat.id) for chat in chats]
+    for chat, group in zip(chats, w.monitored_groups):
+        w.index_group(chat.id, group)
+
+
+def replay(w, events):
+    """
+    依次把事件交给 message_handler
+
+    Returns:
+        (每秒处理的消息数（含写入队列排空）, 每条消息的处理器延迟列表)
+    """
+    latencies = []
+
+    async def run():
+        w.message_writer.start(asyncio.get_running_loop())
+        started = time.perf_counter()
+        for event in events:
+            t = time.perf_counter()
+            await w.message_handler(event)
+            latencies.append(time.perf_counter() - t)
+        await w.message_writer.flush()
+        return time.perf_counter() - started
+
+    # 处理器每条消息都会打印日志，测量时丢弃输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        elapsed = asyncio.run(run())
+    return len(events) / elapsed if elapsed else 0.0, latencies
+
+
+def measure_endpoints(w, chats, requests_per_endpoint, summarize_request, seed=1):
+    """用 Flask 测试客户端请求读接口和（桩）总结接口"""
+    rng = random.Random(seed)
+    client = w.app.test_client()
+    groups = list(w.monitored_groups)
+
+    def messages_url():
+        return f'/api/groups/{rng.choice(groups)}/messages?limit=100'
+
+    def summarize():
+        group = rng.choice(groups)
+        response = client.post(f'/api/groups/{group}/summarize', json=dict(summarize_request, use_cache=False))
+        response.get_data()
+        return response
+
+    endpoints = {
+        '/api/groups': lambda: client.get('/api/groups'),
+        '/api/groups/<group>/messages': lambda: client.get(messages_url()),
+        '/api/groups/<group>/summarize': summarize
+    }
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, call in endpoints.items():
+            latencies = []
+            for _ in range(requests_per_endpoint):
+                t = time.perf_counter()
+                response = call()
+                latencies.append(time.perf_counter() - t)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{name} 返回 {response.status_code}')
+            results[name] = summarize_latencies(latencies)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='监听器和 API 的离线回放基准测试')
+    parser.add_argument('--groups', default='10,100,1000', help='群组数量，逗号分隔 (默认: 10,100,1000)')
+    parser.add_argument('--messages', type=int, default=20000, help='每轮回放的合成消息数 (默认: 20000)')
+    parser.add_argument('--events', help='录制的事件文件 (JSONL)，指定后忽略 --groups/--messages')
+    parser.add_argument('--requests', type=int, default=200, help='每个接口的请求次数 (默认: 200)')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='桩 LLM 每次调用的模拟延迟秒数 (默认: 0)')
+    parser.add_argument('--llm-ms-per-1k-tokens', type=float, default=0.0,
+                        help='桩 LLM 每千个提示词 token 增加的模拟延迟毫秒数 (默认: 0)')
+    parser.add_argument('--summarize-mode', choices=['default', 'map_reduce'], default='default',
+                        help='总结接口使用的模式 (默认: default)')
+    parser.add_argument('--summarize-limit', type=int, default=200, help='每次总结使用的消息数 (默认: 200)')
+    parser.add_argument('--json', dest='json_output', help='把结果另存为 JSON 文件，便于比较')
+    args = parser.parse_args()
+
+    json_output = os.path.abspath(args.json_output) if args.json_output else None
+    workdir = tempfile.mkdtemp(prefix='tg-bench-')
+    # 在临时目录中导入，搜索索引、总结缓存等文件都写到这里
+    os.chdir(workdir)
+    import web_listener_new as w
+    w.summarizer = StubSummarizer(StubLLMClient(args.llm_latency, args.llm_ms_per_1k_tokens))
+    summarize_request = {'limit': args.summarize_limit}
+    if args.summarize_mode != 'default':
+        summarize_request['mode'] = args.summarize_mode
+
+    if args.events:
+        runs = [recorded_events(args.events)]
+    else:
+        runs = [synthetic_events(int(n), args.messages) for n in args.groups.split(',')]
+
+    results = []
+    for chats, events in runs:
+        reset_listener(w, chats)
+        rate, latencies = replay(w, events)
+        endpoints = measure_endpoints(w, chats, args.requests, summarize_request)
+        results.append({
+            'groups': len(chats),
+            'messages': len(events),
+            'messages_per_sec': round(rate, 1),
+            'handler': summarize_latencies(latencies),
+            'endpoints': endpoints,
+            'writer': w.message_writer.get_stats()
+        })
+
+    for result in results:
+        handler = result['handler']
+        print(f"\n=== {result['groups']} 个群组, {result['messages']} 条消息 ===")
+        print(f"  吞吐量        {result['messages_per_sec']:>10.1f} 条/秒")
+        print(f"  处理器延迟    p50 {handler['p50_ms']:>8.3f} ms   p99 {handler['p99_ms']:>8.3f} ms")
+        for name, stats in result['endpoints'].items():
+            print(f"  {name:<32} p50 {stats['p50_ms']:>8.3f} ms   p99 {stats['p99_ms']:>8.3f} ms")
+
+    if json_output:
+        with open(json_output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控群组配置存储
+内存中的群组列表在锁内修改，写入经过防抖合并后以"写临时文件再改名"的方式原子落盘；
+配置文件被其他进程或手工修改后自动重新加载，并保留本进程尚未落盘的增删
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class ConfigStore:
+    """监控群组配置存储"""
+
+    def __init__(self, path, default_groups, debounce=0.5, read_only=False, extra=None, on_change=None):
+        """
+        初始化存储
+
+        Args:
+            path: 配置文件路径
+            default_groups: 配置文件不存在或损坏时使用的群组
+            debounce: 修改后等待多少秒再写入（期间的多次修改合并为一次写入）
+            read_only: 只读模式，从不写入配置文件
+            extra: 写入时调用，返回要一并保存的其他字段（如 group_ids）
+            on_change: 从文件重新加载后调用，参数为配置字典；调用方据此合并其他字段，
+                       之后写入时 extra() 返回的就是合并后的内容
+        """
+        self.path = path
+        self.default_groups = list(default_groups)
+        self.debounce = debounce
+        self.read_only = read_only
+        self.extra = extra
+        self.on_change = on_change
+        # 群组列表对象始终不变，只在锁内原地修改，调用方可以直接持有引用
+        self.groups = []
+        self.data = {}
+        self._lock = threading.RLock()
+        self._pending_ops = []
+        self._timer = None
+        self._file_stamp = None
+        self._watcher = None
+        self._watcher_pid = None
+        # 每次内存中的群组变化（加载、增删）加一，调用方据此发现变化
+        self.version = 0
+        self.stats = {'writes': 0, 'coalesced': 0, 'reloads': 0, 'write_errors': 0}
+
+    def _stamp(self):
+        """配置文件的 (修改时间, 大小)，文件不存在返回 None"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        """
+        从文件加载配置
+
+        Returns:
+            配置字典（文件不存在或损坏时为空字典）
+        """
+        with self._lock:
+            stamp = self._stamp()
+            data = {}
+            if stamp is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    print(f"⚠ 加载配置失败: {e}，使用默认配置")
+                    data = {}
+            self.groups[:] = data.get('groups', self.default_groups)
+            self.data = data
+            self.version += 1
+            self._file_stamp = stamp
+            if stamp is None:
+                # 首次运行：写入默认配置
+                self.save()
+            return data
+
+    def reload_if_changed(self):
+        """
+        配置文件被外部修改后重新加载，重新应用本进程尚未落盘的增删，再调用 on_change
+
+        Returns:
+            重新加载后的配置字典，没有变化返回 None
+        """
+        with self._lock:
+            stamp = self._stamp()
+            if stamp is None or stamp == self._file_stamp:
+                return None
+            pending = list(self._pending_ops)
+            data = self.load()
+            for op, group in pending:
+                self._apply(op, group)
+            self._pending_ops = pending
+            self.stats['reloads'] += 1
+            if self.on_change:
+                try:
+                    self.on_change(data)
+                except Exception as e:
+                    print(f"⚠ 应用重新加载的配置失败: {e}")
+            return data
+
+    def _apply(self, op, group):
+        """在内存中应用一次增删（调用方持有锁）"""
+        if op == 'add' and group not in self.groups:
+            self.groups.append(group)
+        elif op == 'remove' and group in self.groups:
+            self.groups.remove(group)
+        else:
+            return False
+        self.version += 1
+        return True
+
+    def add_groups(self, groups):
+        """
+        添加群组（已存在的跳过）
+
+        Returns:
+            实际新增的群组列表
+        """
+        with self._lock:
+            added = [group for group in groups if self._apply('add', group)]
+            self._pending_ops.extend(('add', group) for group in added)
+            if added:
+                self.save()
+            return added
+
+    def remove_group(self, group):
+        """删除群组，不存在时返回 False"""
+        with self._lock:
+            if not self._apply('remove', group):
+                return False
+            self._pending_ops.append(('remove', group))
+            self.save()
+            return True
+
+    def save(self):
+        """安排一次写入：debounce 秒内的多次调用合并为一次"""
+        if self.read_only:
+            return
+        with self._lock:
+            if self._timer is not None:
+                self.stats['coalesced'] += 1
+                return
+            self._timer = threading.Timer(self.debounce, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """立即写入尚未落盘的修改（先写临时文件再改名，读者不会看到写了一半的文件）"""
+        if self.read_only:
+            return
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            # 先合并外部修改（群组列表和经 on_change 合并的其他字段），避免覆盖其他进程刚写入的配置
+            self.reload_if_changed()
+            data = dict(self.extra() if self.extra else {})
+            data['groups'] = list(self.groups)
+            data['updated_at'] = datetime.now().isoformat()
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                self.stats['write_errors'] += 1
+                print(f"⚠ 保存配置失败: {e}")
+                return
+            self.data = data
+            self._file_stamp = self._stamp()
+            self._pending_ops = []
+            self.stats['writes'] += 1
+
+    def watch(self, on_change=None, interval=1.0):
+        """
+        启动后台线程监视配置文件（fork 出的子进程需要重新调用）
+
+        Args:
+            on_change: 重新加载后调用，参数为配置字典（None 表示沿用构造时传入的）
+            interval: 检查间隔秒数
+        """
+        if on_change is not None:
+            self.on_change = on_change
+        if self._watcher is not None and self._watcher.is_alive() and self._watcher_pid == os.getpid():
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"⚠ 重新加载配置失败: {e}")
+
+        self._watcher = threading.Thread(target=run, name='config-watcher', daemon=True)
+        self._watcher_pid = os.getpid()
+        self._watcher.start()
+
+    def get_stats(self):
+        """获取读写统计"""
+        with self._lock:
+            return dict(self.stats, groups=len(self.groups), pending=bool(self._timer))
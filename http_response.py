@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+读接口的响应层
+JSON 用 orjson 序列化（未安装时退回标准库），较大的响应按客户端支持压缩为 brotli 或 gzip，
+并带上 ETag / Last-Modified，内容没有变化时返回 304，仪表盘刷新不用重复下载相同的数据
+"""
+
+import gzip
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩收益抵不过开销）
+MIN_COMPRESS_SIZE = 1024
+
+
+def _default(value):
+    """标准库 json 无法序列化的值：时间转为 ISO 格式（与 orjson 一致），其余转为字符串"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(payload):
+    """把响应内容序列化为 UTF-8 JSON 字节串"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def make_etag(*parts):
+    """根据决定响应内容的值生成 ETag"""
+    raw = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def parse_timestamp(value):
+    """把消息日期（ISO 字符串或 datetime）转换为带时区的 datetime，无法解析返回 None"""
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if not isinstance(value, datetime):
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+    except ValueError:
+        return None
+
+
+def _choose_encoding(size):
+    """按 Accept-Encoding 选择压缩方式，不压缩返回 None"""
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _set_validators(response, etag, last_modified):
+    # 压缩与否的表示不同但内容相同，使用弱 ETag
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if etag is not None or last_modified is not None:
+        # 允许缓存，但每次使用前都要向服务器确认
+        response.cache_control.no_cache = True
+
+
+def is_not_modified(etag=None, last_modified=None):
+    """客户端缓存的版本是否仍然有效（有 If-None-Match 时忽略 If-Modified-Since）"""
+    if etag is not None and request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def json_response(payload, etag=None, last_modified=None, status=200):
+    """
+    生成 JSON 响应（按需压缩，带缓存校验头）
+
+    Args:
+        payload: 响应内容
+        etag: ETag，None 表示不设置
+        last_modified: 内容最后修改时间（带时区的 datetime），None 表示不设置
+    """
+    body = dumps(payload)
+    encoding = _choose_encoding(len(body))
+    if encoding == 'br':
+        body = brotli.compress(body, quality=4)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=5)
+
+    response = Response(body, status=status, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+def conditional_json(build, etag=None, last_modified=None):
+    """
+    条件 GET：客户端缓存仍然有效时直接返回 304，否则调用 build() 生成内容
+
+    Args:
+        build: 返回响应内容的函数（返回 304 时不调用，省去序列化和压缩）
+    """
+    if is_not_modified(etag, last_modified):
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+        _set_validators(response, etag, last_modified)
+        return response
+    return json_response(build(), etag, last_modified)
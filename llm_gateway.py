@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大模型调用网关
+所有 OpenAI 兼容的提供方（通义千问兼容模式、Ollama、智谱、DeepSeek）共用一个网关：
+每个提供方一个长连接池和令牌桶限速，网关限制同时进行的请求数；
+请求失败时按优先级切换到下一个提供方，超过延迟阈值时向下一个提供方发起对冲请求，
+先返回的结果胜出。只依赖标准库，可以指向本地的模拟 HTTP 服务测试
+"""
+
+import concurrent.futures
+import http.client
+import json
+import queue
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+# 各提供方的默认接口地址和模型（配置文件中的 base_url / model 优先）
+DEFAULT_BASE_URLS = {
+    'tongyi': 'https://dashscope.aliyuncs.com/compatible-mode/v1',
+    'ollama': 'http://localhost:11434/v1',
+    'zhipu': 'https://open.bigmodel.cn/api/paas/v4',
+    'deepseek': 'https://api.deepseek.com/v1',
+}
+DEFAULT_MODELS = {
+    'tongyi': 'qwen-plus',
+    'ollama': 'qwen2.5',
+    'zhipu': 'glm-4-flash',
+    'deepseek': 'deepseek-chat',
+}
+
+class LLMError(Exception):
+    """大模型调用失败"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积攒 capacity 个"""
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate: 每秒补充的令牌数，0 表示不限速
+            capacity: 桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        尝试取一个令牌
+
+        Returns:
+            0 表示已取得，否则为还需等待的秒数
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """取一个令牌，最多等待 timeout 秒（None 表示一直等），超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < wait:
+                    return False
+            time.sleep(wait)
+
+
+class FairSlots:
+    """先到先得的并发槽位（threading.Semaphore 不保证顺序，排队的请求可能一直抢不到）"""
+
+    def __init__(self, count):
+        self.free = count
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        占用一个槽位，没有空闲槽位时排队等待
+
+        Returns:
+            排队等待的秒数
+        """
+        with self._lock:
+            if self.free and not self._waiters:
+                self.free -= 1
+                return 0.0
+            ready = threading.Event()
+            self._waiters.append(ready)
+        started = time.monotonic()
+        ready.wait()
+        return time.monotonic() - started
+
+    def try_acquire(self):
+        """有空闲槽位且无人排队时占用一个，否则立即返回 False"""
+        with self._lock:
+            if self.free and not self._waiters:
+                self.free -= 1
+                return True
+            return False
+
+    def release(self):
+        """释放槽位：有人排队时直接交给最早排队的请求"""
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self.free += 1
+
+
+class ConnectionPool:
+    """到同一主机的 HTTP 长连接池"""
+
+    def __init__(self, base_url, size=4, timeout=120):
+        """
+        Args:
+            base_url: 接口根地址，如 https://api.deepseek.com/v1
+            size: 最多保留的空闲连接数
+            timeout: 连接和读取超时秒数
+        """
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._ssl_context = ssl.create_default_context() if self.https else None
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def _connect(self):
+        self.stats['created'] += 1
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def set_timeout(conn, timeout):
+        """修改连接（包括已建立的套接字）的超时时间"""
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def request(self, path, payload, headers, timeout=None):
+        """
+        发送 POST 请求并读取响应头
+
+        Args:
+            timeout: 本次请求到响应头返回为止的超时秒数，None 使用连接池默认值
+
+        Returns:
+            (连接, 响应)，读完响应后调用 release()
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = dict(headers, **{'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self._connect()
+                reused = False
+            self.set_timeout(conn, timeout or self.timeout)
+            try:
+                conn.request('POST', self.base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                # 服务端已关闭空闲连接：换一个连接重发
+                if reused:
+                    self.stats['discarded'] += 1
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if reused:
+                self.stats['reused'] += 1
+            return conn, response
+
+    def release(self, conn, response, reusable=True):
+        """归还连接（响应未读完或服务端要求关闭时直接关闭）"""
+        if reusable and not response.will_close and response.isclosed() and self._idle.qsize() < self.size:
+            self.set_timeout(conn, self.timeout)
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Provider:
+    """一个 OpenAI 兼容的大模型提供方"""
+
+    def __init__(self, name, base_url, api_key=None, model=None, rpm=60, burst=5, pool_size=4, timeout=120):
+        """
+        Args:
+            name: 提供方名称
+            base_url: 接口根地址（请求发往 {base_url}/chat/completions）
+            api_key: API 密钥（本地模型可以为空）
+            model: 模型名称
+            rpm: 每分钟最多请求数，0 表示不限
+            burst: 允许的突发请求数
+            pool_size: 长连接池大小
+            timeout: 请求超时秒数
+        """
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.bucket = TokenBucket(rpm / 60, burst)
+        self.pool = ConnectionPool(base_url, pool_size, timeout)
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'ok': 0,
+            'errors': 0,
+            'rate_limited': 0,
+            'in_flight': 0,
+            'total_seconds': 0.0,
+            'last_error': None
+        }
+
+    @classmethod
+    def from_config(cls, name, config, rpm=60, pool_size=4, timeout=120):
+        """
+        根据提供方配置文件创建（没有可用的接口地址或密钥时返回 None）
+
+        Args:
+            config: 配置字典，支持 base_url/api_base、api_key、model、rpm、burst、timeout
+        """
+        base_url = config.get('base_url') or config.get('api_base') or DEFAULT_BASE_URLS.get(name)
+        api_key = config.get('api_key')
+        if not base_url or (not api_key and name != 'ollama' and 'base_url' not in config):
+            return None
+        return cls(
+            name, base_url, api_key,
+            model=config.get('model') or DEFAULT_MODELS.get(name),
+            rpm=config.get('rpm', rpm),
+            burst=config.get('burst', 5),
+            pool_size=pool_size,
+            timeout=config.get('timeout', timeout)
+        )
+
+    def _headers(self):
+        headers = {'Accept': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        return headers
+
+    def _payload(self, messages, max_tokens, stream):
+        payload = {'model': self.model, 'messages': messages, 'stream': stream}
+        if max_tokens:
+            payload['max_tokens'] = max_tokens
+        return payload
+
+    def _check(self, response):
+        """非 200 响应转换为 LLMError"""
+        if response.status == 200:
+            return
+        detail = response.read()[:300].decode('utf-8', 'replace')
+        raise LLMError(f'{self.name} 返回 HTTP {response.status}: {detail}', status=response.status)
+
+    def _record(self, started, error=None, cancelled=False):
+        with self._lock:
+            self.stats['in_flight'] -= 1
+            if cancelled:
+                return
+            self.stats['total_seconds'] += time.monotonic() - started
+            if error is None:
+                self.stats['ok'] += 1
+            else:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(error)[:300]
+
+    def note_rate_limited(self):
+        with self._lock:
+            self.stats['rate_limited'] += 1
+
+    def _begin(self):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['in_flight'] += 1
+        return time.monotonic()
+
+    def chat(self, messages, max_tokens=None):
+        """一次性请求，返回完整回复"""
+        started = self._begin()
+        conn = None
+        try:
+            conn, response = self.pool.request(
+                '/chat/completions', self._payload(messages, max_tokens, False), self._headers()
+            )
+            self._check(response)
+            data = json.loads(response.read())
+            self.pool.release(conn, response)
+            conn = None
+            content = data['choices'][0]['message']['content']
+        except Exception as e:
+            if conn is not None:
+                # 错误响应已完整读取时连接仍可复用
+                self.pool.release(conn, response, reusable=isinstance(e, LLMError))
+            self._record(started, e)
+            raise
+        self._record(started)
+        return content
+
+    def chat_stream(self, messages, max_tokens=None, first_token_timeout=None):
+        """
+        流式请求，逐段返回回复
+
+        Args:
+            first_token_timeout: 等待第一段内容的超时秒数（超时抛出 socket.timeout），None 不单独限制
+        """
+        started = self._begin()
+        conn = response = None
+        finished = False
+        error = None
+        try:
+            conn, response = self.pool.request(
+                '/chat/completions', self._payload(messages, max_tokens, True),
+                dict(self._headers(), Accept='text/event-stream'), timeout=first_token_timeout
+            )
+            self._check(response)
+            first = True
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    # 读完剩余内容，连接才能复用
+                    response.read()
+                    break
+                delta = json.loads(data)['choices'][0].get('delta') or {}
+                piece = delta.get('content')
+                if piece:
+                    if first:
+                        ConnectionPool.set_timeout(conn, self.pool.timeout)
+                        first = False
+                    yield piece
+            finished = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if conn is not None:
+                if finished or isinstance(error, LLMError):
+                    self.pool.release(conn, response)
+                else:
+                    # 调用方中途放弃或出错：响应没读完，连接不能复用
+                    conn.close()
+            # 未完成也没有异常说明调用方提前关闭了生成器
+            self._record(started, error, cancelled=not finished and error is None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        requests = stats['ok'] + stats['errors']
+        stats['avg_seconds'] = round(stats.pop('total_seconds') / requests, 3) if requests else None
+        stats['pool'] = dict(self.pool.stats)
+        stats['model'] = self.model
+        return stats
+
+
+class LLMGateway:
+    """
+    多提供方大模型网关
+
+    与原有客户端接口一致：chat() 失败时返回 None，chat_stream() 逐段返回内容
+    """
+
+    def __init__(self, providers, max_concurrency=4, hedge_after=0, max_rate_wait=30, on_result=None):
+        """
+        Args:
+            providers: 按优先级排列的 Provider 列表
+            max_concurrency: 同时进行的请求数上限（超出的请求排队）
+            hedge_after: 延迟阈值秒数，chat() 超过后向下一个提供方发起对冲请求（没有空闲槽位时不对冲），
+                         chat_stream() 超过后仍无内容则切换到下一个提供方；0 表示只在出错时切换
+            max_rate_wait: 所有提供方都被限速时最多等待的秒数
+            on_result: 每次提供方请求结束后调用 on_result(提供方名称, 'ok'/'error', 耗时秒数)
+        """
+        self.providers = list(providers)
+        self.max_concurrency = max(1, max_concurrency)
+        self.hedge_after = hedge_after
+        self.max_rate_wait = max_rate_wait
+        self.on_result = on_result
+        # 每个发往提供方的请求（包括对冲请求）占用一个槽位，直到该请求结束
+        self._slots = FairSlots(self.max_concurrency)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix='llm'
+        )
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'failed': 0, 'failovers': 0, 'hedges': 0, 'hedge_wins': 0,
+                      'hedges_skipped': 0, 'queued': 0, 'queued_seconds': 0.0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _acquire_slot(self):
+        waited = self._slots.acquire()
+        if waited:
+            self._count('queued')
+            self._count('queued_seconds', waited)
+
+    def _take_token(self, provider, last):
+        """取提供方的令牌：还有其他提供方可选时不等待，最后一个提供方最多等待 max_rate_wait 秒"""
+        if provider.bucket.acquire(timeout=self.max_rate_wait if last else 0):
+            return True
+        provider.note_rate_limited()
+        return False
+
+    def _report(self, provider, outcome, started):
+        if self.on_result:
+            self.on_result(provider.name, outcome, time.monotonic() - started)
+
+    def _call(self, provider, messages, max_tokens):
+        started = time.monotonic()
+        try:
+            result = provider.chat(messages, max_tokens)
+        except Exception:
+            self._report(provider, 'error', started)
+            raise
+        self._report(provider, 'ok', started)
+        return result
+
+    def chat(self, messages, max_tokens=None):
+        """
+        一次性请求
+
+        Returns:
+            回复内容，所有提供方都失败时返回 None
+        """
+        self._count('requests')
+        return self._chat(messages, max_tokens)
+
+    def _chat(self, messages, max_tokens):
+        remaining = list(self.providers)
+        pending = {}
+        launched = []
+        errors = []
+        hedging = bool(self.hedge_after)
+
+        def launch(hedge=False):
+            # 对冲请求不排队：没有空闲槽位时放弃对冲，继续等待已发出的请求
+            if hedge:
+                if not self._slots.try_acquire():
+                    self._count('hedges_skipped')
+                    return False
+            else:
+                self._acquire_slot()
+            while remaining:
+                provider = remaining.pop(0)
+                if self._take_token(provider, last=not remaining and not pending):
+                    future = self._executor.submit(self._call, provider, messages, max_tokens)
+                    # 落后的请求在后台结束时才归还槽位，提供方侧的并发始终不超过 max_concurrency
+                    future.add_done_callback(lambda _: self._slots.release())
+                    pending[future] = provider
+                    launched.append(provider)
+                    return True
+            self._slots.release()
+            return False
+
+        launch()
+        while pending:
+            timeout = self.hedge_after if hedging and remaining else None
+            done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                # 超过延迟阈值：向下一个提供方发起对冲请求，先返回的胜出
+                if launch(hedge=True):
+                    self._count('hedges')
+                else:
+                    # 槽位已满或其余提供方都被限速：本次请求不再对冲，等已发出的请求结束
+                    hedging = False
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f'{provider.name}: {e}')
+                    continue
+                if result:
+                    if pending and provider is not launched[0]:
+                        # 对冲请求先返回：落后的请求在后台结束，连接归还连接池
+                        self._count('hedge_wins')
+                    return result
+                errors.append(f'{provider.name}: 空回复')
+            if not pending and launch():
+                self._count('failovers')
+
+        self._count('failed')
+        print(f"⚠ 所有大模型提供方均调用失败: {'; '.join(errors) or '全部被限速'}")
+        return None
+
+    def chat_stream(self, messages, max_tokens=None):
+        """
+        流式请求：第一段内容返回前出错或超过延迟阈值时切换到下一个提供方，
+        已经输出内容后出错则直接抛出（不能把两个提供方的回复拼在一起）
+        """
+        self._count('requests')
+        self._acquire_slot()
+        try:
+            errors = []
+            for i, provider in enumerate(self.providers):
+                last = i == len(self.providers) - 1
+                if not self._take_token(provider, last):
+                    continue
+                if errors:
+                    self._count('failovers')
+                started = time.monotonic()
+                stream = provider.chat_stream(
+                    messages, max_tokens, first_token_timeout=None if last else (self.hedge_after or None)
+                )
+                produced = False
+                try:
+                    for piece in stream:
+                        produced = True
+                        yield piece
+                except Exception as e:
+                    self._report(provider, 'error', started)
+                    if produced:
+                        self._count('failed')
+                        raise
+                    errors.append(f'{provider.name}: {"首段内容超时" if isinstance(e, socket.timeout) else e}')
+                    continue
+                finally:
+                    stream.close()
+                self._report(provider, 'ok', started)
+                return
+            self._count('failed')
+            raise LLMError(f"所有大模型提供方均调用失败: {'; '.join(errors) or '全部被限速'}")
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """关闭所有连接池"""
+        for provider in self.providers:
+            provider.pool.close()
+
+    def get_stats(self):
+        """获取网关和各提供方的统计"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queued_seconds'] = round(stats['queued_seconds'], 3)
+        stats['max_concurrency'] = self.max_concurrency
+        stats['hedge_after'] = self.hedge_after
+        stats['providers'] = {provider.name: provider.get_stats() for provider in self.providers}
+        return stats
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+进程内的计数器、仪表和耗时直方图，以 Prometheus 文本格式导出（/metrics）；
+关闭后记录操作直接返回，热路径上几乎没有开销
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认耗时分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    """转义标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """带标签的指标基类"""
+
+    kind = 'untyped'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+    def samples(self):
+        """[(后缀, 标签字典, 值), ...]"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器（名称以 _total 结尾）"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """仪表：导出时调用回调函数取当前值"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, fn):
+        """
+        Args:
+            fn: 返回数值，或 [(标签字典, 数值), ...]
+        """
+        super().__init__(registry, name, help_text)
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, (list, tuple)):
+            return [('', dict(labels), v) for labels, v in value]
+        return [('', {}, value)]
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 每个桶只记本桶的次数，导出时再累加
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文：with histogram.time(stage='x'): ..."""
+        if not self.registry.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                result.append(('_bucket', dict(labels, le=_format_value(float(bound))), cumulative))
+            result.append(('_sum', labels, total))
+            result.append(('_count', labels, count))
+        return result
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def gauge(self, name, help_text, fn):
+        return self._register(Gauge(self, name, help_text, fn))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """
+        导出当前所有指标（可 JSON 序列化，供其他进程合并导出）
+
+        Returns:
+            [{'name', 'help', 'type', 'samples': [[后缀, 标签字典, 值], ...]}, ...]
+        """
+        if not self.enabled:
+            return []
+        return [
+            {'name': m.name, 'help': m.help, 'type': m.kind, 'samples': [list(s) for s in m.samples()]}
+            for m in self._metrics
+        ]
+
+    def render(self, sources=()):
+        """
+        生成 Prometheus 文本格式
+
+        Args:
+            sources: 额外合并的 [(snapshot() 的结果, 附加标签字典), ...]，如监听进程的指标
+        """
+        families = {}
+        for snapshot, extra_labels in [(self.snapshot(), {})] + list(sources):
+            for family in snapshot or []:
+                merged = families.setdefault(family['name'], {
+                    'help': family['help'], 'type': family['type'], 'samples': []
+                })
+                for suffix, labels, value in family['samples']:
+                    merged['samples'].append((suffix, dict(extra_labels, **labels), value))
+
+        lines = []
+        for name, family in families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for suffix, labels, value in family['samples']:
+                lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+总结提示词打包
+在 token 预算内挑选要发送给 AI 的消息：去掉非文本占位符和近似重复的消息，
+按时间新旧和发送者多样性排序，尽量填满预算
+"""
+
+import heapq
+import re
+
+# 非文本消息占位符（与消息处理器保存的一致）
+NON_TEXT_PLACEHOLDER = '[非文本消息]'
+
+_CJK_RE = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+_URL_RE = re.compile(r'https?://\S+')
+_NOISE_RE = re.compile(r'[\W\d_]+', re.UNICODE)
+
+
+def estimate_tokens(text):
+    """
+    估算文本的 token 数
+
+    中日韩字符大约每字 1 个 token，其他字符大约每 4 个字符 1 个 token
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _dedup_key(text):
+    """近似重复判断用的归一化文本：忽略大小写、链接、数字、标点和空白"""
+    text = _URL_RE.sub('', text.lower())
+    return _NOISE_RE.sub('', text)[:200]
+
+
+def pack_messages(messages, token_budget, format_line):
+    """
+    在 token 预算内挑选消息
+
+    Args:
+        messages: 消息列表（最新的在前）
+        token_budget: 可用于消息内容的 token 数
+        format_line: 把一条消息格式化为一行文本的函数
+
+    Returns:
+        (选中的消息列表（保持原顺序）, 统计字典)
+    """
+    stats = {
+        'total': len(messages),
+        'used': 0,
+        'dropped_non_text': 0,
+        'dropped_duplicates': 0,
+        'dropped_budget': 0,
+        'estimated_tokens': 0,
+        'token_budget': token_budget
+    }
+
+    # 过滤非文本占位符和近似重复的消息（保留最新的一条）
+    candidates = []
+    seen = set()
+    for index, msg in enumerate(messages):
+        text = (msg.get('message_text') or '').strip()
+        if not text or text == NON_TEXT_PLACEHOLDER:
+            stats['dropped_non_text'] += 1
+            continue
+        key = _dedup_key(text) or text
+        if key in seen:
+            stats['dropped_duplicates'] += 1
+            continue
+        seen.add(key)
+        line = format_line(msg)
+        candidates.append((index, msg, estimate_tokens(line) + 1))  # +1 为换行符
+
+    # 按发送者分组，每组内按新旧排序
+    by_sender = {}
+    for candidate in candidates:
+        sender = candidate[1].get('sender_id') or candidate[1].get('sender_username') or candidate[1].get('sender_name')
+        by_sender.setdefault(sender, []).append(candidate)
+
+    # 轮流从各发送者中取最新的消息：已选条数少的发送者优先，其次是更新的消息
+    heap = [(0, queue[0][0], sender, 0) for sender, queue in by_sender.items()]
+    heapq.heapify(heap)
+    selected = []
+    remaining = token_budget
+    while heap:
+        taken, index, sender, position = heapq.heappop(heap)
+        queue = by_sender[sender]
+        _, msg, tokens = queue[position]
+        if tokens <= remaining:
+            selected.append((index, msg))
+            remaining -= tokens
+            taken += 1
+        else:
+            stats['dropped_budget'] += 1
+        if position + 1 < len(queue):
+            heapq.heappush(heap, (taken, queue[position + 1][0], sender, position + 1))
+
+    selected.sort(key=lambda item: item[0])
+    stats['used'] = len(selected)
+    stats['estimated_tokens'] = token_budget - remaining
+    return [msg for _, msg in selected], stats
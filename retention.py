@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息保留策略
+后台按群组清理消息库中超出条数上限或超过保留天数的消息：先把消息追加到按月分文件的
+gzip 归档（archive/YYYY-MM.jsonl.gz，仍可按群组、时间和关键词查询），再分批删除，
+每批一个短事务，最后增量归还空闲页，不阻塞消息写入
+
+消息库需要提供 STORE_METHODS 中的计数、选取和删除接口（见 RetentionEngine.__init__），
+缺少时 check() 抛出异常，由启动流程报错退出，而不是静默地只清理一部分数据
+"""
+
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# 消息库必须提供的接口：按群组计数、按时间从旧到新选取应清理的消息、按消息ID删除
+STORE_METHODS = ('get_group_stats', 'get_prunable_messages', 'delete_messages')
+
+
+def _month_of(ts):
+    return datetime.fromtimestamp(ts or 0, timezone.utc).strftime('%Y-%m')
+
+
+def _message_ts(msg):
+    """消息的纪元秒：优先 message_ts，其次解析 message_date，都没有返回 0"""
+    if msg.get('message_ts') is not None:
+        return msg['message_ts']
+    message_date = msg.get('message_date')
+    try:
+        if isinstance(message_date, str):
+            message_date = datetime.fromisoformat(message_date.replace('Z', '+00:00'))
+        if isinstance(message_date, datetime):
+            if message_date.tzinfo is None:
+                message_date = message_date.replace(tzinfo=timezone.utc)
+            return int(message_date.timestamp())
+    except ValueError:
+        pass
+    return 0
+
+
+class MessageArchive:
+    """按月分文件的压缩消息归档"""
+
+    def __init__(self, archive_dir='archive'):
+        """
+        初始化归档
+
+        Args:
+            archive_dir: 归档目录
+        """
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+
+    def _path(self, month):
+        return os.path.join(self.archive_dir, f'{month}.jsonl.gz')
+
+    def append(self, messages):
+        """
+        追加一批消息（每次追加写入一个新的 gzip 成员，已有内容不用重新压缩）
+
+        Returns:
+            写入的条数
+        """
+        by_month = {}
+        for msg in messages:
+            msg = {key: value for key, value in msg.items() if key != 'id'}
+            # 数据库中的消息只有 message_date，归档时补上 message_ts 供按时间查询
+            msg['message_ts'] = _message_ts(msg)
+            by_month.setdefault(_month_of(msg['message_ts']), []).append(msg)
+
+        with self._lock:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            for month, rows in by_month.items():
+                with gzip.open(self._path(month), 'at', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+        return len(messages)
+
+    def months(self):
+        """已有归档的月份（从新到旧）"""
+        paths = glob.glob(os.path.join(self.archive_dir, '*.jsonl.gz'))
+        return sorted((os.path.basename(path)[:-len('.jsonl.gz')] for path in paths), reverse=True)
+
+    def query(self, chat_username=None, since_ts=None, until_ts=None, text=None, limit=100):
+        """
+        查询归档消息（只读取时间范围涉及的月份）
+
+        Args:
+            chat_username: 群组用户名（不带@），None 表示全部群组
+            since_ts: 起始时间（纪元秒，包含）
+            until_ts: 结束时间（纪元秒，不包含）
+            text: 消息内容包含的关键词（不区分大小写）
+            limit: 最多返回的条数
+
+        Returns:
+            消息字典列表（最新的在前）
+        """
+        first_month = _month_of(since_ts) if since_ts is not None else None
+        last_month = _month_of(until_ts) if until_ts is not None else None
+        chat_username = chat_username.lower() if chat_username else None
+        text = text.lower() if text else None
+
+        results = []
+        for month in self.months():
+            if last_month and month > last_month:
+                continue
+            if first_month and month < first_month:
+                break
+            seen = set()
+            matches = []
+            with gzip.open(self._path(month), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    msg = json.loads(line)
+                    ts = msg.get('message_ts') or 0
+                    if since_ts is not None and ts < since_ts:
+                        continue
+                    if until_ts is not None and ts >= until_ts:
+                        continue
+                    if chat_username and (msg.get('chat_username') or '').lower() != chat_username:
+                        continue
+                    if text and text not in (msg.get('message_text') or '').lower():
+                        continue
+                    # 归档后删除前中断会导致重复归档，按消息去重
+                    key = (msg.get('chat_id'), msg.get('message_id'))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    matches.append(msg)
+            matches.sort(key=lambda msg: msg.get('message_ts') or 0, reverse=True)
+            results.extend(matches)
+            # 月份从新到旧遍历，够数后就不用再读更旧的月份
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+
+class RetentionEngine:
+    """按群组执行条数和天数上限的后台清理"""
+
+    def __init__(self, store, archive, max_rows=0, max_age_days=0, chunk_size=500, pause=0.05, mirrors=()):
+        """
+        初始化保留策略
+
+        消息库（store）需要提供:
+            get_group_stats(): 每个群组一行，至少含 chat_id 和 message_count
+            get_prunable_messages(chat_id, keep_rows, before_ts, limit): 按时间从旧到新返回最多 limit 条
+                应清理的消息（最新 keep_rows 条之外的，以及早于 before_ts 的，包括非文本消息）
+            delete_messages(chat_id, message_ids): 在一个事务内删除这些消息
+            incremental_vacuum()（可选）: 归还空闲页，返回是否支持
+
+        Args:
+            store: 消息库（通常是数据库管理器）
+            archive: MessageArchive，None 表示直接删除不归档
+            max_rows: 每个群组最多保留的条数，0 表示不限
+            max_age_days: 消息最多保留的天数，0 表示不限
+            chunk_size: 每批删除的条数
+            pause: 每批之间暂停的秒数（让出写锁给消息写入）
+            mirrors: 需要同步删除的派生存储（如全文搜索索引），提供 delete_messages(chat_id, message_ids)，
+                可选 incremental_vacuum()
+        """
+        self.store = store
+        self.archive = archive
+        self.max_rows = max_rows
+        self.max_age_days = max_age_days
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.mirrors = list(mirrors)
+        self.stats = {
+            'runs': 0,
+            'running': False,
+            'deleted': 0,
+            'archived': 0,
+            'vacuum_supported': None,
+            'last_run_at': None,
+            'last_run_seconds': None,
+            'last_error': None
+        }
+
+    @property
+    def enabled(self):
+        return bool(self.max_rows or self.max_age_days)
+
+    def check(self):
+        """
+        检查消息库是否提供清理所需的接口
+
+        Raises:
+            RuntimeError: 启用了保留策略但消息库缺少接口
+        """
+        if not self.enabled:
+            return
+        missing = [name for name in STORE_METHODS if not hasattr(self.store, name)]
+        if missing:
+            # 延迟构建的代理（Lazy）报告被代理的实例的类名
+            store = getattr(self.store, 'instance', lambda: self.store)()
+            raise RuntimeError(
+                f"消息库缺少保留策略需要的接口: {', '.join(missing)}"
+                f"（{type(store).__name__} 需要实现这些方法，或关闭 --max-messages-per-group/--retention-days）"
+            )
+
+    def _prune_chat(self, chat_id, before_ts):
+        """分批清理一个群组，返回删除的条数"""
+        deleted = 0
+        while True:
+            batch = self.store.get_prunable_messages(chat_id, self.max_rows, before_ts, self.chunk_size)
+            if not batch:
+                break
+            # 先归档再删除：中断时最多重复归档，不会丢消息
+            if self.archive is not None:
+                self.stats['archived'] += self.archive.append(batch)
+            message_ids = [msg['message_id'] for msg in batch]
+            self.store.delete_messages(chat_id, message_ids)
+            for mirror in self.mirrors:
+                mirror.delete_messages(chat_id, message_ids)
+            deleted += len(batch)
+            self.stats['deleted'] += len(batch)
+            time.sleep(self.pause)
+            if len(batch) < self.chunk_size:
+                break
+        return deleted
+
+    def run_once(self):
+        """
+        执行一轮清理
+
+        Returns:
+            本轮删除的条数
+        """
+        if not self.enabled:
+            return 0
+        started = time.monotonic()
+        self.stats['running'] = True
+        self.stats['last_run_at'] = datetime.now().isoformat()
+        before_ts = int(time.time()) - self.max_age_days * 86400 if self.max_age_days else None
+        deleted = 0
+        try:
+            for row in self.store.get_group_stats():
+                # 只按条数清理时，没有超出上限的群组不用查询
+                if before_ts is None and (row.get('message_count') or 0) <= self.max_rows:
+                    continue
+                deleted += self._prune_chat(row['chat_id'], before_ts)
+            if deleted:
+                if hasattr(self.store, 'incremental_vacuum'):
+                    self.stats['vacuum_supported'] = bool(self.store.incremental_vacuum())
+                for mirror in self.mirrors:
+                    if hasattr(mirror, 'incremental_vacuum'):
+                        mirror.incremental_vacuum()
+            self.stats['last_error'] = None
+        except Exception as e:
+            self.stats['last_error'] = str(e)
+            print(f"⚠ 清理旧消息失败: {e}")
+        finally:
+            self.stats['runs'] += 1
+            self.stats['running'] = False
+            self.stats['last_run_seconds'] = round(time.monotonic() - started, 3)
+        if deleted:
+            print(f"[保留策略] 已归档并删除 {deleted} 条旧消息")
+        return deleted
+
+    def start(self, interval):
+        """启动后台线程，每 interval 秒执行一轮"""
+        def run():
+            while True:
+                self.run_once()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='retention', daemon=True)
+        thread.start()
+        return thread
+
+    def get_stats(self):
+        """获取清理统计"""
+        return dict(self.stats, max_rows=self.max_rows, max_age_days=self.max_age_days)
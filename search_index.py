@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息全文搜索索引
+基于 SQLite FTS5（trigram 分词，支持中文子串搜索），由消息写入线程同步更新，
+支持按群组、发送者和时间范围过滤，结果按相关度排序并带高亮片段；
+trigram 无法索引的一两个字的词（大多数中文词）由另一张二元组索引缩小范围；
+保留策略从消息库删除消息时同步从索引中删除
+"""
+
+import html
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# trigram 分词只能索引长度 >= 3 的词，更短的词先用二元组索引筛选候选，再用 LIKE 精确匹配
+MIN_FTS_TERM_LENGTH = 3
+
+# 二元组索引按连续的字母、数字和汉字切分（与 unicode61 分词的词边界一致）
+_RUN_RE = re.compile(r'[^\W_]+')
+
+# 高亮标记先用私用区字符占位，HTML 转义之后再换成 <mark> 标签（消息原文不会被当作 HTML）
+_MARK_OPEN = '\ue000'
+_MARK_CLOSE = '\ue001'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS search_messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    chat_title TEXT,
+    chat_username TEXT COLLATE NOCASE,
+    sender_id INTEGER,
+    sender_username TEXT COLLATE NOCASE,
+    sender_name TEXT,
+    message_text TEXT NOT NULL,
+    message_date TEXT,
+    message_ts INTEGER,
+    UNIQUE (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_search_messages_chat_ts ON search_messages (chat_username, message_ts);
+CREATE INDEX IF NOT EXISTS idx_search_messages_ts ON search_messages (message_ts);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message_text,
+    content='search_messages',
+    content_rowid='id',
+    tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS search_messages_ai AFTER INSERT ON search_messages BEGIN
+    INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+END;
+CREATE TRIGGER IF NOT EXISTS search_messages_ad AFTER DELETE ON search_messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+END;
+
+-- 短词索引：每条消息的相邻两字和每段的最后一个字，不保存原文
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_bigram USING fts5(
+    grams,
+    content='',
+    tokenize='unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS search_messages_bigram_ai AFTER INSERT ON search_messages BEGIN
+    INSERT INTO messages_bigram (rowid, grams) VALUES (new.id, search_bigrams(new.message_text));
+END;
+CREATE TRIGGER IF NOT EXISTS search_messages_bigram_ad AFTER DELETE ON search_messages BEGIN
+    INSERT INTO messages_bigram (messages_bigram, rowid, grams) VALUES ('delete', old.id, search_bigrams(old.message_text));
+END;
+'''
+
+_COLUMNS = [
+    'chat_id', 'message_id', 'chat_title', 'chat_username', 'sender_id',
+    'sender_username', 'sender_name', 'message_text', 'message_date', 'message_ts'
+]
+
+
+class SearchIndex:
+    """消息全文搜索索引"""
+
+    def __init__(self, db_path='search_index.db'):
+        """
+        初始化索引
+
+        Args:
+            db_path: 索引数据库文件路径
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._connect()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if not tables:
+            # 新数据库：开启增量清理，删除消息后可以分批归还空闲页而不用整库 VACUUM
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+        conn.executescript(SCHEMA)
+        if 'search_messages' in tables and 'messages_bigram' not in tables:
+            # 旧版索引没有短词索引：为已有消息补建
+            conn.execute(
+                'INSERT INTO messages_bigram (rowid, grams) '
+                'SELECT id, search_bigrams(message_text) FROM search_messages'
+            )
+        conn.commit()
+
+    def _connect(self):
+        """获取当前线程的连接（WAL 模式下读写互不阻塞；fork 后的子进程重新连接）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            # 短词索引的触发器调用，每个连接都要注册
+            conn.create_function('search_bigrams', 1, _bigrams, deterministic=True)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add_messages(self, messages):
+        """
+        在一个事务内把一批消息加入索引（重复消息自动忽略）
+
+        Args:
+            messages: 消息字典列表，字段与数据库保存的消息一致
+        """
+        rows = []
+        for msg in messages:
+            text = msg.get('message_text')
+            if not text or text == '[非文本消息]':
+                continue
+            # 原文中的占位字符会被当作高亮标记，入库前去掉
+            text = text.replace(_MARK_OPEN, '').replace(_MARK_CLOSE, '')
+            message_date = msg.get('message_date')
+            if isinstance(message_date, datetime):
+                message_date = message_date.isoformat()
+            message_ts = msg.get('message_ts')
+            if message_ts is None and message_date:
+                # 从数据库读出的旧消息只有 message_date（重建索引时）
+                try:
+                    parsed = datetime.fromisoformat(str(message_date).replace('Z', '+00:00'))
+                    if parsed.tzinfo is None:
+                        parsed = parsed.replace(tzinfo=timezone.utc)
+                    message_ts = int(parsed.timestamp())
+                except ValueError:
+                    message_ts = None
+            row = [msg.get(column) for column in _COLUMNS]
+            row[_COLUMNS.index('message_text')] = text
+            row[_COLUMNS.index('message_date')] = message_date
+            row[_COLUMNS.index('message_ts')] = message_ts
+            rows.append(row)
+        if not rows:
+            return 0
+
+        conn = self._connect()
+        with self._write_lock, conn:
+            cursor = conn.executemany(
+                f"INSERT OR IGNORE INTO search_messages ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                rows
+            )
+            return cursor.rowcount
+
+    def search(self, query, chat_username=None, sender=None, since_ts=None, until_ts=None, limit=50, offset=0):
+        """
+        搜索消息
+
+        Args:
+            query: 搜索词，空格分隔的多个词之间为"且"关系
+            chat_username: 群组用户名（不带@），None 表示全部群组
+            sender: 发送者用户名、显示名或 ID
+            since_ts: 起始时间（纪元秒，包含）
+            until_ts: 结束时间（纪元秒，不包含）
+            limit: 最多返回的结果数
+            offset: 跳过的结果数
+
+        Returns:
+            结果字典列表（含 snippet 高亮片段和 rank 相关度，rank 越小越相关）
+        """
+        terms = [term for term in (query or '').split() if term]
+        fts_terms = [term for term in terms if len(term) >= MIN_FTS_TERM_LENGTH]
+        like_terms = [term for term in terms if len(term) < MIN_FTS_TERM_LENGTH]
+
+        where = []
+        params = []
+        if fts_terms:
+            # 每个词作为短语查询，避免 FTS5 语法字符被解析
+            where.append('messages_fts MATCH ?')
+            params.append(' '.join('"' + term.replace('"', '""') + '"' for term in fts_terms))
+        bigram_query = ' '.join(_bigram_query(term) for term in like_terms).strip()
+        if bigram_query:
+            # 先用短词索引筛选候选消息，LIKE 只检查这些候选（标点等无法索引的字符也由 LIKE 保证）
+            where.append('m.id IN (SELECT rowid FROM messages_bigram WHERE messages_bigram MATCH ?)')
+            params.append(bigram_query)
+        for term in like_terms:
+            where.append("m.message_text LIKE ? ESCAPE '\\'")
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f'%{escaped}%')
+        if chat_username:
+            where.append('m.chat_username = ?')
+            params.append(chat_username)
+        if sender:
+            sender = sender.lstrip('@')
+            if sender.lstrip('-').isdigit():
+                where.append('m.sender_id = ?')
+                params.append(int(sender))
+            else:
+                where.append('(m.sender_username = ? OR m.sender_name = ?)')
+                params.extend([sender, sender])
+        if since_ts is not None:
+            where.append('m.message_ts >= ?')
+            params.append(since_ts)
+        if until_ts is not None:
+            where.append('m.message_ts < ?')
+            params.append(until_ts)
+
+        if fts_terms:
+            sql = f'''
+                SELECT m.*, snippet(messages_fts, 0, '{_MARK_OPEN}', '{_MARK_CLOSE}', '…', 24) AS snippet,
+                       bm25(messages_fts) AS rank
+                FROM messages_fts JOIN search_messages m ON m.id = messages_fts.rowid
+                WHERE {' AND '.join(where)}
+                ORDER BY rank, m.message_ts DESC
+                LIMIT ? OFFSET ?
+            '''
+        else:
+            # 没有可用于全文索引的词时按时间倒序返回
+            sql = f'''
+                SELECT m.*, NULL AS snippet, NULL AS rank
+                FROM search_messages m
+                {'WHERE ' + ' AND '.join(where) if where else ''}
+                ORDER BY m.message_ts DESC
+                LIMIT ? OFFSET ?
+            '''
+        params.extend([limit, offset])
+
+        results = []
+        for row in self._connect().execute(sql, params):
+            result = dict(row)
+            result.pop('id', None)
+            if result['snippet'] is None:
+                result['snippet'] = _highlight(result['message_text'], like_terms)
+            else:
+                result['snippet'] = _render_marks(result['snippet'], like_terms)
+            results.append(result)
+        return results
+
+    def delete_messages(self, chat_id, message_ids):
+        """在一个事务内删除一个群组的一批消息（保留策略从消息库删除后同步调用）"""
+        if not message_ids:
+            return 0
+        conn = self._connect()
+        with self._write_lock, conn:
+            cursor = conn.execute(
+                f"DELETE FROM search_messages WHERE chat_id = ? AND message_id IN ({', '.join('?' * len(message_ids))})",
+                [chat_id, *message_ids]
+            )
+            return cursor.rowcount
+
+    def incremental_vacuum(self, pages=1000):
+        """
+        归还最多 pages 个空闲页
+
+        Returns:
+            是否支持增量清理（在开启该功能之前创建的数据库不支持）
+        """
+        conn = self._connect()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return False
+        with self._write_lock:
+            # execute() 只执行一步（只归还一页），executescript() 才会执行到底
+            conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        return True
+
+    def get_stats(self):
+        """获取索引统计"""
+        count = self._connect().execute('SELECT COUNT(*) FROM search_messages').fetchone()[0]
+        return {'indexed_messages': count}
+
+
+def _bigrams(text):
+    """短词索引的内容：每段连续字母、数字或汉字的相邻两字，以及该段的最后一个字"""
+    grams = []
+    for run in _RUN_RE.findall(text or ''):
+        grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+        grams.append(run[-1])
+    return ' '.join(grams)
+
+
+def _bigram_query(term):
+    """
+    短词对应的短词索引查询：两个字的段按二元组匹配，一个字的段按前缀匹配
+    （每个字都是某个二元组的开头或某段的最后一个字）；不含可索引字符时返回空字符串
+    """
+    parts = []
+    for run in _RUN_RE.findall(term):
+        if len(run) == 1:
+            parts.append(f'"{run}"*')
+        else:
+            parts.extend(f'"{run[i:i + 2]}"' for i in range(len(run) - 1))
+    return ' '.join(parts)
+
+
+def _render_marks(snippet, terms):
+    """
+    生成可直接插入页面的高亮片段：一次正则替换为短词加占位标记（跳过 FTS5 已标记的部分），
+    再转义 HTML，最后把占位标记换成 <mark> 标签
+    """
+    if terms:
+        alternatives = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+        pattern = re.compile(f'({_MARK_OPEN}[^{_MARK_CLOSE}]*{_MARK_CLOSE})|({alternatives})', re.IGNORECASE)
+        snippet = pattern.sub(lambda m: m.group(1) or f'{_MARK_OPEN}{m.group(2)}{_MARK_CLOSE}', snippet)
+    return html.escape(snippet).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>')
+
+
+def _highlight(text, terms, width=120):
+    """为 LIKE 匹配的结果生成高亮片段"""
+    # 原文中的占位字符不能被当作标记
+    text = (text or '').replace(_MARK_OPEN, '').replace(_MARK_CLOSE, '')
+    lowered = text.lower()
+    start = 0
+    for term in terms:
+        index = lowered.find(term.lower())
+        if index >= 0:
+            start = max(0, index - width // 3)
+            break
+    snippet = text[start:start + width]
+    return ('…' if start else '') + _render_marks(snippet, terms) + ('…' if start + width < len(text) else '')
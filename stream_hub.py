@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时消息推送中心
+把消息处理器收到的新消息分发给所有 SSE 订阅者：
+每条事件只序列化一次，每个订阅者有容量有限的缓冲区，
+消费过慢的订阅者会被断开，断线重连时可按 Last-Event-ID 补发
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+
+class Subscriber:
+    """一个 SSE 订阅者"""
+
+    def __init__(self, max_pending, groups=None):
+        self.max_pending = max_pending
+        self.groups = set(groups) if groups else None
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = False
+
+    def wants(self, group):
+        """是否订阅了该群组"""
+        return self.groups is None or group in self.groups
+
+    def offer(self, frame):
+        """
+        放入一个事件帧
+
+        Returns:
+            缓冲区已满时返回 False（调用方应断开该订阅者）
+        """
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                self.closed = True
+                self.dropped = True
+                self.cond.notify()
+                return False
+            self.pending.append(frame)
+            self.cond.notify()
+            return True
+
+    def close(self):
+        """关闭订阅"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class StreamHub:
+    """SSE 事件分发中心"""
+
+    def __init__(self, history_size=1000, max_pending=256):
+        """
+        初始化分发中心
+
+        Args:
+            history_size: 为断线重连保留的最近事件数
+            max_pending: 每个订阅者最多积压的事件数，超过即断开
+        """
+        self.max_pending = max_pending
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.stats = {'published': 0, 'delivered': 0, 'dropped_subscribers': 0}
+
+    def publish(self, event_type, data, group=None):
+        """
+        发布一个事件（不阻塞，可在事件循环中调用）
+
+        Returns:
+            事件ID
+        """
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            # 事件只序列化一次，所有订阅者共享同一个帧
+            frame = f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+            self._history.append((event_id, group, frame))
+            subscribers = [sub for sub in self._subscribers if sub.wants(group)]
+            self.stats['published'] += 1
+
+        delivered = 0
+        dropped = []
+        for sub in subscribers:
+            if sub.offer(frame):
+                delivered += 1
+            else:
+                dropped.append(sub)
+
+        with self._lock:
+            self.stats['delivered'] += delivered
+            self.stats['dropped_subscribers'] += len(dropped)
+            self._subscribers.difference_update(dropped)
+        return event_id
+
+    def subscribe(self, last_event_id=None, groups=None):
+        """
+        新增订阅者，并补发 last_event_id 之后的历史事件
+
+        Args:
+            last_event_id: 客户端收到的最后一个事件ID
+            groups: 只订阅这些群组，None 表示全部
+        """
+        sub = Subscriber(self.max_pending, groups)
+        with self._lock:
+            if last_event_id is not None:
+                oldest = self._history[0][0] if self._history else self._next_id
+                if last_event_id + 1 < oldest:
+                    # 历史已被覆盖，通知客户端重新拉取完整数据
+                    sub.pending.append(f"event: reset\ndata: {json.dumps({'oldest_id': oldest})}\n\n")
+                for event_id, group, frame in self._history:
+                    if event_id > last_event_id and sub.wants(group):
+                        if len(sub.pending) >= sub.max_pending:
+                            break
+                        sub.pending.append(frame)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        """移除订阅者"""
+        sub.close()
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def iter_frames(self, sub, keepalive=15):
+        """
+        逐个产出订阅者的 SSE 帧，空闲时定期发送注释保持连接
+
+        Args:
+            sub: 订阅者
+            keepalive: 保活间隔秒数
+        """
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                with sub.cond:
+                    if not sub.pending and not sub.closed:
+                        sub.cond.wait(timeout=keepalive)
+                    frames = list(sub.pending)
+                    sub.pending.clear()
+                    closed = sub.closed
+                if frames:
+                    yield ''.join(frames)
+                elif not closed:
+                    yield f': keepalive {int(time.time())}\n\n'
+                if closed:
+                    if sub.dropped:
+                        yield 'event: dropped\ndata: {"reason": "slow consumer"}\n\n'
+                    return
+        finally:
+            self.unsubscribe(sub)
+
+    def get_stats(self):
+        """获取分发统计"""
+        with self._lock:
+            return dict(self.stats, subscribers=len(self._subscribers), last_event_id=self._next_id - 1)
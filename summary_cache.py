@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+群组总结缓存
+以 (群组, 天数, 条数, 提示词版本, 最新消息ID) 为键持久化 AI 总结结果，
+没有新消息时直接返回上次的总结，避免重复调用大模型；
+并保存按小时分块的总结，供增量总结合并使用
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def prompt_version(prompt_config):
+    """根据提示词配置计算版本号（配置变化后旧缓存自动失效）"""
+    raw = json.dumps(prompt_config or {}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+class SummaryCache:
+    """基于 SQLite 的总结结果缓存，按存活时间和条数淘汰"""
+
+    def __init__(self, db_path='summary_cache.db', max_entries=500, max_age=7 * 86400):
+        """
+        初始化缓存
+
+        Args:
+            db_path: 缓存数据库文件路径
+            max_entries: 最多保留的缓存条数
+            max_age: 缓存有效秒数
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS summary_cache (
+                cache_key TEXT PRIMARY KEY,
+                group_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                last_used_at INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_summary_cache_last_used ON summary_cache (last_used_at)')
+        conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        """获取当前进程的连接（fork 出的子进程不能复用父进程的连接）"""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(group, since_ts, until_ts, limit, version, last_message_id):
+        """生成缓存键（since_ts/until_ts 为解析后的时间范围，None 表示不限）"""
+        raw = json.dumps([group, since_ts, until_ts, limit, version, last_message_id], ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, cache_key):
+        """
+        读取缓存
+
+        Returns:
+            缓存的结果字典，未命中或已过期返回 None
+        """
+        now = int(time.time())
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT payload, created_at FROM summary_cache WHERE cache_key = ?',
+                (cache_key,)
+            ).fetchone()
+            if row is None or row[1] < now - self.max_age:
+                self.misses += 1
+                return None
+            conn.execute(
+                'UPDATE summary_cache SET last_used_at = ? WHERE cache_key = ?',
+                (now, cache_key)
+            )
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, cache_key, group, payload):
+        """写入缓存，并按存活时间和条数淘汰旧条目"""
+        now = int(time.time())
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO summary_cache (cache_key, group_name, payload, created_at, last_used_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (cache_key, group, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self._evict(now)
+            conn.commit()
+
+    def _evict(self, now):
+        """删除过期条目和超出容量的最久未使用条目（调用方持有锁）"""
+        conn = self._connect()
+        conn.execute('DELETE FROM summary_cache WHERE created_at < ?', (now - self.max_age,))
+        conn.execute('''
+            DELETE FROM summary_cache WHERE cache_key IN (
+                SELECT cache_key FROM summary_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+    def get_stats(self):
+        """获取缓存统计"""
+        with self._lock:
+            size = self._connect().execute('SELECT COUNT(*) FROM summary_cache').fetchone()[0]
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class ChunkSummaryStore:
+    """按小时分块的群组总结，以及每个群组最近一次合并得到的滚动总结"""
+
+    def __init__(self, db_path='summary_cache.db'):
+        """
+        初始化存储
+
+        Args:
+            db_path: 数据库文件路径（可与 SummaryCache 共用）
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_summaries (
+                group_name TEXT NOT NULL,
+                chunk_ts INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                last_message_id INTEGER,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (group_name, chunk_ts)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rolling_summaries (
+                group_name TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                since_ts INTEGER,
+                until_ts INTEGER NOT NULL,
+                last_message_id INTEGER,
+                updated_at INTEGER NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def _connect(self):
+        """获取当前进程的连接（fork 出的子进程不能复用父进程的连接）"""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_chunks(self, group, since_ts, until_ts):
+        """
+        获取时间范围内已保存的分块总结
+
+        Returns:
+            chunk_ts -> 分块字典
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT * FROM chunk_summaries WHERE group_name = ? AND chunk_ts >= ? AND chunk_ts < ? '
+                'ORDER BY chunk_ts',
+                (group, since_ts, until_ts)
+            ).fetchall()
+        return {row['chunk_ts']: dict(row) for row in rows}
+
+    def put_chunk(self, group, chunk_ts, summary, message_count, last_message_id):
+        """保存一个分块总结（没有消息的分块保存为空总结，避免重复查询）"""
+        chunk = {
+            'group_name': group,
+            'chunk_ts': chunk_ts,
+            'summary': summary,
+            'message_count': message_count,
+            'last_message_id': last_message_id,
+            'created_at': int(time.time())
+        }
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO chunk_summaries '
+                '(group_name, chunk_ts, summary, message_count, last_message_id, created_at) '
+                'VALUES (:group_name, :chunk_ts, :summary, :message_count, :last_message_id, :created_at)',
+                chunk
+            )
+            conn.commit()
+        return chunk
+
+    def delete_chunks(self, group, chunk_ts_list):
+        """删除分块总结（对应小时写入了新消息时调用，下次请求重新生成）"""
+        chunk_ts_list = list(chunk_ts_list)
+        if not chunk_ts_list:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                f"DELETE FROM chunk_summaries WHERE group_name = ? AND chunk_ts IN ({', '.join('?' * len(chunk_ts_list))})",
+                [group, *chunk_ts_list]
+            )
+            conn.commit()
+        return cursor.rowcount
+
+    def get_rolling(self, group):
+        """获取群组的滚动总结，不存在返回 None"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT * FROM rolling_summaries WHERE group_name = ?', (group,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def put_rolling(self, group, summary, since_ts, until_ts, last_message_id):
+        """保存群组的滚动总结"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO rolling_summaries '
+                '(group_name, summary, since_ts, until_ts, last_message_id, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (group, summary, since_ts, until_ts, last_message_id, int(time.time()))
+            )
+            conn.commit()
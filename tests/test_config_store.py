@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""config_store：防抖合并写入、外部修改重新加载"""
+
+import json
+import os
+
+from config_store import ConfigStore
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    # 保证 (修改时间, 大小) 与上次不同，不依赖文件系统时间精度
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def make_store(tmp_path, **kwargs):
+    # 防抖时间设得很长，由测试显式调用 flush()，不依赖计时器
+    kwargs.setdefault('debounce', 60)
+    store = ConfigStore(str(tmp_path / 'config.json'), ['default'], **kwargs)
+    store.load()
+    store.flush()
+    return store
+
+
+def test_first_load_writes_default_groups(tmp_path):
+    store = make_store(tmp_path)
+    assert store.groups == ['default']
+    assert read(store.path)['groups'] == ['default']
+
+
+def test_changes_within_debounce_are_coalesced_into_one_write(tmp_path):
+    store = make_store(tmp_path)
+    writes = store.stats['writes']
+
+    assert store.add_groups(['a', 'b', 'a']) == ['a', 'b']
+    assert store.add_groups(['a']) == []
+    assert store.remove_group('default') is True
+    assert store.remove_group('missing') is False
+    assert store.get_stats()['pending'] is True
+    assert read(store.path)['groups'] == ['default']
+
+    store.flush()
+    assert read(store.path)['groups'] == ['a', 'b']
+    assert store.stats['writes'] == writes + 1
+    assert store.stats['coalesced'] == 1
+    assert store.get_stats()['pending'] is False
+
+
+def test_timer_flushes_after_debounce(tmp_path):
+    store = make_store(tmp_path, debounce=0.2)
+    store.add_groups(['a'])
+    timer = store._timer
+    timer.join(5)
+    assert read(store.path)['groups'] == ['default', 'a']
+
+
+def test_external_edit_is_reloaded_and_pending_changes_reapplied(tmp_path):
+    store = make_store(tmp_path)
+    groups = store.groups
+    version = store.version
+    store.add_groups(['mine'])
+
+    write(store.path, {'groups': ['default', 'theirs']})
+    assert store.reload_if_changed() is not None
+    # 列表对象不变，调用方持有的引用也能看到新内容
+    assert groups is store.groups
+    assert store.groups == ['default', 'theirs', 'mine']
+    assert store.version > version
+    assert store.stats['reloads'] == 1
+    assert store.reload_if_changed() is None
+
+    store.flush()
+    assert read(store.path)['groups'] == ['default', 'theirs', 'mine']
+
+
+def test_flush_merges_external_edit_made_after_local_change(tmp_path):
+    store = make_store(tmp_path)
+    store.remove_group('default')
+    write(store.path, {'groups': ['default', 'theirs']})
+
+    store.flush()
+    assert read(store.path)['groups'] == ['theirs']
+
+
+def test_external_edit_before_debounced_flush_keeps_both_sides(tmp_path):
+    group_ids = {}
+    reloaded = []
+
+    def on_change(data):
+        reloaded.append(data)
+        group_ids.update(data.get('group_ids', {}))
+
+    store = make_store(tmp_path, debounce=0.2, extra=lambda: {'group_ids': dict(group_ids)}, on_change=on_change)
+    store.add_groups(['mine'])
+    group_ids['1'] = 'mine'
+    timer = store._timer
+
+    # 防抖写入之前，另一个进程写入了自己的群组和索引
+    write(store.path, {'groups': ['default', 'theirs'], 'group_ids': {'2': 'theirs'}})
+    timer.join(5)
+
+    data = read(store.path)
+    assert data['groups'] == ['default', 'theirs', 'mine']
+    assert data['group_ids'] == {'1': 'mine', '2': 'theirs'}
+    assert len(reloaded) == 1
+    assert group_ids == {'1': 'mine', '2': 'theirs'}
+
+
+def test_extra_fields_are_saved_with_groups(tmp_path):
+    store = make_store(tmp_path, extra=lambda: {'group_ids': {'a': 1}})
+    store.add_groups(['a'])
+    store.flush()
+    data = read(store.path)
+    assert data['group_ids'] == {'a': 1}
+    assert data['groups'] == ['default', 'a']
+
+
+def test_read_only_never_writes(tmp_path):
+    path = tmp_path / 'config.json'
+    store = ConfigStore(str(path), ['default'], read_only=True)
+    store.load()
+    store.add_groups(['a'])
+    store.flush()
+    assert not path.exists()
+    assert store.groups == ['default', 'a']
+
+
+def test_corrupt_file_falls_back_to_defaults(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text('{not json', encoding='utf-8')
+    store = ConfigStore(str(path), ['default'], debounce=60)
+    assert store.load() == {}
+    assert store.groups == ['default']
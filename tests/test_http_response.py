@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""http_response：JSON 序列化、压缩协商和 ETag / Last-Modified 条件请求"""
+
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from flask import Flask
+
+import http_response
+from http_response import MIN_COMPRESS_SIZE, conditional_json, dumps, json_response, make_etag, parse_timestamp
+
+app = Flask(__name__)
+
+MODIFIED = datetime(2026, 1, 2, 3, 4, 5, 600000, tzinfo=timezone.utc)
+HTTP_DATE = 'Fri, 02 Jan 2026 03:04:05 GMT'
+
+
+@pytest.fixture(autouse=True)
+def no_brotli(monkeypatch):
+    # 是否安装 brotli 不影响结果：压缩测试只协商 gzip
+    monkeypatch.setattr(http_response, 'brotli', None)
+
+
+def large_payload():
+    return {'messages': [{'id': i, 'text': '消息内容' * 10} for i in range(50)]}
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_dumps_matches_with_and_without_orjson(monkeypatch, use_orjson):
+    if use_orjson and http_response.orjson is None:
+        pytest.skip('orjson 未安装')
+    if not use_orjson:
+        monkeypatch.setattr(http_response, 'orjson', None)
+    payload = {'text': '你好', 'date': datetime(2026, 1, 2, 3, 4, 5), 1: 'x'}
+    assert json.loads(dumps(payload)) == {'text': '你好', 'date': '2026-01-02T03:04:05', '1': 'x'}
+
+
+def test_make_etag_depends_on_every_part():
+    assert make_etag('group', 10) == make_etag('group', 10)
+    assert make_etag('group', 10) != make_etag('group', 11)
+    assert make_etag('a', 'b') != make_etag('ab')
+
+
+def test_parse_timestamp_assumes_utc_for_naive_values():
+    assert parse_timestamp('2026-01-02T03:04:05Z') == datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert parse_timestamp(datetime(2026, 1, 2)).tzinfo is timezone.utc
+    assert parse_timestamp('not a date') is None
+    assert parse_timestamp(None) is None
+
+
+def test_small_response_is_not_compressed():
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = json_response({'ok': True})
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert json.loads(response.get_data()) == {'ok': True}
+
+
+def test_large_response_is_gzipped_when_accepted():
+    payload = large_payload()
+    assert len(dumps(payload)) >= MIN_COMPRESS_SIZE
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip, deflate'}):
+        response = json_response(payload)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.get_data())) == payload
+
+    with app.test_request_context():
+        response = json_response(payload)
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.get_data()) == payload
+
+
+def test_validators_are_set():
+    with app.test_request_context():
+        response = json_response({'ok': True}, etag='abc', last_modified=MODIFIED)
+    assert response.headers['ETag'] == 'W/"abc"'
+    assert response.headers['Last-Modified'] == HTTP_DATE
+    assert response.cache_control.no_cache
+
+    with app.test_request_context():
+        response = json_response({'ok': True})
+    assert 'ETag' not in response.headers
+    assert not response.cache_control.no_cache
+
+
+def test_matching_etag_returns_304_without_building():
+    def build():
+        raise AssertionError('304 时不应生成内容')
+
+    for header in ('W/"abc"', '"abc"', '"other", W/"abc"'):
+        with app.test_request_context(headers={'If-None-Match': header}):
+            response = conditional_json(build, etag='abc')
+        assert response.status_code == 304
+        assert response.get_data() == b''
+        assert response.headers['ETag'] == 'W/"abc"'
+
+
+def test_changed_etag_builds_response():
+    with app.test_request_context(headers={'If-None-Match': 'W/"old"'}):
+        response = conditional_json(lambda: {'ok': True}, etag='new')
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == {'ok': True}
+
+
+def test_if_modified_since_ignores_subsecond_precision():
+    with app.test_request_context(headers={'If-Modified-Since': HTTP_DATE}):
+        assert conditional_json(dict, last_modified=MODIFIED).status_code == 304
+        assert conditional_json(dict, last_modified=MODIFIED + timedelta(seconds=1)).status_code == 200
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    headers = {'If-None-Match': 'W/"old"', 'If-Modified-Since': HTTP_DATE}
+    with app.test_request_context(headers=headers):
+        response = conditional_json(dict, etag='new', last_modified=MODIFIED)
+    assert response.status_code == 200
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""llm_gateway：失败切换、对冲请求、流式切换和令牌桶（使用本地模拟服务）"""
+
+import pytest
+
+from benchmarks.llm_mock import start_mock
+from llm_gateway import LLMError, LLMGateway, Provider, TokenBucket
+
+MESSAGES = [{'role': 'user', 'content': '请总结以下内容'}]
+
+
+@pytest.fixture(scope='module')
+def mock():
+    """本模块共用的模拟服务：healthy 正常、broken 总是返回 503、slow 约 1 秒后才返回"""
+    servers = {name: start_mock(latency, fail_rate)
+               for name, latency, fail_rate in [('healthy', 0, 0), ('broken', 0, 1.0), ('slow', 1.0, 0)]}
+    yield {name: base_url for name, (_, base_url) in servers.items()}
+    for server, _ in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def make_gateway(*providers, **kwargs):
+    return LLMGateway([Provider(name, url, model='mock', rpm=0) for name, url in providers], **kwargs)
+
+
+def test_chat_fails_over_to_next_provider(mock):
+    gateway = make_gateway(('broken', mock['broken']), ('backup', mock['healthy']))
+    try:
+        assert gateway.chat(MESSAGES) == '总结' * 10
+        stats = gateway.get_stats()
+        assert stats['failovers'] == 1
+        assert stats['failed'] == 0
+        assert stats['providers']['broken']['errors'] == 1
+        assert 'HTTP 503' in stats['providers']['broken']['last_error']
+        assert stats['providers']['backup']['ok'] == 1
+    finally:
+        gateway.close()
+
+
+def test_chat_returns_none_when_every_provider_fails(mock):
+    gateway = make_gateway(('a', mock['broken']), ('b', mock['broken']))
+    try:
+        assert gateway.chat(MESSAGES) is None
+        assert gateway.get_stats()['failed'] == 1
+    finally:
+        gateway.close()
+
+
+def test_slow_provider_is_hedged(mock):
+    results = []
+    gateway = make_gateway(('slow', mock['slow']), ('fast', mock['healthy']), hedge_after=0.05,
+                           on_result=lambda name, outcome, seconds: results.append((name, outcome)))
+    try:
+        assert gateway.chat(MESSAGES) == '总结' * 10
+        stats = gateway.get_stats()
+        assert stats['hedges'] == 1
+        assert stats['hedge_wins'] == 1
+        assert stats['failovers'] == 0
+        assert results[0] == ('fast', 'ok')
+    finally:
+        gateway.close()
+
+
+def test_hedge_holds_a_slot_until_the_slower_call_finishes(mock):
+    gateway = make_gateway(('slow', mock['slow']), ('fast', mock['healthy']), max_concurrency=2, hedge_after=0.05)
+    try:
+        assert gateway.chat(MESSAGES) == '总结' * 10
+        # 对冲胜出后，落后的请求仍占着一个槽位
+        assert gateway._slots.free == 1
+        gateway._executor.shutdown(wait=True)
+        assert gateway._slots.free == 2
+    finally:
+        gateway.close()
+
+
+def test_hedge_is_skipped_when_no_slot_is_free(mock):
+    gateway = make_gateway(('slow', mock['slow']), ('fast', mock['healthy']), max_concurrency=1, hedge_after=0.05)
+    try:
+        assert gateway.chat(MESSAGES) == '总结' * 10
+        stats = gateway.get_stats()
+        assert stats['hedges'] == 0
+        assert stats['hedges_skipped'] == 1
+        assert stats['providers']['fast']['requests'] == 0
+        assert stats['providers']['slow']['ok'] == 1
+    finally:
+        gateway.close()
+
+
+def test_connections_are_reused(mock):
+    gateway = make_gateway(('only', mock['healthy']))
+    try:
+        for _ in range(3):
+            assert gateway.chat(MESSAGES)
+        pool = gateway.get_stats()['providers']['only']['pool']
+        assert pool['created'] == 1
+        assert pool['reused'] == 2
+    finally:
+        gateway.close()
+
+
+def test_stream_fails_over_before_first_token(mock):
+    gateway = make_gateway(('broken', mock['broken']), ('backup', mock['healthy']))
+    try:
+        assert ''.join(gateway.chat_stream(MESSAGES)) == '总结' * 10
+        assert gateway.get_stats()['failovers'] == 1
+    finally:
+        gateway.close()
+
+
+def test_stream_switches_provider_when_first_token_is_late(mock):
+    gateway = make_gateway(('slow', mock['slow']), ('fast', mock['healthy']), hedge_after=0.05)
+    try:
+        assert ''.join(gateway.chat_stream(MESSAGES)) == '总结' * 10
+        stats = gateway.get_stats()
+        assert stats['failovers'] == 1
+        assert stats['providers']['fast']['ok'] == 1
+    finally:
+        gateway.close()
+
+
+def test_stream_raises_when_every_provider_fails(mock):
+    gateway = make_gateway(('a', mock['broken']))
+    try:
+        with pytest.raises(LLMError):
+            ''.join(gateway.chat_stream(MESSAGES))
+    finally:
+        gateway.close()
+
+
+def test_rate_limited_provider_is_skipped(mock):
+    gateway = LLMGateway([
+        Provider('limited', mock['healthy'], model='mock', rpm=1, burst=1),
+        Provider('backup', mock['healthy'], model='mock', rpm=0),
+    ])
+    try:
+        assert gateway.chat(MESSAGES)
+        assert gateway.chat(MESSAGES)
+        providers = gateway.get_stats()['providers']
+        assert providers['limited']['ok'] == 1
+        assert providers['limited']['rate_limited'] == 1
+        assert providers['backup']['ok'] == 1
+    finally:
+        gateway.close()
+
+
+def test_token_bucket_allows_burst_then_reports_wait():
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 1
+    assert bucket.acquire(timeout=0) is False
+    assert TokenBucket(rate=0, capacity=1).try_acquire() == 0
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""metrics：Prometheus 文本格式导出"""
+
+from metrics import Registry
+
+
+def test_counter_renders_help_type_and_labels():
+    registry = Registry()
+    counter = registry.counter('requests_total', 'HTTP 请求数', ['path', 'status'])
+    counter.inc(path='/api/search', status=200)
+    counter.inc(2, path='/api/search', status=200)
+    counter.inc(path='/api/"x"\n', status=500)
+
+    text = registry.render()
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    assert lines[0] == '# HELP requests_total HTTP 请求数'
+    assert lines[1] == '# TYPE requests_total counter'
+    assert 'requests_total{path="/api/search",status="200"} 3' in lines
+    assert 'requests_total{path="/api/\\"x\\"\\n",status="500"} 1' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', '耗时', ['stage'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, stage='ai')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{stage="ai",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="ai",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{stage="ai",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{stage="ai"} 6.05' in lines
+    assert 'latency_seconds_count{stage="ai"} 4' in lines
+
+
+def test_histogram_timer_observes_once():
+    registry = Registry()
+    histogram = registry.histogram('stage_seconds', '耗时')
+    with histogram.time():
+        pass
+    assert 'stage_seconds_count 1' in registry.render().splitlines()
+
+
+def test_gauge_reads_callback_and_skips_failures():
+    registry = Registry()
+    registry.gauge('queue_size', '队列长度', lambda: 7)
+    registry.gauge('group_messages', '群组消息数', lambda: [({'group': 'a'}, 1), ({'group': 'b'}, 2.5)])
+    registry.gauge('broken', '出错的仪表', lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+    assert 'queue_size 7' in lines
+    assert 'group_messages{group="a"} 1' in lines
+    assert 'group_messages{group="b"} 2.5' in lines
+    assert '# TYPE broken gauge' in lines
+    assert not any(line.startswith('broken ') for line in lines)
+
+
+def test_render_merges_snapshots_from_other_processes():
+    listener = Registry()
+    listener.counter('messages_total', '消息数').inc(5)
+    web = Registry()
+    web.counter('messages_total', '消息数').inc(1)
+
+    text = web.render(sources=[(listener.snapshot(), {'process': 'listener'})])
+    lines = text.splitlines()
+    assert lines.count('# TYPE messages_total counter') == 1
+    assert 'messages_total 1' in lines
+    assert 'messages_total{process="listener"} 5' in lines
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry(enabled=False)
+    counter = registry.counter('events_total', '事件数')
+    histogram = registry.histogram('event_seconds', '耗时')
+    counter.inc()
+    histogram.observe(1)
+    with histogram.time():
+        pass
+    assert registry.snapshot() == []
+    assert registry.render() == '\n'
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""prompt_packer：token 估算、去重和预算内挑选"""
+
+from prompt_packer import NON_TEXT_PLACEHOLDER, estimate_tokens, pack_messages
+
+
+def line(msg):
+    return f"{msg.get('sender_id')}: {msg.get('message_text')}"
+
+
+def word(n):
+    """生成互不相同的字母串（归一化去重会忽略数字）"""
+    return ''.join(chr(ord('a') + int(digit)) for digit in str(n))
+
+
+def make(message_id, text, sender_id=1):
+    return {'message_id': message_id, 'message_text': text, 'sender_id': sender_id}
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('你好世界') == 4
+    assert estimate_tokens('abcdefgh') == 2
+    assert estimate_tokens('你好abcd') == 3
+
+
+def test_drops_non_text_and_near_duplicates_keeping_newest():
+    messages = [
+        make(5, 'BTC to the moon! https://a.example/1'),
+        make(4, NON_TEXT_PLACEHOLDER),
+        make(3, 'btc to the moon https://b.example/2'),
+        make(2, ''),
+        make(1, 'something else'),
+    ]
+    selected, stats = pack_messages(messages, 1000, line)
+
+    assert [msg['message_id'] for msg in selected] == [5, 1]
+    assert stats['dropped_non_text'] == 2
+    assert stats['dropped_duplicates'] == 1
+    assert stats['used'] == 2
+
+
+def test_stays_within_budget_and_keeps_original_order():
+    messages = [make(i, f'message {word(i)} ' + 'x' * 40, sender_id=i % 3) for i in range(30, 0, -1)]
+    budget = 100
+    selected, stats = pack_messages(messages, budget, line)
+
+    used = sum(estimate_tokens(line(msg)) + 1 for msg in selected)
+    assert used <= budget
+    assert stats['estimated_tokens'] == used
+    assert stats['used'] + stats['dropped_budget'] == len(messages)
+    ids = [msg['message_id'] for msg in selected]
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_rotates_between_senders_before_taking_more_from_one():
+    # 发送者 1 刷屏，发送者 2 只有一条较旧的消息，预算只够两条
+    messages = [make(i, f'spam {word(i)} ' + 'y' * 20, sender_id=1) for i in range(10, 1, -1)]
+    messages.append(make(1, 'quiet but relevant ' + 'z' * 14, sender_id=2))
+    budget = estimate_tokens(line(messages[0])) + estimate_tokens(line(messages[-1])) + 2
+    selected, _ = pack_messages(messages, budget, line)
+
+    assert {msg['sender_id'] for msg in selected} == {1, 2}
+    assert [msg['message_id'] for msg in selected] == [10, 1]
+
+
+def test_zero_budget_selects_nothing():
+    selected, stats = pack_messages([make(1, 'hello')], 0, line)
+    assert selected == []
+    assert stats['dropped_budget'] == 1
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""search_index：全文搜索、短词 LIKE 过滤、过滤条件、片段转义和删除"""
+
+import pytest
+
+from search_index import SearchIndex
+
+
+def message(message_id, text, chat_id=1, chat_username='group', message_ts=None, **fields):
+    return dict({
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'chat_title': '测试群',
+        'chat_username': chat_username,
+        'sender_id': 100,
+        'sender_username': 'alice',
+        'sender_name': 'Alice',
+        'message_text': text,
+        'message_date': None,
+        'message_ts': 1_700_000_000 + message_id if message_ts is None else message_ts,
+    }, **fields)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / 'search.db'))
+
+
+def test_add_skips_non_text_and_duplicates(index):
+    batch = [message(1, 'hello world'), message(2, '[非文本消息]'), message(3, '')]
+    assert index.add_messages(batch) == 1
+    assert index.add_messages(batch) == 0
+    assert index.get_stats() == {'indexed_messages': 1}
+
+
+def test_message_ts_is_derived_from_naive_date_as_utc(index):
+    index.add_messages([dict(message(1, 'hello world'), message_ts=None, message_date='2023-11-14T22:13:20')])
+    assert index.search('hello')[0]['message_ts'] == 1_700_000_000
+
+
+def test_chinese_substring_search_highlights_match(index):
+    index.add_messages([message(1, '今天比特币价格大涨'), message(2, '以太坊升级完成')])
+    results = index.search('比特币')
+    assert [r['message_id'] for r in results] == [1]
+    assert '<mark>比特币</mark>' in results[0]['snippet']
+    assert 'id' not in results[0]
+
+
+def test_terms_are_anded_and_short_terms_use_like(index):
+    index.add_messages([
+        message(1, 'ethereum ma crossover'),
+        message(2, 'ethereum only'),
+        message(3, 'ma only 100%'),
+    ])
+    assert [r['message_id'] for r in index.search('ethereum ma')] == [1]
+    snippet = index.search('ethereum ma')[0]['snippet']
+    assert snippet == '<mark>ethereum</mark> <mark>ma</mark> crossover'
+
+    # 只有短词时按时间倒序，% 按字面匹配
+    assert [r['message_id'] for r in index.search('ma')] == [3, 1]
+    assert [r['message_id'] for r in index.search('0%')] == [3]
+    assert index.search('ma')[0]['rank'] is None
+
+
+def test_snippet_escapes_message_html(index):
+    index.add_messages([message(1, '<script>alert("x")</script> payload & more')])
+    for query in ('payload', 'pa', 'script'):
+        snippet = index.search(query)[0]['snippet']
+        assert '<script>' not in snippet
+        assert '&lt;' in snippet
+        assert snippet.count('<mark>') == snippet.count('</mark>') >= 1
+
+
+def test_placeholder_characters_in_text_are_not_marks(index):
+    index.add_messages([message(1, 'bitcoin \ue000fake\ue001 ab tail')])
+    for query in ('bitcoin', 'ab', 'bitcoin ab'):
+        snippet = index.search(query)[0]['snippet']
+        assert '\ue000' not in snippet and '\ue001' not in snippet
+        assert '<mark>fake</mark>' not in snippet
+    assert index.search('bitcoin')[0]['message_text'] == 'bitcoin fake ab tail'
+
+
+def test_fts_syntax_is_treated_as_literal_text(index):
+    index.add_messages([message(1, 'price "quoted" AND NOT foo*')])
+    assert [r['message_id'] for r in index.search('"quoted"')] == [1]
+    assert [r['message_id'] for r in index.search('AND NOT')] == [1]
+    assert index.search('OR') == []
+    assert [r['message_id'] for r in index.search('foo*')] == [1]
+
+
+def test_filters_by_group_sender_and_time(index):
+    index.add_messages([
+        message(1, 'bitcoin news', chat_username='one'),
+        message(2, 'bitcoin news', chat_username='two', chat_id=2),
+        message(3, 'bitcoin news', chat_username='one', sender_id=200, sender_username='bob', sender_name='Bob'),
+    ])
+    ids = lambda results: sorted(r['message_id'] for r in results)
+    assert ids(index.search('bitcoin', chat_username='ONE')) == [1, 3]
+    assert ids(index.search('bitcoin', sender='@bob')) == [3]
+    assert ids(index.search('bitcoin', sender='Alice')) == [1, 2]
+    assert ids(index.search('bitcoin', sender='200')) == [3]
+    assert ids(index.search('bitcoin', since_ts=1_700_000_002)) == [2, 3]
+    assert ids(index.search('bitcoin', until_ts=1_700_000_002)) == [1]
+    assert ids(index.search('', chat_username='two')) == [2]
+
+
+def test_limit_and_offset_page_results(index):
+    index.add_messages([message(i, f'bitcoin update {i}') for i in range(1, 6)])
+    first = index.search('bitcoin', limit=2)
+    second = index.search('bitcoin', limit=2, offset=2)
+    assert len(first) == len(second) == 2
+    assert not {r['message_id'] for r in first} & {r['message_id'] for r in second}
+
+
+def test_delete_messages_removes_from_full_text_index(index):
+    index.add_messages([message(1, 'bitcoin one'), message(2, 'bitcoin two'), message(1, 'bitcoin other', chat_id=2)])
+    assert index.delete_messages(1, [1, 99]) == 1
+    assert index.delete_messages(1, []) == 0
+    assert sorted((r['chat_id'], r['message_id']) for r in index.search('bitcoin')) == [(1, 2), (2, 1)]
+    assert index.get_stats() == {'indexed_messages': 2}
+    assert index.incremental_vacuum() is True
+
+
+def test_short_chinese_terms_use_bigram_index(index):
+    index.add_messages([message(1, '大户鲸鱼正在出货'), message(2, '鲸落'), message(3, '今天没有消息'), message(4, '鱼')])
+    ids = lambda query: sorted(r['message_id'] for r in index.search(query))
+    assert ids('鲸鱼') == [1]
+    assert ids('鲸') == [1, 2]
+    assert ids('鱼') == [1, 4]
+    assert ids('出货 鲸') == [1]
+    assert '<mark>鲸鱼</mark>' in index.search('鲸鱼')[0]['snippet']
+
+    plan = ' '.join(row[-1] for row in index._connect().execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM search_messages m '
+        'WHERE m.id IN (SELECT rowid FROM messages_bigram WHERE messages_bigram MATCH ?)', ['"鲸鱼"']))
+    assert 'SEARCH m USING INTEGER PRIMARY KEY' in plan and 'VIRTUAL TABLE INDEX' in plan
+
+
+def test_bigram_index_follows_deletes_and_is_backfilled_for_old_indexes(tmp_path):
+    path = str(tmp_path / 'search.db')
+    index = SearchIndex(path)
+    index.add_messages([message(1, '鲸鱼出货'), message(2, '鲸鱼进场')])
+    index.delete_messages(1, [1])
+    assert [r['message_id'] for r in index.search('鲸鱼')] == [2]
+
+    # 模拟升级前的索引：没有短词索引
+    conn = index._connect()
+    conn.executescript('DROP TABLE messages_bigram; DROP TRIGGER search_messages_bigram_ai; '
+                       'DROP TRIGGER search_messages_bigram_ad;')
+    conn.close()
+    index._local.conn = None
+
+    reopened = SearchIndex(path)
+    assert [r['message_id'] for r in reopened.search('进场')] == [2]
+    assert reopened.search('出货') == []
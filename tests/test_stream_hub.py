@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""stream_hub：SSE 事件分发、群组过滤、断线补发和慢消费者断开"""
+
+import json
+
+from stream_hub import StreamHub
+
+
+def drain(sub):
+    """取出订阅者缓冲区中的所有帧"""
+    frames = list(sub.pending)
+    sub.pending.clear()
+    return frames
+
+
+def test_publish_fans_out_to_matching_subscribers():
+    hub = StreamHub()
+    everyone = hub.subscribe()
+    only_a = hub.subscribe(groups=['a'])
+
+    first = hub.publish('message', {'text': '你好'}, group='a')
+    second = hub.publish('message', {'text': 'hi'}, group='b')
+
+    assert (first, second) == (1, 2)
+    assert drain(everyone) == [
+        'id: 1\nevent: message\ndata: {"text": "你好"}\n\n',
+        'id: 2\nevent: message\ndata: {"text": "hi"}\n\n',
+    ]
+    assert [frame.split('\n')[0] for frame in drain(only_a)] == ['id: 1']
+    stats = hub.get_stats()
+    assert stats['published'] == 2
+    assert stats['delivered'] == 3
+    assert stats['subscribers'] == 2
+    assert stats['last_event_id'] == 2
+
+
+def test_resubscribe_replays_events_after_last_event_id():
+    hub = StreamHub()
+    for i in range(5):
+        hub.publish('message', {'n': i}, group='a' if i % 2 else 'b')
+
+    sub = hub.subscribe(last_event_id=2, groups=['a'])
+    frames = drain(sub)
+    assert [json.loads(frame.split('data: ')[1]) for frame in frames] == [{'n': 3}]
+
+
+def test_resubscribe_past_history_sends_reset():
+    hub = StreamHub(history_size=2)
+    for i in range(5):
+        hub.publish('message', {'n': i})
+
+    frames = drain(hub.subscribe(last_event_id=1))
+    assert frames[0] == 'event: reset\ndata: {"oldest_id": 4}\n\n'
+    assert [frame.split('\n')[0] for frame in frames[1:]] == ['id: 4', 'id: 5']
+
+
+def test_slow_subscriber_is_dropped():
+    hub = StreamHub(max_pending=2)
+    slow = hub.subscribe()
+    for i in range(3):
+        hub.publish('message', {'n': i})
+
+    assert slow.closed and slow.dropped
+    assert hub.get_stats()['dropped_subscribers'] == 1
+    assert hub.get_stats()['subscribers'] == 0
+
+    frames = list(hub.iter_frames(slow))
+    assert frames[0] == 'retry: 3000\n\n'
+    assert frames[1].count('event: message') == 2
+    assert frames[-1].startswith('event: dropped')
+
+
+def test_iter_frames_batches_pending_and_unsubscribes_on_close():
+    hub = StreamHub()
+    sub = hub.subscribe()
+    hub.publish('message', {'n': 1})
+    hub.publish('message', {'n': 2})
+
+    frames = hub.iter_frames(sub, keepalive=0.01)
+    assert next(frames) == 'retry: 3000\n\n'
+    batch = next(frames)
+    assert batch.count('event: message') == 2
+    assert next(frames).startswith(': keepalive')
+
+    frames.close()
+    assert sub.closed
+    assert hub.get_stats()['subscribers'] == 0
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推文批量导入工具
+把 tweets/YYYY-MM-DD.json 增量解析后分批写入 SQLite（表结构见 FLASK_SERVER_DESIGN.md），
+以 tweet_url 唯一约束去重，支持多进程并行回填整个目录
+"""
+
+import argparse
+import glob
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from multiprocessing import Pool, Queue
+
+# Twitter 雪花 ID 的时间起点（毫秒）
+TWITTER_EPOCH_MS = 1288834974657
+
+_STATUS_ID_RE = re.compile(r'/status/(\d+)')
+_DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tweets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tweet_id TEXT UNIQUE NOT NULL,
+    tweet_url TEXT UNIQUE NOT NULL,
+    screen_name TEXT,
+    full_text TEXT NOT NULL,
+    created_at TEXT,
+    collected_at TEXT NOT NULL,
+    date TEXT,
+    has_images INTEGER DEFAULT 0,
+    has_videos INTEGER DEFAULT 0,
+    image_count INTEGER DEFAULT 0,
+    video_count INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_tweets_date ON tweets (date);
+CREATE INDEX IF NOT EXISTS idx_tweets_screen_name ON tweets (screen_name);
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    screen_name TEXT UNIQUE NOT NULL,
+    name TEXT,
+    profile_image_url TEXT,
+    description TEXT,
+    followers_count INTEGER DEFAULT 0,
+    friends_count INTEGER DEFAULT 0,
+    location TEXT,
+    first_seen_at TEXT,
+    last_updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tweet_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tweet_id INTEGER NOT NULL REFERENCES tweets (id),
+    image_url TEXT NOT NULL,
+    image_index INTEGER,
+    UNIQUE (tweet_id, image_index)
+);
+
+CREATE TABLE IF NOT EXISTS tweet_videos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tweet_id INTEGER NOT NULL REFERENCES tweets (id),
+    video_url TEXT NOT NULL,
+    video_index INTEGER,
+    UNIQUE (tweet_id, video_index)
+);
+
+CREATE TABLE IF NOT EXISTS collection_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection_date TEXT NOT NULL,
+    source_file TEXT,
+    tweet_count INTEGER,
+    new_tweets INTEGER,
+    duplicate_tweets INTEGER,
+    status TEXT,
+    error_message TEXT,
+    created_at TEXT NOT NULL
+);
+'''
+
+_TWEET_COLUMNS = (
+    'tweet_id, tweet_url, screen_name, full_text, created_at, collected_at, date, '
+    'has_images, has_videos, image_count, video_count'
+)
+
+
+def iter_json_array(path, chunk_size=1 << 16):
+    """
+    增量解析 JSON 数组文件，逐个产出元素，不把整个文件读入内存
+
+    Args:
+        path: JSON 文件路径（顶层必须是数组）
+        chunk_size: 每次读取的字符数
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # 跳过空白和分隔符
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) and not started:
+                if buf[pos] != '[':
+                    raise ValueError(f'{path}: 顶层不是 JSON 数组')
+                started = True
+                pos += 1
+                continue
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            if pos < len(buf):
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # 元素恰好在缓冲区末尾结束时可能被截断（如数字），先读入更多数据
+                    if end < len(buf) or eof:
+                        yield item
+                        pos = end
+                        continue
+            if eof:
+                if started:
+                    raise ValueError(f'{path}: JSON 数组未结束')
+                return
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def file_date(path):
+    """从文件名中取出日期（YYYY-MM-DD），没有返回 None"""
+    match = _DATE_RE.search(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def parse_batches(path, batch_size=5000):
+    """
+    分批解析一个推文文件，每批最多 batch_size 条推文，整个文件的行不会同时留在内存中
+
+    Yields:
+        (推文行, 用户行, 图片行, 视频行)；图片和视频行以 tweet_url 关联推文
+    """
+    date = file_date(path)
+    collected_at = datetime.now(timezone.utc).isoformat()
+    # 用户资料以文件日期为准，并行导入时旧文件不会覆盖新文件的资料
+    seen_at = date or collected_at
+
+    tweets, users, images, videos = [], {}, [], []
+    for tweet in iter_json_array(path):
+        tweet_url = tweet.get('tweetUrl')
+        match = _STATUS_ID_RE.search(tweet_url or '')
+        if not match:
+            continue
+        # 推文 ID 是雪花 ID，可以直接算出发布时间
+        tweet_id = match.group(1)
+        created_ms = (int(tweet_id) >> 22) + TWITTER_EPOCH_MS
+        created_at = datetime.fromtimestamp(created_ms / 1000, timezone.utc).isoformat()
+
+        user = tweet.get('user') or {}
+        screen_name = user.get('screenName')
+        tweet_images = tweet.get('images') or []
+        tweet_videos = tweet.get('videos') or []
+
+        tweets.append((
+            tweet_id, tweet_url, screen_name, tweet.get('fullText') or '',
+            created_at, collected_at, date,
+            int(bool(tweet_images)), int(bool(tweet_videos)), len(tweet_images), len(tweet_videos)
+        ))
+        if screen_name:
+            users[screen_name] = (
+                screen_name, user.get('name'), user.get('profileImageUrl'), user.get('description'),
+                user.get('followersCount') or 0, user.get('friendsCount') or 0, user.get('location'),
+                seen_at, seen_at
+            )
+        images.extend((i, url, tweet_url) for i, url in enumerate(tweet_images))
+        videos.extend((i, url, tweet_url) for i, url in enumerate(tweet_videos))
+
+        if len(tweets) >= batch_size:
+            yield tweets, list(users.values()), images, videos
+            tweets, users, images, videos = [], {}, [], []
+
+    if tweets:
+        yield tweets, list(users.values()), images, videos
+
+
+class TweetImporter:
+    """推文批量写入器：单连接、大事务、INSERT OR IGNORE 去重"""
+
+    def __init__(self, db_path='tweets.db', commit_every=50000):
+        """
+        初始化写入器
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            commit_every: 累计多少行提交一次事务
+        """
+        self.commit_every = commit_every
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._uncommitted = 0
+        self.stats = {'files': 0, 'tweets': 0, 'new_tweets': 0, 'duplicate_tweets': 0, 'failed_files': 0}
+
+    def write_batch(self, batch):
+        """
+        写入一批解析结果
+
+        Returns:
+            (推文数, 新增推文数)
+        """
+        tweets, users, images, videos = batch
+        before = self.conn.total_changes
+        self.conn.executemany(
+            f'INSERT OR IGNORE INTO tweets ({_TWEET_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', tweets
+        )
+        new_tweets = self.conn.total_changes - before
+
+        # 并行导入时文件的写入顺序不固定，只用日期不早于已有资料的数据更新用户
+        self.conn.executemany('''
+            INSERT INTO users (screen_name, name, profile_image_url, description, followers_count,
+                               friends_count, location, first_seen_at, last_updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(screen_name) DO UPDATE SET
+                name = excluded.name,
+                profile_image_url = excluded.profile_image_url,
+                description = excluded.description,
+                followers_count = excluded.followers_count,
+                friends_count = excluded.friends_count,
+                location = excluded.location,
+                first_seen_at = MIN(users.first_seen_at, excluded.first_seen_at),
+                last_updated_at = excluded.last_updated_at
+            WHERE excluded.last_updated_at >= users.last_updated_at
+        ''', users)
+        # 通过 tweet_url 唯一索引找到推文的 id
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO tweet_images (tweet_id, image_index, image_url) '
+            'SELECT id, ?, ? FROM tweets WHERE tweet_url = ?', images
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO tweet_videos (tweet_id, video_index, video_url) '
+            'SELECT id, ?, ? FROM tweets WHERE tweet_url = ?', videos
+        )
+
+        self.stats['tweets'] += len(tweets)
+        self.stats['new_tweets'] += new_tweets
+        self.stats['duplicate_tweets'] += len(tweets) - new_tweets
+
+        self._uncommitted += len(tweets) + len(users) + len(images) + len(videos)
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+        return len(tweets), new_tweets
+
+    def log(self, source_file, date, tweet_count, new_tweets, status, error_message=None):
+        """记录采集日志"""
+        self.conn.execute(
+            'INSERT INTO collection_logs (collection_date, source_file, tweet_count, new_tweets, '
+            'duplicate_tweets, status, error_message, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (date or '', source_file, tweet_count, new_tweets, tweet_count - new_tweets,
+             status, error_message, datetime.now(timezone.utc).isoformat())
+        )
+
+    def commit(self):
+        """提交当前事务"""
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """提交并关闭连接"""
+        self.commit()
+        self.conn.close()
+
+
+# 工作进程把解析出的批次放入这个队列，由主进程按到达顺序写入
+_batch_queue = None
+
+
+def _init_worker(batch_queue):
+    global _batch_queue
+    _batch_queue = batch_queue
+
+
+def _parse_into_queue(path, batch_size):
+    """工作进程入口：分批解析文件放入队列，最后放入结束标记（解析失败时带上错误）"""
+    try:
+        for batch in parse_batches(path, batch_size):
+            _batch_queue.put((path, batch, None))
+        _batch_queue.put((path, None, None))
+    except Exception as e:
+        _batch_queue.put((path, None, str(e)))
+
+
+def import_files(paths, db_path='tweets.db', workers=None, commit_every=50000, batch_size=5000):
+    """
+    并行分批解析、单线程批量写入多个推文文件
+
+    Args:
+        paths: 文件路径列表
+        db_path: SQLite 数据库文件路径
+        workers: 解析进程数，None 表示 CPU 核数，1 表示不使用子进程
+        commit_every: 累计多少行提交一次事务
+        batch_size: 每批解析和写入的推文数
+
+    Returns:
+        统计字典（含耗时和每秒行数）
+    """
+    importer = TweetImporter(db_path, commit_every)
+    started = time.monotonic()
+    counts = {path: [0, 0] for path in paths}
+
+    def handle(path, batch, error):
+        """处理一批解析结果；batch 为 None 表示该文件已结束"""
+        if batch is not None:
+            tweet_count, new_tweets = importer.write_batch(batch)
+            counts[path][0] += tweet_count
+            counts[path][1] += new_tweets
+            return
+        tweet_count, new_tweets = counts.pop(path)
+        source_file = os.path.basename(path)
+        if error:
+            # 出错之前已写入的批次保留（重新导入时自动去重）
+            importer.stats['failed_files'] += 1
+            importer.log(source_file, file_date(path), tweet_count, new_tweets, 'failed', error)
+            print(f"✗ 解析失败 {path}: {error}")
+        else:
+            importer.stats['files'] += 1
+            importer.log(source_file, file_date(path), tweet_count, new_tweets, 'success')
+            print(f"✓ {source_file}: {tweet_count} 条推文")
+
+    try:
+        if workers == 1 or len(paths) <= 1:
+            for path in paths:
+                try:
+                    for batch in parse_batches(path, batch_size):
+                        handle(path, batch, None)
+                    handle(path, None, None)
+                except Exception as e:
+                    handle(path, None, str(e))
+        else:
+            # 有界队列：写入跟不上时工作进程等待，内存中最多只有几批数据
+            batch_queue = Queue(maxsize=4 * (workers or os.cpu_count() or 1))
+            with Pool(processes=workers, initializer=_init_worker, initargs=(batch_queue,)) as pool:
+                pending = pool.starmap_async(_parse_into_queue, [(path, batch_size) for path in paths])
+                while counts:
+                    try:
+                        item = batch_queue.get(timeout=1)
+                    except queue.Empty:
+                        # 工作进程异常退出时不再等待（get() 抛出其异常）
+                        if pending.ready() and not pending.successful():
+                            pending.get()
+                        continue
+                    handle(*item)
+                pending.get()
+    finally:
+        importer.close()
+
+    stats = dict(importer.stats)
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    stats['rows_per_second'] = round(stats['tweets'] / stats['seconds'], 1) if stats['seconds'] else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推文批量导入工具')
+    parser.add_argument('paths', nargs='*', default=['tweets'],
+                        help='推文 JSON 文件或目录 (默认: tweets)')
+    parser.add_argument('--db', dest='db_path',
+                        default=os.environ.get('TWEETS_DB', 'tweets.db'),
+                        help='SQLite 数据库文件 (默认: tweets.db, 也可通过环境变量 TWEETS_DB 设置)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='并行解析进程数 (默认: CPU 核数)')
+    parser.add_argument('--commit-every', dest='commit_every', type=int, default=50000,
+                        help='累计多少行提交一次事务 (默认: 50000)')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=5000,
+                        help='每批解析和写入的推文数 (默认: 5000)')
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths.extend(sorted(glob.glob(os.path.join(path, '*.json'))))
+        else:
+            paths.append(path)
+    if not paths:
+        print("未找到推文文件")
+        sys.exit(1)
+
+    stats = import_files(paths, args.db_path, args.workers, args.commit_every, args.batch_size)
+    print(f"\n导入完成: {stats['files']} 个文件, {stats['tweets']} 条推文, "
+          f"新增 {stats['new_tweets']}, 重复 {stats['duplicate_tweets']}, 失败文件 {stats['failed_files']}")
+    print(f"耗时 {stats['seconds']} 秒, {stats['rows_per_second']} 条/秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -12,16 +12,34 @@ import sys
 import threading
 import time
 import argparse
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context
-from telethon import TelegramClient, events
-from db_manager import DatabaseManager
-from modules.ai_summarizer.summarizer import Summarizer
-from modules.ai_summarizer.deepseek_client import DeepSeekClient
+import atexit
+import concurrent.futures
+import queue
+import signal
+import subprocess
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import Flask, g, render_template, request, jsonify, Response, stream_with_context
+# telethon、数据库管理器和 AI 客户端较重，在第一次使用时才导入（见 Lazy 和各工厂函数）
+from prompt_packer import estimate_tokens, pack_messages
+from config_store import ConfigStore
+from http_response import conditional_json, make_etag, parse_timestamp
+from llm_gateway import LLMGateway, Provider
+from metrics import Registry
+from retention import MessageArchive, RetentionEngine
+from search_index import SearchIndex
+from stream_hub import StreamHub
+from summary_cache import SummaryCache, ChunkSummaryStore, prompt_version
 
 # ==================== 命令行参数解析 ====================
-def parse_args():
-    """解析命令行参数"""
+def parse_args(argv=None):
+    """
+    解析命令行参数
+    
+    Args:
+        argv: 参数列表，None 表示 sys.argv[1:]
+    """
     parser = argparse.ArgumentParser(
         description='Telegram 群组监听器 - 新版网页版',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -87,6 +105,44 @@ def parse_args():
                        default=int(os.environ.get('WEB_PORT', '5001')),
                        help='Web 服务器端口 (默认: 5001, 也可通过环境变量 WEB_PORT 设置)')
     
+    # 部署方式
+    parser.add_argument('--server',
+                       dest='server',
+                       choices=['dev', 'waitress', 'gunicorn'],
+                       default=os.environ.get('SERVER', 'dev'),
+                       help='Web 服务器: dev (Flask 开发服务器，监听器在同一进程), waitress, gunicorn (多进程) (默认: dev)')
+    parser.add_argument('--role',
+                       dest='role',
+                       choices=['all', 'web', 'listener'],
+                       default=os.environ.get('ROLE', 'all'),
+                       help='进程角色: all (Web + 监听器), web (只运行 Web), listener (只运行 Telegram 监听器) (默认: all)')
+    parser.add_argument('--web-workers',
+                       dest='web_workers',
+                       type=int,
+                       default=int(os.environ.get('WEB_WORKERS', str(os.cpu_count() or 2))),
+                       help='gunicorn 工作进程数 (默认: CPU 核数)')
+    parser.add_argument('--web-threads',
+                       dest='web_threads',
+                       type=int,
+                       default=int(os.environ.get('WEB_THREADS', '16')),
+                       help='每个工作进程的线程数，SSE 长连接各占一个线程 (默认: 16)')
+    
+    # 监听器分片
+    parser.add_argument('--shards',
+                       dest='shards',
+                       type=int,
+                       default=int(os.environ.get('SHARDS', '1')),
+                       help='监听器分片数，每个分片是独立进程和独立会话 (默认: 1, 不分片)')
+    parser.add_argument('--shard-sessions',
+                       dest='shard_sessions',
+                       default=os.environ.get('SHARD_SESSIONS', ''),
+                       help='各分片的会话文件名，逗号分隔 (默认: <session-name>_shard<N>)')
+    parser.add_argument('--shard-index',
+                       dest='shard_index',
+                       type=int,
+                       default=None,
+                       help=argparse.SUPPRESS)
+    
     # 默认群组（可选）
     parser.add_argument('--default-groups',
                        dest='default_groups',
@@ -97,21 +153,148 @@ def parse_args():
     parser.add_argument('--max-messages-per-group',
                        dest='max_messages_per_group',
                        type=int,
-                       default=int(os.environ.get('MAX_MESSAGES_PER_GROUP', '100')),
-                       help='每个群组最多保存的消息数 (默认: 100)')
+                       default=int(os.environ.get('MAX_MESSAGES_PER_GROUP', '0')),
+                       help='每个群组最多保留的消息数，更旧的消息移入归档，0 表示不限 (默认: 0，不清理)')
+    parser.add_argument('--retention-days',
+                       dest='retention_days',
+                       type=int,
+                       default=int(os.environ.get('RETENTION_DAYS', '0')),
+                       help='消息最多保留的天数，更旧的消息移入归档，0 表示不限 (默认: 0，不清理)')
+    parser.add_argument('--retention-interval',
+                       dest='retention_interval',
+                       type=int,
+                       default=int(os.environ.get('RETENTION_INTERVAL', '3600')),
+                       help='保留策略检查间隔秒数 (默认: 3600)')
+    parser.add_argument('--archive-dir',
+                       dest='archive_dir',
+                       default=os.environ.get('ARCHIVE_DIR', 'archive'),
+                       help='按月压缩归档目录 (默认: archive)')
     
-    args = parser.parse_args()
+    # 群组索引配置
+    parser.add_argument('--group-index-refresh',
+                       dest='group_index_refresh',
+                       type=int,
+                       default=int(os.environ.get('GROUP_INDEX_REFRESH', '600')),
+                       help='群组 chat_id 索引后台刷新间隔秒数 (默认: 600, 0 表示不刷新)')
     
-    # 验证必需配置
-    if not args.api_id or not args.api_hash:
-        parser.print_help()
-        print("\n错误: 必须提供 --api-id 和 --api-hash 参数，或设置环境变量 API_ID 和 API_HASH")
-        sys.exit(1)
+    # 批量写入配置
+    parser.add_argument('--write-batch-size',
+                       dest='write_batch_size',
+                       type=int,
+                       default=int(os.environ.get('WRITE_BATCH_SIZE', '200')),
+                       help='每批最多写入的消息数 (默认: 200)')
+    parser.add_argument('--write-flush-ms',
+                       dest='write_flush_ms',
+                       type=int,
+                       default=int(os.environ.get('WRITE_FLUSH_MS', '200')),
+                       help='攒批最长等待毫秒数 (默认: 200)')
+    parser.add_argument('--write-queue-size',
+                       dest='write_queue_size',
+                       type=int,
+                       default=int(os.environ.get('WRITE_QUEUE_SIZE', '10000')),
+                       help='写入队列容量，队列满时消息处理器会等待 (默认: 10000)')
+    
+    # 发送者缓存配置
+    parser.add_argument('--sender-cache-size',
+                       dest='sender_cache_size',
+                       type=int,
+                       default=int(os.environ.get('SENDER_CACHE_SIZE', '5000')),
+                       help='发送者信息缓存条数 (默认: 5000, 0 表示不缓存)')
+    parser.add_argument('--sender-cache-ttl',
+                       dest='sender_cache_ttl',
+                       type=int,
+                       default=int(os.environ.get('SENDER_CACHE_TTL', '3600')),
+                       help='发送者信息缓存有效秒数 (默认: 3600)')
     
-    return args
+    # 总结缓存配置
+    parser.add_argument('--summary-cache-file',
+                       dest='summary_cache_file',
+                       default=os.environ.get('SUMMARY_CACHE_FILE', 'summary_cache.db'),
+                       help='总结缓存数据库文件 (默认: summary_cache.db)')
+    parser.add_argument('--summary-cache-size',
+                       dest='summary_cache_size',
+                       type=int,
+                       default=int(os.environ.get('SUMMARY_CACHE_SIZE', '500')),
+                       help='最多缓存的总结条数 (默认: 500)')
+    parser.add_argument('--summary-cache-ttl',
+                       dest='summary_cache_ttl',
+                       type=int,
+                       default=int(os.environ.get('SUMMARY_CACHE_TTL', str(7 * 86400))),
+                       help='总结缓存有效秒数 (默认: 604800，即 7 天)')
+    
+    # 全文搜索配置
+    parser.add_argument('--search-index-file',
+                       dest='search_index_file',
+                       default=os.environ.get('SEARCH_INDEX_FILE', 'search_index.db'),
+                       help='全文搜索索引数据库文件 (默认: search_index.db)')
+    parser.add_argument('--rebuild-search-index',
+                       dest='rebuild_search_index',
+                       action='store_true',
+                       help='把数据库中已有的消息补充到全文搜索索引后退出（可重复执行，已索引的消息自动跳过）')
+    
+    # 运行指标
+    parser.add_argument('--metrics',
+                       dest='metrics',
+                       choices=['on', 'off'],
+                       default=os.environ.get('METRICS', 'on'),
+                       help='是否记录运行指标并在 /metrics 导出 (默认: on)')
+    
+    # 大模型网关配置
+    parser.add_argument('--llm-gateway',
+                       dest='llm_gateway',
+                       choices=['on', 'off'],
+                       default=os.environ.get('LLM_GATEWAY', 'off'),
+                       help='通过网关调用大模型：长连接、限速、多个提供方自动切换，'
+                            '开启后替代总结器自带的客户端 (默认: off)')
+    parser.add_argument('--llm-concurrency',
+                       dest='llm_concurrency',
+                       type=int,
+                       default=int(os.environ.get('LLM_CONCURRENCY', '4')),
+                       help='同时进行的大模型请求数上限，超出的排队 (默认: 4)')
+    parser.add_argument('--llm-rpm',
+                       dest='llm_rpm',
+                       type=int,
+                       default=int(os.environ.get('LLM_RPM', '60')),
+                       help='每个提供方每分钟最多请求数，配置文件中的 rpm 优先，0 表示不限 (默认: 60)')
+    parser.add_argument('--llm-hedge-after',
+                       dest='llm_hedge_after',
+                       type=float,
+                       default=float(os.environ.get('LLM_HEDGE_AFTER', '0')),
+                       help='延迟阈值秒数：超过后向下一个提供方对冲（流式请求为切换），0 表示只在出错时切换 (默认: 0)')
+    
+    # 分块并行总结配置（mode=map_reduce）
+    parser.add_argument('--map-reduce-workers',
+                       dest='map_reduce_workers',
+                       type=int,
+                       default=int(os.environ.get('MAP_REDUCE_WORKERS', '4')),
+                       help='并行总结分块的线程数 (默认: 4)')
+    parser.add_argument('--map-reduce-chunk-tokens',
+                       dest='map_reduce_chunk_tokens',
+                       type=int,
+                       default=int(os.environ.get('MAP_REDUCE_CHUNK_TOKENS', '4000')),
+                       help='每个分块的消息内容 token 数上限 (默认: 4000)')
+    parser.add_argument('--map-reduce-max-chunks',
+                       dest='map_reduce_max_chunks',
+                       type=int,
+                       default=int(os.environ.get('MAP_REDUCE_MAX_CHUNKS', '16')),
+                       help='一次总结最多的分块数，超出的旧消息不参与总结 (默认: 16)')
+    
+    # 断线补齐配置
+    parser.add_argument('--backfill-limit',
+                       dest='backfill_limit',
+                       type=int,
+                       default=int(os.environ.get('BACKFILL_LIMIT', '5000')),
+                       help='重连后每个群组最多补齐的消息数，0 表示不补齐 (默认: 5000)')
+    parser.add_argument('--backfill-concurrency',
+                       dest='backfill_concurrency',
+                       type=int,
+                       default=int(os.environ.get('BACKFILL_CONCURRENCY', '3')),
+                       help='同时补齐的群组数 (默认: 3)')
+    
+    return parser.parse_args(argv)
 
-# 解析命令行参数
-args = parse_args()
+# 解析命令行参数（被其他模块导入时只使用环境变量和默认值）
+args = parse_args(None if __name__ == '__main__' else [])
 
 # ==================== 配置 ====================
 # 优先级：命令行参数 > 环境变量 > 默认值
@@ -138,127 +321,1092 @@ else:
 WEB_HOST = args.web_host
 WEB_PORT = args.web_port
 
+# 部署方式
+SERVER = args.server
+ROLE = args.role
+WEB_WORKERS = args.web_workers
+WEB_THREADS = args.web_threads
+# 监听器分片
+if args.shard_sessions:
+    SHARD_SESSIONS = [name.strip() for name in args.shard_sessions.split(',') if name.strip()]
+else:
+    SHARD_SESSIONS = [f'{SESSION_NAME}_shard{i}' for i in range(max(1, args.shards))] if args.shards > 1 else []
+# 当前进程是第几个分片（None 表示不是分片进程）
+SHARD_INDEX = args.shard_index
+SHARD_ASSIGNMENT_FILE = os.path.splitext(CONFIG_FILE)[0] + '_shards.json'
+
+# 只有开发服务器的 all 模式（且不分片）在 Web 进程内运行监听器，其他情况监听器是独立进程，
+# 通过数据库、配置文件和状态文件共享数据
+LISTENER_IN_PROCESS = ROLE == 'all' and SERVER == 'dev' and not SHARD_SESSIONS
+_status_base = os.path.splitext(CONFIG_FILE)[0] + '_status'
+LISTENER_STATUS_FILE = f'{_status_base}_{SHARD_INDEX}.json' if SHARD_INDEX is not None else f'{_status_base}.json'
+
 # 消息存储配置
 MAX_MESSAGES_PER_GROUP = args.max_messages_per_group
 
+# 保留策略配置
+RETENTION_DAYS = args.retention_days
+RETENTION_INTERVAL = args.retention_interval
+ARCHIVE_DIR = args.archive_dir
+
+# 群组索引刷新间隔（秒）
+GROUP_INDEX_REFRESH = args.group_index_refresh
+
+# 批量写入配置
+WRITE_BATCH_SIZE = args.write_batch_size
+WRITE_FLUSH_MS = args.write_flush_ms
+WRITE_QUEUE_SIZE = args.write_queue_size
+
+# 发送者缓存配置
+SENDER_CACHE_SIZE = args.sender_cache_size
+SENDER_CACHE_TTL = args.sender_cache_ttl
+
+# 总结缓存配置
+SUMMARY_CACHE_FILE = args.summary_cache_file
+SUMMARY_CACHE_SIZE = args.summary_cache_size
+SUMMARY_CACHE_TTL = args.summary_cache_ttl
+
+# 全文搜索配置
+SEARCH_INDEX_FILE = args.search_index_file
+
+# 运行指标配置
+METRICS_ENABLED = args.metrics == 'on'
+
+# 大模型网关配置
+LLM_GATEWAY = args.llm_gateway == 'on'
+LLM_CONCURRENCY = args.llm_concurrency
+LLM_RPM = args.llm_rpm
+LLM_HEDGE_AFTER = args.llm_hedge_after
+
+# 分块并行总结配置
+MAP_REDUCE_WORKERS = args.map_reduce_workers
+MAP_REDUCE_CHUNK_TOKENS = args.map_reduce_chunk_tokens
+MAP_REDUCE_MAX_CHUNKS = args.map_reduce_max_chunks
+
+# 断线补齐配置
+BACKFILL_LIMIT = args.backfill_limit
+BACKFILL_CONCURRENCY = args.backfill_concurrency
+
+# ==================== 延迟初始化 ====================
+class Lazy:
+    """
+    延迟构建的组件
+    
+    第一次访问属性时才调用工厂函数构建实例，之后所有属性访问都转发给该实例；
+    只用到 Web 接口的进程不会导入 telethon，也不会打开用不到的数据库
+    """
+    
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_built', False)
+        object.__setattr__(self, '_lock', threading.Lock())
+    
+    def instance(self):
+        """获取实例（需要时构建；不叫 get，以免遮住被代理对象自己的 get 方法）"""
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    object.__setattr__(self, '_instance', self._factory())
+                    object.__setattr__(self, '_built', True)
+        return self._instance
+    
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self.instance(), name, value)
+    
+    def __bool__(self):
+        return bool(self.instance())
+
 # ==================== 数据存储 ====================
+def build_db_manager():
+    from db_manager import DatabaseManager
+    return DatabaseManager()
+
 # 数据库管理器
-db_manager = DatabaseManager()
+db_manager = Lazy(build_db_manager)
+
+# 全文搜索索引（由消息写入线程同步更新）
+search_index = Lazy(lambda: SearchIndex(SEARCH_INDEX_FILE))
+
+# 实时消息推送（/api/stream）
+stream_hub = StreamHub()
+
+# 保留策略：超出条数或天数上限的消息移入按月压缩归档
+message_archive = MessageArchive(ARCHIVE_DIR)
+
+# 从消息库（数据库管理器）按群组清理，全文索引同步删除
+retention_engine = RetentionEngine(db_manager, message_archive, MAX_MESSAGES_PER_GROUP, RETENTION_DAYS,
+                                   mirrors=[search_index])
+
+# ==================== 运行指标 ====================
+metrics = Registry(enabled=METRICS_ENABLED)
+handler_stage_seconds = metrics.histogram(
+    'tg_handler_stage_seconds', '消息处理器各阶段耗时（秒）', ['stage'])
+messages_total = metrics.counter(
+    'tg_messages_total', '按群组统计的收到消息数', ['group'])
+db_write_seconds = metrics.histogram(
+    'tg_db_write_seconds', '每批消息落库耗时（秒）')
+db_write_batch_size = metrics.histogram(
+    'tg_db_write_batch_size', '每批落库的消息数', buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000, 5000))
+flood_waits_total = metrics.counter(
+    'tg_flood_waits_total', 'Telegram FloodWait 次数', ['source'])
+flood_wait_seconds_total = metrics.counter(
+    'tg_flood_wait_seconds_total', 'Telegram FloodWait 要求等待的总秒数', ['source'])
+llm_request_seconds = metrics.histogram(
+    'llm_request_seconds', '大模型调用耗时（秒，流式调用为读完整个响应）', ['mode', 'outcome'])
+llm_first_token_seconds = metrics.histogram(
+    'llm_first_token_seconds', '流式调用收到第一段内容的耗时（秒）')
+llm_provider_seconds = metrics.histogram(
+    'llm_provider_seconds', '大模型网关发往各提供方的请求耗时（秒）', ['provider', 'outcome'])
+http_request_seconds = metrics.histogram(
+    'http_request_seconds', 'HTTP 请求耗时（秒，流式响应只计到响应头）', ['endpoint', 'method', 'status'])
+metrics.gauge('tg_writer_queue_depth', '批量写入队列中等待落库的消息数',
+              lambda: message_writer.queue.qsize() if message_writer.queue is not None else 0)
+metrics.gauge('sse_subscribers', '当前 SSE 订阅者数', lambda: stream_hub.get_stats()['subscribers'])
 
 # ==================== AI 总结器 ====================
-# 初始化 AI 总结器
-summarizer = None
-try:
-    prompts_config_path = os.path.join('config', 'prompts.json')
-    
-    # 加载提示词配置
-    if os.path.exists(prompts_config_path):
-        with open(prompts_config_path, 'r', encoding='utf-8') as f:
-            prompts_config = json.load(f)
-    else:
-        prompts_config = {}
-    
-    # 尝试加载不同的 AI 配置（按优先级）
-    ai_config = None
-    provider = 'deepseek'
-    
-    # 1. 尝试通义千问（推荐，免费额度大）
-    tongyi_config_path = os.path.join('config', 'tongyi_config.json')
-    if os.path.exists(tongyi_config_path):
-        with open(tongyi_config_path, 'r', encoding='utf-8') as f:
-            ai_config = json.load(f)
-            provider = 'tongyi'
-            print("✓ 使用通义千问 API")
-    
-    # 2. 尝试 Ollama（本地，完全免费）
-    elif os.path.exists(os.path.join('config', 'ollama_config.json')):
-        ollama_config_path = os.path.join('config', 'ollama_config.json')
-        with open(ollama_config_path, 'r', encoding='utf-8') as f:
-            ai_config = json.load(f)
-            provider = 'ollama'
-            print("✓ 使用 Ollama 本地模型")
-    
-    # 3. 尝试智谱 AI
-    elif os.path.exists(os.path.join('config', 'zhipu_config.json')):
-        zhipu_config_path = os.path.join('config', 'zhipu_config.json')
-        with open(zhipu_config_path, 'r', encoding='utf-8') as f:
-            ai_config = json.load(f)
-            provider = 'zhipu'
-            print("✓ 使用智谱 AI")
-    
-    # 4. 尝试 DeepSeek（默认）
-    elif os.path.exists(os.path.join('config', 'deepseek_config.json')):
-        deepseek_config_path = os.path.join('config', 'deepseek_config.json')
-        with open(deepseek_config_path, 'r', encoding='utf-8') as f:
-            ai_config = json.load(f)
-            provider = 'deepseek'
-            print("✓ 使用 DeepSeek API")
-    
-    # 初始化总结器
-    if ai_config:
-        summarizer = Summarizer(ai_config, prompts_config, provider)
-        print(f"✓ AI 总结器已初始化（使用 {provider}）")
-    else:
-        print("⚠ 未找到任何 AI API 配置文件")
-        print("   支持的配置：")
-        print("   - config/tongyi_config.json (推荐，免费额度大)")
-        print("   - config/ollama_config.json (本地，完全免费)")
-        print("   - config/zhipu_config.json")
-        print("   - config/deepseek_config.json")
-        print("   AI 总结功能将不可用")
-        
-except Exception as e:
-    print(f"⚠ AI 总结器初始化失败: {e}")
-    import traceback
-    traceback.print_exc()
-    summarizer = None
-
-# 当前监控的群组列表
-monitored_groups = []
+class TimedLLMClient:
+    """大模型客户端包装：记录每次调用的耗时，其他属性原样转发"""
+    
+    def __init__(self, client):
+        self._client = client
+        # 只有底层客户端支持流式调用时才提供 chat_stream（调用方用 hasattr 判断）
+        if hasattr(client, 'chat_stream'):
+            self.chat_stream = self._chat_stream
+    
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+    
+    def chat(self, *args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = self._client.chat(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            llm_request_seconds.observe(time.perf_counter() - started, mode='chat', outcome=outcome)
+    
+    def _chat_stream(self, *args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        first = True
+        try:
+            for piece in self._client.chat_stream(*args, **kwargs):
+                if first:
+                    llm_first_token_seconds.observe(time.perf_counter() - started)
+                    first = False
+                yield piece
+            outcome = 'ok'
+        finally:
+            llm_request_seconds.observe(time.perf_counter() - started, mode='stream', outcome=outcome)
+
+# AI 提供方配置文件（按优先级）
+LLM_PROVIDER_CONFIGS = [
+    ('tongyi', 'tongyi_config.json', '通义千问 API'),
+    ('ollama', 'ollama_config.json', 'Ollama 本地模型'),
+    ('zhipu', 'zhipu_config.json', '智谱 AI'),
+    ('deepseek', 'deepseek_config.json', 'DeepSeek API'),
+]
+
+# 大模型网关（未启用或没有可用提供方时为 None）
+llm_gateway = None
+
+def build_llm_gateway(ai_configs):
+    """
+    用所有已配置的提供方创建大模型网关
+    
+    Args:
+        ai_configs: 按优先级排列的 [(提供方, 配置字典), ...]
+    
+    Returns:
+        LLMGateway，没有可用的提供方时返回 None
+    """
+    providers = []
+    for provider, ai_config in ai_configs:
+        llm_provider = Provider.from_config(provider, ai_config, rpm=LLM_RPM, pool_size=LLM_CONCURRENCY)
+        if llm_provider is None:
+            print(f"⚠ {provider} 配置缺少 api_key 或 base_url，网关不使用该提供方")
+            continue
+        providers.append(llm_provider)
+    if not providers:
+        return None
+    
+    def on_result(provider, outcome, seconds):
+        llm_provider_seconds.observe(seconds, provider=provider, outcome=outcome)
+    
+    return LLMGateway(providers, max_concurrency=LLM_CONCURRENCY, hedge_after=LLM_HEDGE_AFTER, on_result=on_result)
+
+def build_summarizer():
+    """初始化 AI 总结器（第一次请求总结时调用），没有可用配置时返回 None"""
+    global llm_gateway
+    try:
+        from modules.ai_summarizer.summarizer import Summarizer
+        
+        prompts_config_path = os.path.join('config', 'prompts.json')
+        
+        # 加载提示词配置
+        if os.path.exists(prompts_config_path):
+            with open(prompts_config_path, 'r', encoding='utf-8') as f:
+                prompts_config = json.load(f)
+        else:
+            prompts_config = {}
+        
+        # 加载所有 AI 配置（按优先级：通义千问免费额度大，Ollama 本地完全免费，其次智谱、DeepSeek）
+        ai_configs = []
+        for provider, filename, label in LLM_PROVIDER_CONFIGS:
+            config_path = os.path.join('config', filename)
+            if os.path.exists(config_path):
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    ai_configs.append((provider, json.load(f)))
+                print(f"✓ 找到 {label} 配置")
+        
+        # 初始化总结器
+        if ai_configs:
+            provider, ai_config = ai_configs[0]
+            summarizer = Summarizer(ai_config, prompts_config, provider)
+            # 启用网关时所有调用经过网关：长连接、限速、按优先级自动切换提供方
+            llm_gateway = build_llm_gateway(ai_configs) if LLM_GATEWAY else None
+            if llm_gateway is not None:
+                summarizer.client = llm_gateway
+                print(f"✓ 大模型网关已启用（提供方: {', '.join(p.name for p in llm_gateway.providers)}）")
+            summarizer.client = TimedLLMClient(summarizer.client)
+            print(f"✓ AI 总结器已初始化（使用 {provider}）")
+            return summarizer
+        else:
+            print("⚠ 未找到任何 AI API 配置文件")
+            print("   支持的配置：")
+            print("   - config/tongyi_config.json (推荐，免费额度大)")
+            print("   - config/ollama_config.json (本地，完全免费)")
+            print("   - config/zhipu_config.json")
+            print("   - config/deepseek_config.json")
+            print("   AI 总结功能将不可用")
+        
+    except Exception as e:
+        print(f"⚠ AI 总结器初始化失败: {e}")
+        import traceback
+        traceback.print_exc()
+    return None
+
+# AI 总结器（未配置任何 API 时为空）
+summarizer = Lazy(build_summarizer)
+
+# 总结结果缓存
+summary_cache = Lazy(lambda: SummaryCache(SUMMARY_CACHE_FILE, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL))
+# 增量总结的小时分块和滚动总结
+chunk_store = Lazy(lambda: ChunkSummaryStore(SUMMARY_CACHE_FILE))
+
 # Telegram客户端连接状态
 client_connected = False
 # 客户端就绪事件
 client_ready_event = threading.Event()
 # 客户端事件循环引用（用于线程安全的协程执行）
 client_loop_ref = None
+# 群组索引：chat_id -> 配置中的群组名（避免每条消息都调用 get_entity）
+group_index = {}
+group_index_lock = threading.Lock()
+# 解析失败的群组：小写群组名 -> (群组名, 下次重试的 monotonic 时间, 已失败次数)；
+# 重试成功之前，消息过滤器按用户名放行这些群组的消息
+unresolved_groups = {}
+# 解析失败后的首次重试间隔（秒），之后每次翻倍，最长为索引刷新间隔
+GROUP_RETRY_BASE = 5
+# 消息处理器是否已注册（整个进程只注册一次）
+handler_registered = False
 
 # ==================== 配置管理 ====================
-def load_config():
-    """加载配置文件"""
-    global monitored_groups
-    if os.path.exists(CONFIG_FILE):
+def apply_config(config):
+    """恢复配置中上次解析的群组索引（JSON 的键是字符串，分片进程只解析自己的群组）"""
+    if SHARD_INDEX is not None:
+        return
+    with group_index_lock:
+        for chat_id, group in config.get('group_ids', {}).items():
+            if group in monitored_groups:
+                group_index[int(chat_id)] = group
+
+def config_extra():
+    """写配置时一并保存的群组索引"""
+    with group_index_lock:
+        return {'group_ids': {str(chat_id): group for chat_id, group in group_index.items()}}
+
+# 配置存储：修改在内存中完成，写入防抖合并后原子落盘（分片进程不写配置文件）；
+# 任何一次重新加载（包括写入前合并外部修改）都经 apply_config 合并群组索引
+config_store = ConfigStore(CONFIG_FILE, DEFAULT_GROUPS, read_only=SHARD_INDEX is not None,
+                           extra=config_extra, on_change=apply_config)
+# 当前监控的群组列表（与配置存储共用同一个列表对象，只通过 config_store 修改）
+monitored_groups = config_store.groups
+config_loaded = False
+
+def init_config():
+    """加载配置并开始监视配置文件（重复调用无副作用）"""
+    global config_loaded
+    if config_loaded:
+        return
+    config_loaded = True
+    apply_config(config_store.load())
+    config_store.watch()
+    # 退出前写入尚未落盘的修改
+    atexit.register(config_store.flush)
+
+# ==================== Telegram客户端 ====================
+def build_client():
+    from telethon import TelegramClient
+    if USE_PROXY:
+        return TelegramClient(SESSION_NAME, API_ID, API_HASH, proxy=PROXY_CONFIG)
+    return TelegramClient(SESSION_NAME, API_ID, API_HASH)
+
+# Telegram 客户端（只在监听进程中构建）
+client = Lazy(build_client)
+
+# ==================== 监听器分片 ====================
+# 分片分配：群组 -> 分片序号（由监督进程写入分配文件）
+shard_assignment = {}
+shard_assignment_mtime = None
+
+def assign_shards(groups, alive_shards):
+    """
+    用最高随机权重（rendezvous）哈希把群组分配到存活的分片
+    
+    某个分片失效时只有它负责的群组会被重新分配，其他群组保持不动
+    """
+    if not alive_shards:
+        return {}
+    return {
+        group: max(alive_shards, key=lambda shard: zlib.crc32(f'{group}#{shard}'.encode('utf-8')))
+        for group in groups
+    }
+
+def write_shard_assignment(alive_shards):
+    """监督进程：写入分片分配文件（先写临时文件再改名）"""
+    assignment = assign_shards(monitored_groups, alive_shards)
+    tmp_path = SHARD_ASSIGNMENT_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'alive_shards': alive_shards,
+            'groups': assignment,
+            'updated_at': datetime.now().isoformat()
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, SHARD_ASSIGNMENT_FILE)
+    return assignment
+
+def reload_shard_assignment_if_changed():
+    """
+    分片进程：分配文件变化后重新加载
+    
+    Returns:
+        是否重新加载了分配
+    """
+    global shard_assignment, shard_assignment_mtime
+    if SHARD_INDEX is None:
+        return False
+    try:
+        mtime = os.path.getmtime(SHARD_ASSIGNMENT_FILE)
+        if mtime == shard_assignment_mtime:
+            return False
+        with open(SHARD_ASSIGNMENT_FILE, 'r', encoding='utf-8') as f:
+            shard_assignment = json.load(f).get('groups', {})
+        shard_assignment_mtime = mtime
+        return True
+    except (OSError, ValueError) as e:
+        print(f"⚠ 读取分片分配失败: {e}")
+        return False
+
+def listener_groups():
+    """本进程负责监听的群组（分片进程只负责分配给自己的群组）"""
+    if SHARD_INDEX is None:
+        return list(monitored_groups)
+    reload_shard_assignment_if_changed()
+    return [g for g in monitored_groups if shard_assignment.get(g) == SHARD_INDEX]
+
+# ==================== 群组索引 ====================
+def index_group(chat_id, group):
+    """记录 chat_id 对应的配置群组名"""
+    with group_index_lock:
+        group_index[chat_id] = group
+        unresolved_groups.pop(group.lower(), None)
+
+def unindex_group(group):
+    """从索引中移除某个群组的所有 chat_id"""
+    with group_index_lock:
+        for chat_id in [cid for cid, g in group_index.items() if g == group]:
+            del group_index[chat_id]
+        unresolved_groups.pop(group.lower(), None)
+
+def mark_unresolved(group):
+    """记录解析失败的群组，按指数退避安排重试"""
+    with group_index_lock:
+        _, _, failures = unresolved_groups.get(group.lower(), (group, 0, 0))
+        delay = min(GROUP_RETRY_BASE * 2 ** failures, max(GROUP_INDEX_REFRESH, GROUP_RETRY_BASE))
+        unresolved_groups[group.lower()] = (group, time.monotonic() + delay, failures + 1)
+
+def lookup_group(chat_id):
+    """O(1) 查找 chat_id 对应的配置群组名，未找到返回 None"""
+    with group_index_lock:
+        return group_index.get(chat_id)
+
+async def resolve_group_index(groups=None):
+    """
+    解析群组实体并写入索引
+    
+    Args:
+        groups: 要解析的群组列表，None 表示全部监控群组
+    """
+    own_groups = listener_groups()
+    resolved = 0
+    for group in list(groups if groups is not None else own_groups):
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                monitored_groups = config.get('groups', DEFAULT_GROUPS.copy())
+            entity = await client.get_entity(group)
+            index_group(entity.id, group)
+            resolved += 1
         except Exception as e:
-            print(f"⚠ 加载配置失败: {e}，使用默认配置")
-            monitored_groups = DEFAULT_GROUPS.copy()
-    else:
-        monitored_groups = DEFAULT_GROUPS.copy()
-    save_config()
+            mark_unresolved(group)
+            print(f"⚠ 解析群组索引失败 ({group}): {e}")
+    
+    # 清理已不再由本进程监听的群组
+    with group_index_lock:
+        for chat_id in [cid for cid, g in group_index.items() if g not in own_groups]:
+            del group_index[chat_id]
+        own_keys = {g.lower() for g in own_groups}
+        for key in [key for key in unresolved_groups if key not in own_keys]:
+            del unresolved_groups[key]
+    
+    # 保存 chat_id 索引（分片进程的配置存储是只读的）
+    config_store.save()
+    return resolved
 
-def save_config():
-    """保存配置文件"""
+async def watch_config_changes(interval=2):
+    """监听群组列表变化（Web 接口或其他进程增删群组），解析新增群组的索引"""
+    seen_version = config_store.version
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            config_changed = config_store.version != seen_version
+            seen_version = config_store.version
+            if reload_shard_assignment_if_changed() or config_changed:
+                with group_index_lock:
+                    indexed = set(group_index.values())
+                new_groups = [g for g in listener_groups() if g not in indexed]
+                resolved = await resolve_group_index(new_groups)
+                print(f"[配置] 检测到配置变化，本进程监听 {len(listener_groups())} 个群组，新解析 {resolved} 个")
+        except Exception as e:
+            print(f"⚠ 重新加载配置失败: {e}")
+
+async def retry_unresolved_groups(interval=GROUP_RETRY_BASE):
+    """后台按退避间隔重试解析失败的群组（不用等到下一次定期刷新）"""
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        with group_index_lock:
+            due = [group for group, retry_at, _ in unresolved_groups.values() if retry_at <= now]
+        if not due:
+            continue
+        try:
+            resolved = await resolve_group_index(due)
+            if resolved:
+                print(f"[索引] 重试解析成功 {resolved}/{len(due)} 个群组")
+        except Exception as e:
+            print(f"⚠ 重试解析群组失败: {e}")
+
+async def refresh_group_index_periodically():
+    """后台定期刷新群组索引"""
+    while True:
+        await asyncio.sleep(GROUP_INDEX_REFRESH)
+        try:
+            resolved = await resolve_group_index()
+            print(f"[索引] 已刷新 {resolved}/{len(monitored_groups)} 个群组的 chat_id 索引")
+        except Exception as e:
+            print(f"⚠ 刷新群组索引失败: {e}")
+
+# ==================== 批量写入 ====================
+class MessageWriter:
+    """
+    批量消息写入器
+    
+    消息处理器把消息放入有界 asyncio 队列，后台协程按条数或时间攒批，
+    再交给专用写入线程落库，避免 SQLite 提交阻塞 Telethon 事件循环。
+    数据库管理器提供 save_messages 时一批消息在一个事务内提交；
+    旧版只有 save_message，仍按条提交（启动时提示，统计中 batch_insert 为 False）。
+    """
+    
+    def __init__(self, batch_size, flush_ms, queue_size):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_ms) / 1000
+        self.queue_size = queue_size
+        self.queue = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._task = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_batch': 0,
+            'max_depth': 0,
+            'blocked': 0,
+            'blocked_seconds': 0.0,
+            'commits': 0,
+        }
+    
+    @property
+    def batch_insert(self):
+        """数据库管理器是否支持一个事务写入一批消息"""
+        return hasattr(db_manager, 'save_messages')
+    
+    def start(self, loop):
+        """在客户端事件循环上启动攒批协程"""
+        if not self.batch_insert:
+            print("⚠ 数据库管理器没有 save_messages，消息仍逐条提交（攒批只减少线程切换，不减少事务数）")
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = loop.create_task(self._run())
+    
+    async def put(self, message_data):
+        """放入一条待写入消息，队列满时等待（背压）"""
+        if self.queue is None:
+            # 写入器未启动时直接写入
+            self._write_batch([message_data])
+            return
+        
+        if self.queue.full():
+            started = time.monotonic()
+            await self.queue.put(message_data)
+            with self._lock:
+                self.stats['blocked'] += 1
+                self.stats['blocked_seconds'] += time.monotonic() - started
+        else:
+            self.queue.put_nowait(message_data)
+        
+        with self._lock:
+            self.stats['enqueued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+    
+    async def _run(self):
+        """攒够 batch_size 条或等待 flush_interval 后提交一批"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._pending = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(self._pending) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            batch, self._pending = self._pending, []
+            await loop.run_in_executor(self.executor, self._write_batch, batch)
+    
+    def _write_batch(self, batch):
+        """在写入线程中落库一批消息"""
+        started = time.perf_counter()
+        try:
+            if self.batch_insert:
+                # 批量接口：单个事务内 executemany
+                db_manager.save_messages(batch)
+                commits = 1
+            else:
+                for message_data in batch:
+                    db_manager.save_message(message_data)
+                commits = len(batch)
+            with self._lock:
+                self.stats['written'] += len(batch)
+                self.stats['commits'] += commits
+                self.stats['batches'] += 1
+                self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            backfiller.note_written(batch)
+            invalidate_chunk_summaries(batch)
+            db_write_seconds.observe(time.perf_counter() - started)
+            db_write_batch_size.observe(len(batch))
+        except Exception as e:
+            with self._lock:
+                self.stats['failed'] += len(batch)
+            print(f"⚠ 批量写入 {len(batch)} 条消息失败: {e}")
+            return
+        
+        # 同步更新全文搜索索引
+        try:
+            search_index.add_messages(batch)
+        except Exception as e:
+            print(f"⚠ 更新搜索索引失败: {e}")
+    
+    async def flush(self):
+        """停止攒批协程，并写入所有尚未落库的消息"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        remaining, self._pending = self._pending, []
+        if self.queue is not None:
+            while not self.queue.empty():
+                remaining.append(self.queue.get_nowait())
+        
+        loop = asyncio.get_running_loop()
+        for i in range(0, len(remaining), self.batch_size):
+            batch = remaining[i:i + self.batch_size]
+            try:
+                await loop.run_in_executor(self.executor, self._write_batch, batch)
+            except RuntimeError:
+                # 解释器退出时（atexit）线程池已不接受新任务，直接在当前线程写入
+                self._write_batch(batch)
+        
+        if remaining:
+            print(f"✓ 已写入队列中剩余的 {len(remaining)} 条消息")
+    
+    def get_stats(self):
+        """获取写入统计（含队列深度和背压信息）"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize() if self.queue is not None else 0
+        stats['queue_size'] = self.queue_size
+        stats['blocked_seconds'] = round(stats['blocked_seconds'], 3)
+        stats['batch_insert'] = self.batch_insert
+        return stats
+
+message_writer = MessageWriter(WRITE_BATCH_SIZE, WRITE_FLUSH_MS, WRITE_QUEUE_SIZE)
+
+def flush_message_writer_on_exit(timeout=10):
+    """
+    进程退出时在客户端事件循环中写入尚未落库的消息，最多等待 timeout 秒
+    
+    开发模式下客户端运行在守护线程中，退出时不会执行 run_telegram_client 的 finally，
+    由 atexit 调用；客户端循环已经结束（已在 finally 中写入）时直接返回
+    """
+    loop = client_loop_ref
+    if loop is None or loop.is_closed() or not loop.is_running():
+        return
+    future = asyncio.run_coroutine_threadsafe(message_writer.flush(), loop)
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump({
-                'groups': monitored_groups,
-                'updated_at': datetime.now().isoformat()
-            }, f, ensure_ascii=False, indent=2)
+        future.result(timeout=timeout)
     except Exception as e:
-        print(f"⚠ 保存配置失败: {e}")
+        print(f"⚠ 退出时写入剩余消息失败: {e}")
 
-# 初始化配置
-load_config()
+atexit.register(flush_message_writer_on_exit)
 
-# ==================== Telegram客户端 ====================
-if USE_PROXY:
-    client = TelegramClient(SESSION_NAME, API_ID, API_HASH, proxy=PROXY_CONFIG)
-else:
-    client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+def handle_sigterm(signum, frame):
+    """SIGTERM（terminate()、容器停止）按正常退出处理，finally 和 atexit 中的清理才会执行"""
+    print("收到 SIGTERM，正在退出...")
+    sys.exit(128 + signum)
+
+# ==================== 群组统计 ====================
+# chat_id -> 群组统计（标题、用户名、消息数、最新消息），由消息处理器增量更新
+group_stats = {}
+group_stats_lock = threading.Lock()
+
+def load_group_stats(groups=None):
+    """
+    从数据库加载群组统计
+    
+    Args:
+        groups: 需要加载的群组列表，None 表示全部监控群组
+    """
+    try:
+        if hasattr(db_manager, 'get_group_stats'):
+            # 一次分组查询获取所有群组的统计
+            rows = db_manager.get_group_stats()
+        else:
+            # 兼容旧版数据库管理器：逐个群组查询
+            rows = []
+            for group in list(groups if groups is not None else monitored_groups):
+                if not group.startswith('@'):
+                    continue
+                latest_messages = db_manager.get_messages_by_chat_username(group[1:], limit=1)
+                if not latest_messages:
+                    continue
+                latest = latest_messages[0]
+                chat_id = latest.get('chat_id')
+                rows.append({
+                    'chat_id': chat_id,
+                    'chat_title': latest.get('chat_title'),
+                    'chat_username': latest.get('chat_username') or group[1:],
+                    'message_count': db_manager.get_message_count_by_chat(chat_id) if chat_id else 0,
+                    'last_message_id': latest.get('message_id'),
+                    'last_message_date': latest.get('message_date')
+                })
+        
+        with group_stats_lock:
+            for row in rows:
+                if row.get('chat_id') is not None:
+                    group_stats[row['chat_id']] = dict(row)
+    except Exception as e:
+        print(f"⚠ 加载群组统计失败: {e}")
+
+# 统计最后一次从数据库加载的时间（监听器在其他进程时定期刷新）
+group_stats_loaded_at = 0.0
+
+def refresh_group_stats_if_stale(max_age=5):
+    """监听器在其他进程时，统计超过 max_age 秒后从数据库重新加载"""
+    global group_stats_loaded_at
+    if LISTENER_IN_PROCESS or time.monotonic() - group_stats_loaded_at < max_age:
+        return
+    group_stats_loaded_at = time.monotonic()
+    load_group_stats()
+
+def record_group_message(message_data):
+    """收到新消息时增量更新群组统计"""
+    message_date = message_data['message_date']
+    if isinstance(message_date, datetime):
+        message_date = message_date.isoformat()
+    
+    with group_stats_lock:
+        stats = group_stats.setdefault(message_data['chat_id'], {
+            'chat_id': message_data['chat_id'],
+            'message_count': 0
+        })
+        stats['chat_title'] = message_data['chat_title']
+        stats['chat_username'] = message_data['chat_username']
+        stats['message_count'] += 1
+        # 补齐的旧消息不覆盖最新消息
+        if message_data['message_id'] >= (stats.get('last_message_id') or 0):
+            stats['last_message_id'] = message_data['message_id']
+            stats['last_message_date'] = message_date
+
+def group_stats_by_config():
+    """
+    一次遍历获取所有配置群组的统计（优先按 chat_id 索引匹配，其次按用户名匹配）
+    
+    Returns:
+        配置群组名 -> 统计字典，没有统计的群组不在结果中
+    """
+    result = {}
+    by_username = {}
+    with group_stats_lock:
+        for chat_id, stats in group_stats.items():
+            group = lookup_group(chat_id)
+            if group is not None:
+                result.setdefault(group, dict(stats))
+            if stats.get('chat_username'):
+                by_username.setdefault(stats['chat_username'].lower(), stats)
+        for group in monitored_groups:
+            if group not in result and group.startswith('@'):
+                stats = by_username.get(group[1:].lower())
+                if stats is not None:
+                    result[group] = dict(stats)
+    return result
+
+# ==================== 发送者缓存 ====================
+class SenderCache:
+    """发送者信息 LRU 缓存（带过期时间）：sender_id -> (username, 显示名)"""
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, sender_id):
+        """获取缓存的发送者信息，未命中或已过期返回 None"""
+        with self._lock:
+            item = self._items.get(sender_id)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[sender_id]
+                self.misses += 1
+                return None
+            self._items.move_to_end(sender_id)
+            self.hits += 1
+            return item[1]
+    
+    def put(self, sender_id, username, name):
+        """写入发送者信息，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0 or sender_id is None:
+            return
+        with self._lock:
+            self._items[sender_id] = (time.monotonic() + self.ttl, (username, name))
+            self._items.move_to_end(sender_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def warm(self, messages):
+        """用数据库中已保存的发送者字段预热缓存（不覆盖已有条目）"""
+        warmed = 0
+        for msg in messages:
+            sender_id = msg.get('sender_id')
+            if sender_id is None or sender_id in self._items:
+                continue
+            if msg.get('sender_username') or msg.get('sender_name'):
+                self.put(sender_id, msg.get('sender_username'), msg.get('sender_name'))
+                warmed += 1
+        return warmed
+    
+    def get_stats(self):
+        """获取缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+sender_cache = SenderCache(SENDER_CACHE_SIZE, SENDER_CACHE_TTL)
+
+def warm_sender_cache():
+    """从数据库预热发送者缓存"""
+    if SENDER_CACHE_SIZE <= 0:
+        return
+    try:
+        if hasattr(db_manager, 'get_recent_senders'):
+            messages = db_manager.get_recent_senders(limit=SENDER_CACHE_SIZE)
+        else:
+            # 兼容旧版数据库管理器：从各群组最近的消息中提取发送者
+            messages = []
+            per_group = max(1, SENDER_CACHE_SIZE // max(1, len(monitored_groups)))
+            for group in monitored_groups:
+                username = group[1:] if group.startswith('@') else group
+                messages.extend(db_manager.get_messages_by_chat_username(username, limit=per_group))
+        warmed = sender_cache.warm(messages)
+        print(f"✓ 已从数据库预热 {warmed} 个发送者缓存")
+    except Exception as e:
+        print(f"⚠ 预热发送者缓存失败: {e}")
+
+# ==================== 分发统计 ====================
+class DispatchCounter:
+    """统计每条消息被处理器调用的次数，用于发现重复分发"""
+    
+    def __init__(self, window=10000):
+        self.window = window
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.invocations = 0
+        self.duplicates = 0
+        self.max_per_message = 0
+    
+    def record(self, chat_id, message_id):
+        """记录一次处理器调用，返回该消息目前的调用次数"""
+        key = (chat_id, message_id)
+        with self._lock:
+            self.invocations += 1
+            count = self._seen.pop(key, 0) + 1
+            self._seen[key] = count
+            if count > 1:
+                self.duplicates += 1
+            self.max_per_message = max(self.max_per_message, count)
+            while len(self._seen) > self.window:
+                self._seen.popitem(last=False)
+        return count
+    
+    def seen(self, chat_id, message_id):
+        """消息最近是否已被处理器处理过（断线补齐时跳过）"""
+        with self._lock:
+            return (chat_id, message_id) in self._seen
+    
+    def get_stats(self):
+        """获取分发统计"""
+        with self._lock:
+            messages = self.invocations - self.duplicates
+            return {
+                'invocations': self.invocations,
+                'messages': messages,
+                'duplicates': self.duplicates,
+                'invocations_per_message': round(self.invocations / messages, 4) if messages else 0.0,
+                'max_per_message': self.max_per_message
+            }
+
+dispatch_counter = DispatchCounter()
+
+# ==================== 断线补齐 ====================
+class Backfiller:
+    """
+    断线补齐器
+    
+    记录每个群组已落库的最大 message_id（检查点）。客户端断线或进程重启后，
+    用 iter_messages 从断线时的检查点开始按时间顺序拉取错过的消息，
+    交给批量写入器落库；多个群组并发补齐，遇到 FloodWait 等待后从断点继续。
+    """
+    
+    def __init__(self, limit, concurrency):
+        self.limit = limit
+        self.concurrency = max(1, concurrency)
+        self._checkpoints = {}
+        self._lock = threading.Lock()
+        self.progress = {}
+        self.stats = {
+            'runs': 0,
+            'running': False,
+            'fetched': 0,
+            'skipped': 0,
+            'failed_groups': 0,
+            'flood_waits': 0,
+            'flood_wait_seconds': 0,
+            'last_run_at': None,
+            'last_run_seconds': None,
+            'messages_per_second': 0.0
+        }
+    
+    def seed_from_database(self, groups):
+        """进程启动时从数据库读取各群组最新一条消息作为检查点"""
+        seeded = 0
+        for group in groups:
+            username = group[1:] if group.startswith('@') else group
+            try:
+                latest = fetch_messages_page(username, 1)
+            except Exception as e:
+                print(f"⚠ 读取补齐检查点失败 ({group}): {e}")
+                continue
+            if latest:
+                self.note_written(latest)
+                seeded += 1
+        return seeded
+    
+    def note_written(self, batch):
+        """消息落库后推进检查点（在写入线程中调用）"""
+        with self._lock:
+            for msg in batch:
+                chat_id = msg['chat_id']
+                if msg['message_id'] > self._checkpoints.get(chat_id, 0):
+                    self._checkpoints[chat_id] = msg['message_id']
+    
+    def snapshot(self):
+        """断线时记录检查点：重连后新消息会推进检查点，补齐必须从断线时的位置开始"""
+        with self._lock:
+            return dict(self._checkpoints)
+    
+    async def run(self, gap_start):
+        """
+        补齐本进程监听的各群组在检查点之后错过的消息
+        
+        Args:
+            gap_start: chat_id -> 断线时的检查点（snapshot() 的返回值）
+        """
+        if self.limit <= 0 or not gap_start:
+            return
+        with group_index_lock:
+            targets = [(chat_id, group) for chat_id, group in group_index.items() if chat_id in gap_start]
+        if not targets:
+            return
+        
+        self.progress = {}
+        self.stats['runs'] += 1
+        self.stats['running'] = True
+        self.stats['last_run_at'] = datetime.now().isoformat()
+        fetched_before = self.stats['fetched']
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def backfill(chat_id, group):
+            async with semaphore:
+                await self._backfill_chat(chat_id, group, gap_start[chat_id])
+        
+        try:
+            await asyncio.gather(*(backfill(chat_id, group) for chat_id, group in targets))
+        finally:
+            elapsed = time.monotonic() - started
+            fetched = self.stats['fetched'] - fetched_before
+            self.stats['running'] = False
+            self.stats['last_run_seconds'] = round(elapsed, 3)
+            self.stats['messages_per_second'] = round(fetched / elapsed, 1) if elapsed else 0.0
+            print(f"[补齐] 完成 {len(targets)} 个群组，补齐 {fetched} 条消息，耗时 {elapsed:.1f} 秒")
+    
+    async def _backfill_chat(self, chat_id, group, min_id):
+        """补齐单个群组：按消息ID升序拉取，已由处理器处理过的消息跳过"""
+        from telethon import errors
+        progress = {'from_id': min_id, 'last_id': min_id, 'fetched': 0, 'skipped': 0, 'status': 'running'}
+        self.progress[group] = progress
+        try:
+            chat = await client.get_entity(group)
+            while True:
+                remaining = self.limit - progress['fetched'] - progress['skipped']
+                if remaining <= 0:
+                    progress['status'] = 'truncated'
+                    return
+                try:
+                    # 每次请求最多 100 条；wait_time 让连续请求之间留出间隔，降低触发限流的概率
+                    async for message in client.iter_messages(chat, min_id=progress['last_id'], reverse=True,
+                                                              limit=remaining, wait_time=1):
+                        progress['last_id'] = message.id
+                        if dispatch_counter.seen(chat_id, message.id):
+                            progress['skipped'] += 1
+                            self.stats['skipped'] += 1
+                            continue
+                        message_data = await build_message_data(message, chat)
+                        await message_writer.put(message_data)
+                        record_group_message(message_data)
+                        progress['fetched'] += 1
+                        self.stats['fetched'] += 1
+                    progress['status'] = 'done'
+                    return
+                except errors.FloodWaitError as e:
+                    # 等待限流结束后从 last_id 继续
+                    self.stats['flood_waits'] += 1
+                    self.stats['flood_wait_seconds'] += e.seconds
+                    flood_waits_total.inc(source='backfill')
+                    flood_wait_seconds_total.inc(e.seconds, source='backfill')
+                    progress['status'] = f'flood_wait {e.seconds}s'
+                    print(f"[补齐] {group} 触发限流，等待 {e.seconds} 秒")
+                    await asyncio.sleep(e.seconds)
+                    progress['status'] = 'running'
+        except Exception as e:
+            progress['status'] = 'failed'
+            progress['error'] = str(e)
+            self.stats['failed_groups'] += 1
+            print(f"⚠ 补齐群组消息失败 ({group}): {e}")
+    
+    def get_stats(self):
+        """获取补齐进度和吞吐"""
+        return dict(self.stats, limit=self.limit, concurrency=self.concurrency,
+                    groups={group: dict(progress) for group, progress in self.progress.items()})
+
+backfiller = Backfiller(BACKFILL_LIMIT, BACKFILL_CONCURRENCY)
 
 # ==================== 消息处理 ====================
+async def build_message_data(message, chat):
+    """
+    把 Telethon 消息转换为数据库存储的消息字典（新消息和断线补齐共用）
+    
+    Args:
+        message: Telethon 消息对象
+        chat: 消息所在的群组实体
+    """
+    chat_title = getattr(chat, 'title', None) or getattr(chat, 'username', None) or f"ID: {chat.id}"
+    
+    # 获取发送者信息
+    sender_id = message.sender_id
+    sender_username = None
+    sender_name = None
+    
+    cached_sender = sender_cache.get(sender_id) if sender_id is not None else None
+    if cached_sender:
+        sender_username, sender_name = cached_sender
+    else:
+        try:
+            sender = await message.get_sender()
+            if sender:
+                sender_username = getattr(sender, 'username', None)
+                first_name = getattr(sender, 'first_name', None) or ''
+                last_name = getattr(sender, 'last_name', None) or ''
+                sender_name = f"{first_name} {last_name}".strip() or None
+                sender_cache.put(sender_id, sender_username, sender_name)
+        except:
+            pass
+    
+    message_data = {
+        'message_id': message.id,
+        'chat_id': chat.id,
+        'chat_title': chat_title,
+        'chat_username': getattr(chat, 'username', None),
+        'sender_id': sender_id,
+        'sender_username': sender_username,
+        'sender_name': sender_name,
+        'message_text': message.text or '[非文本消息]',
+        'message_date': message.date if message.date else datetime.now()
+    }
+    # 纪元秒时间戳，供数据库按 (chat_id, message_ts) 索引做时间范围查询
+    message_data['message_ts'] = int(message_data['message_date'].timestamp())
+    return message_data
+
 async def message_handler(event):
     """
     处理新消息
@@ -267,71 +1415,59 @@ async def message_handler(event):
         event: Telethon事件对象
     """
     try:
+        started = time.perf_counter()
+        
         # 获取群组信息
         chat = await event.get_chat()
+        t_chat = time.perf_counter()
         chat_id = chat.id
+        # 按未标记的 chat_id 记录（event.chat_id 带 -100 前缀），与群组索引和断线补齐使用的键一致
+        dispatch_counter.record(chat_id, event.message.id)
         chat_title = getattr(chat, 'title', None) or getattr(chat, 'username', None) or f"ID: {chat_id}"
         chat_username = getattr(chat, 'username', None)
         
-        # 确定群组键名（优先使用配置中的名称）
-        group_key = None
-        if chat_username:
+        # 确定群组键名（优先使用索引，其次按用户名匹配）
+        group_key = lookup_group(chat_id)
+        if not group_key and chat_username:
             username_with_at = f"@{chat_username}"
             if username_with_at in monitored_groups:
                 group_key = username_with_at
             else:
-                # 尝试匹配不带@的
+                # 尝试匹配不带@的（用户名不区分大小写）
                 for group in monitored_groups:
-                    if group.startswith('@') and group[1:] == chat_username:
+                    if group.startswith('@') and group[1:].lower() == chat_username.lower():
                         group_key = group
                         break
+            if group_key:
+                index_group(chat_id, group_key)
         
-        # 如果没找到，使用群组标题
+        # 如果没找到，使用群组标题（索引由启动时和后台刷新维护）
         if not group_key:
-            # 尝试通过标题匹配
-            for group in monitored_groups:
-                try:
-                    entity = await client.get_entity(group)
-                    if entity.id == chat_id:
-                        group_key = group
-                        break
-                except:
-                    pass
-            
-            # 如果还是没找到，使用标题
-            if not group_key:
-                group_key = chat_title
+            group_key = chat_title
+        t_group = time.perf_counter()
         
-        # 获取发送者信息
-        sender_id = event.message.sender_id
-        sender_username = None
-        sender_name = None
+        # 构建消息数据（用于数据库存储）
+        message_data = await build_message_data(event.message, chat)
+        t_sender = time.perf_counter()
+        sender_id = message_data['sender_id']
+        sender_username = message_data['sender_username']
+        sender_name = message_data['sender_name']
         
-        try:
-            sender = await event.message.get_sender()
-            if sender:
-                sender_username = getattr(sender, 'username', None)
-                first_name = getattr(sender, 'first_name', None) or ''
-                last_name = getattr(sender, 'last_name', None) or ''
-                sender_name = f"{first_name} {last_name}".strip() or None
-        except:
-            pass
+        # 放入写入队列（由写入线程批量保存到数据库）
+        await message_writer.put(message_data)
+        t_enqueue = time.perf_counter()
+        record_group_message(message_data)
         
-        # 构建消息数据（用于数据库存储）
-        message_data = {
-            'message_id': event.message.id,
-            'chat_id': chat_id,
-            'chat_title': chat_title,
-            'chat_username': chat_username,
-            'sender_id': sender_id,
-            'sender_username': sender_username,
-            'sender_name': sender_name,
-            'message_text': event.message.text or '[非文本消息]',
-            'message_date': event.message.date if event.message.date else datetime.now()
-        }
+        # 推送给实时订阅者
+        stream_hub.publish('message', dict(message_data, group=group_key), group=group_key)
         
-        # 保存到数据库
-        db_manager.save_message(message_data)
+        # 各阶段耗时（落库耗时见 tg_db_write_seconds）
+        handler_stage_seconds.observe(t_chat - started, stage='get_chat')
+        handler_stage_seconds.observe(t_group - t_chat, stage='group_lookup')
+        handler_stage_seconds.observe(t_sender - t_group, stage='get_sender')
+        handler_stage_seconds.observe(t_enqueue - t_sender, stage='enqueue')
+        handler_stage_seconds.observe(time.perf_counter() - started, stage='total')
+        messages_total.inc(group=group_key)
         
         # 输出日志
         msg_preview = message_data['message_text'][:50] if message_data['message_text'] else '[非文本消息]'
@@ -339,66 +1475,650 @@ async def message_handler(event):
         print(f"\n[{chat_title}] [{sender_info}] 收到新消息: {msg_preview}...")
         
     except Exception as e:
-        print(f"⚠ 处理消息时出错: {e}")
-        import traceback
-        traceback.print_exc()
-
-def register_handlers():
-    """注册消息处理器"""
-    if monitored_groups:
-        try:
-            client.add_event_handler(message_handler, events.NewMessage(chats=monitored_groups))
-            print(f"✓ 已注册 {len(monitored_groups)} 个群组的消息处理器")
-        except Exception as e:
-            print(f"⚠ 注册处理器失败: {e}")
+        print(f"⚠ 处理消息时出错: {e}")
+        import traceback
+        traceback.print_exc()
+
+def is_monitored_chat(event):
+    """
+    消息过滤器：只处理群组索引中的 chat_id
+    
+    过滤条件直接读取可变的群组索引，增删群组时无需重新注册处理器；
+    解析失败、等待重试的群组按用户名放行，处理器匹配到后会写入索引
+    """
+    from telethon import utils
+    if utils.resolve_id(event.chat_id)[0] in group_index:
+        return True
+    if not unresolved_groups:
+        return False
+    username = getattr(event.chat, 'username', None)
+    return bool(username) and f'@{username.lower()}' in unresolved_groups
+
+def register_handlers():
+    """注册消息处理器（只注册一次，重复调用无副作用）"""
+    global handler_registered
+    if handler_registered:
+        return
+    from telethon import events
+    try:
+        client.add_event_handler(message_handler, events.NewMessage(func=is_monitored_chat))
+        handler_registered = True
+        print(f"✓ 已注册消息处理器，当前监控 {len(monitored_groups)} 个群组")
+    except Exception as e:
+        print(f"⚠ 注册处理器失败: {e}")
+
+# ==================== 消息历史管理 ====================
+# 消息历史已迁移到数据库，不再使用JSON文件
+
+# ==================== 消息查询 ====================
+def fetch_messages_in_window(username, limit, since_ts=None, until_ts=None):
+    """
+    按时间范围获取群组消息（最新的在前）
+    
+    Args:
+        username: 群组用户名（不带@）
+        limit: 最多返回的消息数
+        since_ts: 起始时间（纪元秒，包含），None 表示不限
+        until_ts: 结束时间（纪元秒，不包含），None 表示不限
+    """
+    if since_ts is None and until_ts is None:
+        return db_manager.get_messages_by_chat_username(username, limit=limit)
+    
+    if not hasattr(db_manager, 'get_messages_in_range'):
+        # 旧版数据库管理器只能读取最新的 N 条，多取后在内存中过滤会漏掉窗口内较早的消息，不做这种兼容
+        raise RuntimeError('数据库管理器不支持按时间范围查询（需要 DatabaseManager.get_messages_in_range）')
+    
+    # 数据库按 (chat_id, message_ts) 索引过滤
+    return db_manager.get_messages_in_range(username, since_ts=since_ts, until_ts=until_ts, limit=limit)
+
+def fetch_messages_page(username, limit, before_id=None, after_id=None):
+    """
+    按消息ID游标分页获取群组消息（最新的在前）
+    
+    Args:
+        username: 群组用户名（不带@）
+        limit: 每页消息数
+        before_id: 只返回 message_id 小于该值的消息（向更早翻页）
+        after_id: 只返回 message_id 大于该值的消息（获取更新的消息）
+    """
+    if before_id is None and after_id is None:
+        return db_manager.get_messages_by_chat_username(username, limit=limit)
+    
+    if not hasattr(db_manager, 'get_messages_page'):
+        # 旧版数据库管理器只能读取最新的 N 条，翻得越深读得越多，不做这种兼容
+        raise RuntimeError('数据库管理器不支持游标分页（需要 DatabaseManager.get_messages_page）')
+    
+    # 数据库按 (chat_id, message_id) 索引定位，每页成本与第一页相同
+    return db_manager.get_messages_page(username, limit=limit, before_id=before_id, after_id=after_id)
+
+def format_message_line(msg):
+    """把一条消息格式化为总结用的一行：[日期] 发送者: 内容"""
+    sender = msg.get('sender_username') or msg.get('sender_name') or f"ID:{msg.get('sender_id')}"
+    text = msg.get('message_text', '[非文本消息]')
+    date = msg.get('message_date', '')
+    date_str = date[:10] if date else ''  # 只取日期部分
+    return f"[{date_str}] {sender}: {text}"
+
+def format_message_content(messages):
+    """把消息格式化为总结用的文本，每行一条"""
+    return '\n'.join(format_message_line(msg) for msg in messages)
+
+# ==================== 增量总结 ====================
+# 分块总结的时间粒度（秒）
+SUMMARY_CHUNK_SECONDS = 3600
+
+def invalidate_chunk_summaries(batch):
+    """
+    删除已保存但又写入了新消息的小时分块总结（断线补齐、延迟落库的消息），下次请求重新生成
+    
+    Args:
+        batch: 刚落库的消息列表
+    """
+    now = int(time.time())
+    current_chunk = now - now % SUMMARY_CHUNK_SECONDS
+    stale = {}
+    for message_data in batch:
+        ts = message_data.get('message_ts')
+        # 当前小时还没有分块总结
+        if ts is None or ts >= current_chunk:
+            continue
+        group = lookup_group(message_data['chat_id'])
+        if group is None and message_data.get('chat_username'):
+            group = f"@{message_data['chat_username']}"
+        if group is not None:
+            stale.setdefault(group, set()).add(ts - ts % SUMMARY_CHUNK_SECONDS)
+    try:
+        for group, chunk_ts_list in stale.items():
+            chunk_store.delete_chunks(group, chunk_ts_list)
+    except Exception as e:
+        print(f"⚠ 清除过期的分块总结失败: {e}")
+
+def build_chunk_summaries(group_name, username, chat_title, since_ts, until_ts, limit):
+    """
+    获取时间范围内的小时分块总结，缺失的完整小时即时生成并保存
+    
+    Args:
+        group_name: 群组配置名
+        username: 群组用户名（不带@）
+        chat_title: 群组标题
+        since_ts: 起始时间（纪元秒，向下取整到小时）
+        until_ts: 结束时间（纪元秒，应为整点，之后的消息属于尾部）
+        limit: 每个分块最多使用的消息数
+    
+    Yields:
+        (分块字典, 是否新生成)，按时间顺序
+    """
+    prompt_config = summarizer.prompts.get('chunk_summary', {})
+    user_template = prompt_config.get('user_template', '请简要总结群组「{group_name}」在 {period} 的消息要点：\n\n{content}')
+    system_prompt = prompt_config.get('system', '你是一个专业的总结助手。')
+    max_tokens = prompt_config.get('max_tokens', 500)
+    
+    first_chunk = since_ts - since_ts % SUMMARY_CHUNK_SECONDS
+    stored = chunk_store.get_chunks(group_name, first_chunk, until_ts)
+    
+    for chunk_ts in range(first_chunk, until_ts, SUMMARY_CHUNK_SECONDS):
+        if chunk_ts in stored:
+            yield stored[chunk_ts], False
+            continue
+        
+        chunk_messages = fetch_messages_in_window(
+            username, limit, since_ts=chunk_ts, until_ts=chunk_ts + SUMMARY_CHUNK_SECONDS
+        )
+        summary = ''
+        if chunk_messages:
+            period = datetime.fromtimestamp(chunk_ts, timezone.utc).strftime('%Y-%m-%d %H:00 UTC')
+            user_prompt = user_template.format(
+                group_name=chat_title, period=period, content=format_message_content(chunk_messages)
+            )
+            summary = summarizer.client.chat([
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': user_prompt}
+            ], max_tokens=max_tokens)
+            if not summary:
+                # 生成失败时不保存，下次请求重试
+                continue
+        
+        last_message_id = chunk_messages[0].get('message_id') if chunk_messages else None
+        chunk = chunk_store.put_chunk(group_name, chunk_ts, summary or '', len(chunk_messages), last_message_id)
+        yield chunk, True
+
+def summarize_incremental(group_name, username, days, limit, since_ts, use_stream):
+    """
+    增量总结：合并已保存的小时分块总结和当前小时的最新消息
+    
+    完整的小时只在第一次请求时总结一次，之后的请求只需把分块总结
+    和少量尾部消息发送给 AI，长时间窗口的成本和首字节延迟大幅降低
+    """
+    now = int(time.time())
+    tail_since = now - now % SUMMARY_CHUNK_SECONDS
+    tail_messages = fetch_messages_in_window(username, limit, since_ts=max(since_ts, tail_since))
+    
+    latest = tail_messages[0] if tail_messages else None
+    if latest is None:
+        latest_messages = db_manager.get_messages_by_chat_username(username, limit=1)
+        latest = latest_messages[0] if latest_messages else None
+    if latest is None:
+        return jsonify({
+            'success': False,
+            'message': '该群组暂无消息'
+        })
+    chat_title = latest.get('chat_title', group_name)
+    
+    prompt_config = summarizer.prompts.get('rolling_summary', {})
+    user_template = prompt_config.get(
+        'user_template',
+        '以下是群组「{group_name}」按小时整理的分段总结和最新消息，请合并为一份完整的总结：\n\n{content}'
+    )
+    system_prompt = prompt_config.get('system', '你是一个专业的总结助手。')
+    max_tokens = prompt_config.get('max_tokens', 3000)
+    
+    def build_prompt(chunks):
+        """拼接分块总结和尾部消息"""
+        sections = []
+        for chunk in chunks:
+            period = datetime.fromtimestamp(chunk['chunk_ts'], timezone.utc).strftime('%Y-%m-%d %H:00')
+            sections.append(f"### {period}\n{chunk['summary']}")
+        content = '## 分段总结\n' + ('\n\n'.join(sections) or '（无）')
+        content += '\n\n## 最新消息\n' + (format_message_content(tail_messages) or '（无）')
+        return [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_template.format(group_name=chat_title, content=content)}
+        ]
+    
+    def result(summary, chunks):
+        """保存滚动总结并构造结果"""
+        message_count = sum(chunk['message_count'] for chunk in chunks) + len(tail_messages)
+        chunk_store.put_rolling(group_name, summary, since_ts, now, latest.get('message_id'))
+        return {
+            'summary': summary,
+            'message_count': message_count,
+            'chunk_count': len(chunks),
+            'tail_count': len(tail_messages),
+            'date_range': {
+                'start': datetime.fromtimestamp(since_ts, timezone.utc).strftime('%Y-%m-%d'),
+                'end': datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d')
+            },
+            'days': days,
+            'mode': 'incremental'
+        }
+    
+    if use_stream and hasattr(summarizer.client, 'chat_stream'):
+        def generate():
+            yield f"data: {json.dumps({'type': 'start', 'group': chat_title, 'mode': 'incremental'}, ensure_ascii=False)}\n\n"
+            try:
+                chunks = []
+                for chunk, created in build_chunk_summaries(group_name, username, chat_title, since_ts, tail_since, limit):
+                    if created:
+                        yield f"data: {json.dumps({'type': 'progress', 'chunk_ts': chunk['chunk_ts'], 'message_count': chunk['message_count']}, ensure_ascii=False)}\n\n"
+                    if chunk['summary']:
+                        chunks.append(chunk)
+                
+                full_summary = ""
+                for piece in summarizer.client.chat_stream(build_prompt(chunks), max_tokens=max_tokens):
+                    if piece:
+                        full_summary += piece
+                        yield f"data: {json.dumps({'type': 'chunk', 'content': piece}, ensure_ascii=False)}\n\n"
+                
+                yield f"data: {json.dumps({'type': 'done', **result(full_summary, chunks)}, ensure_ascii=False)}\n\n"
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    
+    chunks = [
+        chunk for chunk, _ in build_chunk_summaries(group_name, username, chat_title, since_ts, tail_since, limit)
+        if chunk['summary']
+    ]
+    summary = summarizer.client.chat(build_prompt(chunks), max_tokens=max_tokens)
+    if not summary:
+        return jsonify({
+            'success': False,
+            'message': 'AI 总结生成失败，请检查 API 配置'
+        })
+    
+    return jsonify({
+        'success': True,
+        'group': chat_title,
+        'group_name': group_name,
+        **result(summary, chunks)
+    })
+
+# ==================== 分块并行总结 ====================
+# 各请求共用的分块总结线程池（大模型网关另有全局并发上限）
+summary_map_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, MAP_REDUCE_WORKERS), thread_name_prefix='summary-map'
+)
+
+def split_into_chunks(messages, chunk_tokens):
+    """
+    把消息按时间顺序切分为分块
+    
+    Args:
+        messages: 消息列表（最新的在前）
+        chunk_tokens: 每个分块的 token 数上限
+    
+    Returns:
+        分块列表（从旧到新），每个分块内的消息从旧到新
+    """
+    chunks = []
+    current = []
+    used = 0
+    for msg in reversed(messages):
+        tokens = estimate_tokens(format_message_line(msg)) + 1
+        if current and used + tokens > chunk_tokens:
+            chunks.append(current)
+            current = []
+            used = 0
+        current.append(msg)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def summarize_map_reduce(group_name, chat_title, messages, days, since_ts, until_ts, limit, use_stream, use_cache):
+    """
+    分块并行总结：按时间切分消息，线程池并行总结各分块（map），再合并为最终总结（reduce）
+    
+    长时间窗口不再受单次超长生成的耗时限制，总耗时约为最慢的分块加上合并
+    
+    Args:
+        messages: 时间范围内的消息（最新的在前）
+        since_ts, until_ts: 解析后的时间范围（纪元秒），用于缓存键
+    
+    Returns:
+        Flask 响应，消息只够一个分块时返回 None（调用方按普通方式总结）
+    """
+    messages, packing = pack_messages(
+        messages, MAP_REDUCE_CHUNK_TOKENS * max(1, MAP_REDUCE_MAX_CHUNKS), format_message_line
+    )
+    # 分块边界处的零头可能多出一个分块，只保留最新的 MAP_REDUCE_MAX_CHUNKS 个
+    chunks = split_into_chunks(messages, MAP_REDUCE_CHUNK_TOKENS)[-max(1, MAP_REDUCE_MAX_CHUNKS):]
+    if len(chunks) <= 1:
+        return None
+    message_count = sum(len(chunk) for chunk in chunks)
+    
+    map_config = summarizer.prompts.get('map_summary') or summarizer.prompts.get('chunk_summary', {})
+    map_template = map_config.get('user_template', '请简要总结群组「{group_name}」在 {period} 的消息要点：\n\n{content}')
+    map_system = map_config.get('system', '你是一个专业的总结助手。')
+    map_max_tokens = map_config.get('max_tokens', 500)
+    
+    reduce_config = summarizer.prompts.get('reduce_summary', {})
+    reduce_template = reduce_config.get(
+        'user_template',
+        '以下是群组「{group_name}」按时间顺序整理的分段总结，请合并为一份完整的总结：\n\n{content}'
+    )
+    reduce_system = reduce_config.get('system', '你是一个专业的总结助手。')
+    max_tokens = reduce_config.get('max_tokens', 3000)
+    
+    def period_of(chunk):
+        return f"{str(chunk[0].get('message_date') or '')[:16]} ~ {str(chunk[-1].get('message_date') or '')[:16]}"
+    
+    def summarize_chunk(chunk):
+        started = time.monotonic()
+        summary = summarizer.client.chat([
+            {'role': 'system', 'content': map_system},
+            {'role': 'user', 'content': map_template.format(
+                group_name=chat_title, period=period_of(chunk), content=format_message_content(chunk)
+            )}
+        ], max_tokens=map_max_tokens)
+        return summary, time.monotonic() - started
+    
+    def build_reduce_prompt(partials):
+        sections = [f"### {period_of(chunks[i])}\n{summary}" for i, summary in sorted(partials.items())]
+        return [
+            {'role': 'system', 'content': reduce_system},
+            {'role': 'user', 'content': reduce_template.format(group_name=chat_title, content='\n\n'.join(sections))}
+        ]
+    
+    date_range = {
+        'start': str(chunks[0][0].get('message_date') or '')[:10],
+        'end': str(chunks[-1][-1].get('message_date') or '')[:10]
+    }
+    cache_key = summary_cache.make_key(
+        group_name, since_ts, until_ts, limit,
+        'map_reduce:' + prompt_version({'map': map_config, 'reduce': reduce_config, 'chunk_tokens': MAP_REDUCE_CHUNK_TOKENS}),
+        messages[0].get('message_id')
+    )
+    cached = summary_cache.get(cache_key) if use_cache else None
+    
+    def result(summary, map_seconds=0.0, failed=0, is_cached=False):
+        return {
+            'summary': summary,
+            'message_count': message_count,
+            'packing': packing,
+            'chunk_count': len(chunks),
+            'failed_chunks': failed,
+            'map_seconds': round(map_seconds, 3),
+            'date_range': date_range,
+            'days': days,
+            'mode': 'map_reduce',
+            'cached': is_cached
+        }
+    
+    def run_map():
+        """
+        并行总结所有分块
+        
+        Yields:
+            (分块序号, 分块总结, 耗时)，按完成顺序
+        """
+        futures = {summary_map_executor.submit(summarize_chunk, chunk): i for i, chunk in enumerate(chunks)}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    summary, seconds = future.result()
+                except Exception as e:
+                    print(f"⚠ 分块总结失败: {e}")
+                    summary, seconds = None, 0.0
+                yield futures[future], summary, seconds
+        finally:
+            # 调用方中途断开时取消尚未开始的分块
+            for future in futures:
+                future.cancel()
+    
+    def save(summary, failed):
+        # 有分块失败时不缓存，下次请求重试
+        if summary and not failed:
+            summary_cache.put(cache_key, group_name, {
+                'summary': summary,
+                'message_count': message_count,
+                'date_range': date_range
+            })
+    
+    if use_stream and (cached or hasattr(summarizer.client, 'chat_stream')):
+        def generate():
+            yield f"data: {json.dumps({'type': 'start', 'group': chat_title, 'mode': 'map_reduce', 'message_count': message_count, 'chunk_count': len(chunks), 'packing': packing, 'cached': bool(cached)}, ensure_ascii=False)}\n\n"
+            
+            if cached:
+                yield f"data: {json.dumps({'type': 'chunk', 'content': cached['summary']}, ensure_ascii=False)}\n\n"
+                yield f"data: {json.dumps({'type': 'done', **result(cached['summary'], is_cached=True)}, ensure_ascii=False)}\n\n"
+                return
+            
+            try:
+                started = time.monotonic()
+                partials = {}
+                failed = 0
+                for index, summary, seconds in run_map():
+                    if summary:
+                        partials[index] = summary
+                    else:
+                        failed += 1
+                    yield f"data: {json.dumps({'type': 'progress', 'chunk': index, 'chunk_count': len(chunks), 'completed': len(partials) + failed, 'message_count': len(chunks[index]), 'period': period_of(chunks[index]), 'ok': bool(summary), 'seconds': round(seconds, 3)}, ensure_ascii=False)}\n\n"
+                map_seconds = time.monotonic() - started
+                if not partials:
+                    yield f"data: {json.dumps({'type': 'error', 'message': '所有分块总结均失败，请检查 API 配置'}, ensure_ascii=False)}\n\n"
+                    return
+                
+                full_summary = ""
+                for piece in summarizer.client.chat_stream(build_reduce_prompt(partials), max_tokens=max_tokens):
+                    if piece:
+                        full_summary += piece
+                        yield f"data: {json.dumps({'type': 'chunk', 'content': piece}, ensure_ascii=False)}\n\n"
+                
+                save(full_summary, failed)
+                yield f"data: {json.dumps({'type': 'done', **result(full_summary, map_seconds, failed)}, ensure_ascii=False)}\n\n"
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    
+    if cached:
+        summary = cached['summary']
+        payload = result(summary, is_cached=True)
+    else:
+        started = time.monotonic()
+        partials = {}
+        for index, summary, _ in run_map():
+            if summary:
+                partials[index] = summary
+        map_seconds = time.monotonic() - started
+        failed = len(chunks) - len(partials)
+        summary = summarizer.client.chat(build_reduce_prompt(partials), max_tokens=max_tokens) if partials else None
+        if not summary:
+            return jsonify({
+                'success': False,
+                'message': 'AI 总结生成失败，请检查 API 配置'
+            })
+        save(summary, failed)
+        payload = result(summary, map_seconds, failed)
+    
+    return jsonify({
+        'success': True,
+        'group': chat_title,
+        'group_name': group_name,
+        **payload
+    })
+
+# ==================== 群组验证 ====================
+def describe_group_error(group, e):
+    """把解析群组时的异常转换为给用户看的提示"""
+    error_type = type(e).__name__
+    error_msg = str(e)
+    
+    if isinstance(e, ValueError):
+        # 群组不存在或未找到
+        if 'not found' in error_msg.lower() or 'could not find' in error_msg.lower():
+            return f'群组不存在: {group}。请检查：\n1. 群组名称是否正确\n2. 是否已加入该群组\n3. 群组是否为公开群组'
+        return f'无法找到群组: {error_msg}'
+    
+    # 根据错误类型提供更详细的提示
+    if 'Username' in error_type or 'username' in error_msg.lower():
+        return f'群组名称无效: {group}。请确认群组名是否正确（包括大小写）'
+    if 'Forbidden' in error_type or 'forbidden' in error_msg.lower():
+        return f'无权限访问: {group}。请确认已加入该群组'
+    if 'FloodWait' in error_type:
+        return '请求过于频繁，请稍后再试'
+    if 'Timeout' in error_type or 'timeout' in error_msg.lower():
+        return '连接超时。请检查网络连接和代理设置'
+    return f'验证失败: {error_msg[:100]}'
+
+async def verify_group(group):
+    """
+    验证群组是否存在（在客户端事件循环中执行）
+    
+    Returns:
+        (是否有效, 错误提示, 群组标题, chat_id)
+    """
+    try:
+        # 直接使用已连接的客户端（连接状态已在上层检查）
+        print(f"[验证] 正在验证群组: {group}")
+        entity = await client.get_entity(group)
+        
+        # 获取群组信息
+        chat_title = getattr(entity, 'title', None) or getattr(entity, 'username', None) or f"ID: {entity.id}"
+        chat_type = type(entity).__name__
+        
+        print(f"[验证] ✓ 群组验证成功: {group} ({chat_title}, 类型: {chat_type})")
+        return True, None, chat_title, entity.id
+    except Exception as e:
+        error_detail = describe_group_error(group, e)
+        print(f"[验证] ✗ 群组验证失败 ({group}): {type(e).__name__} - {error_detail}")
+        return False, error_detail, None, None
 
-# ==================== 消息历史管理 ====================
-# 消息历史已迁移到数据库，不再使用JSON文件
+async def verify_groups_bulk(groups, on_result, concurrency=5, max_flood_wait=120, max_attempts=3):
+    """
+    并发验证多个群组（在客户端事件循环中执行）
+    
+    遇到 FloodWait 时所有请求一起暂停到限流结束再重试，
+    等待时间超过 max_flood_wait 秒或重试 max_attempts 次后放弃该群组。
+    
+    Args:
+        groups: 群组列表
+        on_result: 每个群组验证完成后的回调，参数为结果字典
+        concurrency: 同时进行的请求数
+    
+    Returns:
+        验证通过的结果字典列表
+    """
+    from telethon import errors
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    resume_at = 0.0
+    valid = []
+    
+    async def verify(group):
+        nonlocal resume_at
+        attempts = 0
+        while True:
+            delay = resume_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with semaphore:
+                try:
+                    entity = await client.get_entity(group)
+                except errors.FloodWaitError as e:
+                    attempts += 1
+                    flood_waits_total.inc(source='add_groups')
+                    flood_wait_seconds_total.inc(e.seconds, source='add_groups')
+                    if e.seconds > max_flood_wait or attempts >= max_attempts:
+                        result = {'group': group, 'success': False, 'message': describe_group_error(group, e)}
+                        break
+                    resume_at = max(resume_at, loop.time() + e.seconds)
+                    on_result({'group': group, 'status': 'flood_wait', 'seconds': e.seconds})
+                    continue
+                except Exception as e:
+                    result = {'group': group, 'success': False, 'message': describe_group_error(group, e)}
+                    break
+            chat_title = getattr(entity, 'title', None) or getattr(entity, 'username', None) or f"ID: {entity.id}"
+            result = {'group': group, 'success': True, 'chat_title': chat_title, 'chat_id': entity.id}
+            valid.append(result)
+            break
+        on_result(result)
+    
+    await asyncio.gather(*(verify(group) for group in groups))
+    return valid
 
 # ==================== Flask Web服务器 ====================
 app = Flask(__name__, template_folder='web/templates', static_folder='web/static')
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                     method=request.method, status=response.status_code)
+    return response
+
 @app.route('/')
 def index():
     """主页面 - 返回HTML文件"""
     return render_template('index.html')
 
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus 格式的运行指标（监听器在其他进程时一并导出它的指标）"""
+    sources = []
+    if not LISTENER_IN_PROCESS:
+        status = read_listener_status(with_metrics=True)
+        for listener in status.get('shards') or [status]:
+            labels = {'process': 'listener'}
+            if 'shard' in listener:
+                labels['shard'] = str(listener['shard'])
+            sources.append((listener.get('metrics'), labels))
+    return Response(metrics.render(sources), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/groups', methods=['GET'])
 def api_get_groups():
     """获取群组列表API"""
     global monitored_groups
     
     try:
+        refresh_group_stats_if_stale()
+        
+        # 从内存统计获取群组信息和消息数量（一次遍历，不逐个群组扫描全部统计）
+        stats_by_group = group_stats_by_config()
         groups_with_info = []
-        for group in monitored_groups:
-            display_name = group
-            message_count = 0
-            
-            # 尝试从数据库获取群组信息和消息数量
-            try:
-                if group.startswith('@'):
-                    username = group[1:]
-                    # 获取最新消息来显示群组名称
-                    latest_messages = db_manager.get_messages_by_chat_username(username, limit=1)
-                    if latest_messages:
-                        display_name = latest_messages[0].get('chat_title', group)
-                        # 获取消息总数
-                        chat_id = latest_messages[0].get('chat_id')
-                        if chat_id:
-                            message_count = db_manager.get_message_count_by_chat(chat_id)
-            except:
-                pass
-            
+        for group in list(monitored_groups):
+            stats = stats_by_group.get(group) or {}
             groups_with_info.append({
                 'config_name': group,
-                'display_name': display_name,
-                'message_count': message_count
+                'display_name': stats.get('chat_title') or group,
+                'chat_id': stats.get('chat_id'),
+                'message_count': stats.get('message_count', 0),
+                'last_message_date': stats.get('last_message_date')
             })
         
-        return jsonify({
+        # 群组列表和各群组的最新消息不变时返回 304
+        etag = make_etag('groups', [
+            (info['config_name'], info['display_name'], info['message_count'],
+             stats_by_group.get(info['config_name'], {}).get('last_message_id'))
+            for info in groups_with_info
+        ])
+        dates = [parse_timestamp(info['last_message_date']) for info in groups_with_info]
+        last_modified = max((date for date in dates if date is not None), default=None)
+        
+        return conditional_json(lambda: {
             'success': True,
             'groups': groups_with_info
-        })
+        }, etag, last_modified)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -410,6 +2130,19 @@ def api_get_groups():
 @app.route('/api/status', methods=['GET'])
 def api_status():
     """获取状态API"""
+    if not LISTENER_IN_PROCESS:
+        # 监听器在其他进程，读取它定期写入的状态
+        status = read_listener_status()
+        return jsonify({
+            'is_connected': status.get('is_connected', False),
+            'groups': monitored_groups,
+            'role': ROLE,
+            'listener': status,
+            'summary_cache': summary_cache.get_stats(),
+            'llm': llm_gateway.get_stats() if llm_gateway is not None else None,
+            'stream': stream_hub.get_stats()
+        })
+    
     try:
         is_connected = client.is_connected()
     except:
@@ -417,7 +2150,16 @@ def api_status():
     
     return jsonify({
         'is_connected': is_connected,
-        'groups': monitored_groups
+        'groups': monitored_groups,
+        'dispatch': dispatch_counter.get_stats(),
+        'writer': message_writer.get_stats(),
+        'backfill': backfiller.get_stats(),
+        'retention': retention_engine.get_stats(),
+        'sender_cache': sender_cache.get_stats(),
+        'summary_cache': summary_cache.get_stats(),
+        'llm': llm_gateway.get_stats() if llm_gateway is not None else None,
+        'config': config_store.get_stats(),
+        'stream': stream_hub.get_stats()
     })
 
 @app.route('/api/groups/<group_name>/messages', methods=['GET'])
@@ -427,7 +2169,13 @@ def api_get_group_messages(group_name):
         from urllib.parse import unquote
         group_name = unquote(group_name)
         
-        limit = int(request.args.get('limit', 100))
+        # 非整数退回默认值；0 或负数会让 next_cursor 失效，过大则分页失去意义
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        # 游标分页：before_id 取更早的消息，after_id 取更新的消息
+        before_id = request.args.get('before_id', type=int)
+        if before_id is None:
+            before_id = request.args.get('cursor', type=int)
+        after_id = request.args.get('after_id', type=int)
         
         # 处理群组名（去掉@符号）
         if group_name.startswith('@'):
@@ -436,14 +2184,24 @@ def api_get_group_messages(group_name):
             username = group_name
         
         # 从数据库获取消息
-        messages = db_manager.get_messages_by_chat_username(username, limit=limit)
+        messages = fetch_messages_page(username, limit, before_id=before_id, after_id=after_id)
         
-        return jsonify({
+        # 校验值取自这一页实际的消息（而不是内存统计，统计可能先于落库更新），
+        # 页内最新的 message_id 不变时返回 304，省去序列化、压缩和传输
+        etag = make_etag('messages', group_name, limit, before_id, after_id, len(messages),
+                         messages[0]['message_id'] if messages else None,
+                         messages[-1]['message_id'] if messages else None)
+        last_modified = parse_timestamp(messages[0].get('message_date')) if messages else None
+        
+        return conditional_json(lambda: {
             'success': True,
             'group': group_name,
             'messages': messages,
-            'count': len(messages)
-        })
+            'count': len(messages),
+            # 不足一页说明没有更早的消息了
+            'next_cursor': str(messages[-1]['message_id']) if len(messages) >= limit else None,
+            'prev_cursor': str(messages[0]['message_id']) if messages else (str(after_id) if after_id is not None else None)
+        }, etag, last_modified)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -452,6 +2210,101 @@ def api_get_group_messages(group_name):
             'message': f'获取消息失败: {str(e)}'
         })
 
+@app.route('/api/stream', methods=['GET'])
+def api_stream():
+    """实时消息推送API（SSE），支持 Last-Event-ID 断线续传"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    groups = [g.strip() for g in request.args.get('groups', '').split(',') if g.strip()]
+    sub = stream_hub.subscribe(last_event_id=last_event_id, groups=groups or None)
+    
+    return Response(
+        stream_with_context(stream_hub.iter_frames(sub)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """全文搜索消息API"""
+    try:
+        query = request.args.get('q', '').strip()
+        group = request.args.get('group', '').strip()
+        sender = request.args.get('sender', '').strip()
+        since_ts = request.args.get('since', type=int)
+        until_ts = request.args.get('until', type=int)
+        # 负数的 LIMIT 在 SQLite 中表示不限，上下限都要约束
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        offset = max(0, request.args.get('offset', 0, type=int))
+        
+        if not query and not sender:
+            return jsonify({'success': False, 'message': '搜索词不能为空'})
+        
+        started = time.monotonic()
+        results = search_index.search(
+            query,
+            chat_username=group[1:] if group.startswith('@') else (group or None),
+            sender=sender or None,
+            since_ts=since_ts,
+            until_ts=until_ts,
+            limit=limit,
+            offset=offset
+        )
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': results,
+            'count': len(results),
+            'took_ms': round((time.monotonic() - started) * 1000, 2)
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'message': f'搜索失败: {str(e)}'
+        })
+
+@app.route('/api/archive', methods=['GET'])
+def api_archive():
+    """查询已归档的旧消息API（按群组、时间范围和关键词）"""
+    try:
+        query = request.args.get('q', '').strip()
+        group = request.args.get('group', '').strip()
+        since_ts = request.args.get('since', type=int)
+        until_ts = request.args.get('until', type=int)
+        # 上下限都要约束（负数的 limit 会让切片丢掉结果末尾而不是限制条数）
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        
+        started = time.monotonic()
+        results = message_archive.query(
+            chat_username=group[1:] if group.startswith('@') else (group or None),
+            since_ts=since_ts,
+            until_ts=until_ts,
+            text=query or None,
+            limit=limit
+        )
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(results),
+            'months': message_archive.months(),
+            'took_ms': round((time.monotonic() - started) * 1000, 2)
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'message': f'查询归档失败: {str(e)}'
+        })
+
 @app.route('/api/add_group', methods=['POST'])
 def api_add_group():
     """添加群组API"""
@@ -469,51 +2322,10 @@ def api_add_group():
         if group in monitored_groups:
             return jsonify({'success': False, 'message': '群组已存在'})
         
-        # 验证群组是否存在
-        async def verify_group():
-            error_detail = None
-            try:
-                # 直接使用已连接的客户端（连接状态已在上层检查）
-                # 尝试获取群组实体
-                print(f"[验证] 正在验证群组: {group}")
-                entity = await client.get_entity(group)
-                
-                # 获取群组信息
-                chat_title = getattr(entity, 'title', None) or getattr(entity, 'username', None) or f"ID: {entity.id}"
-                chat_type = type(entity).__name__
-                
-                print(f"[验证] ✓ 群组验证成功: {group} ({chat_title}, 类型: {chat_type})")
-                return True, None, chat_title
-                
-            except ValueError as e:
-                # 群组不存在或未找到
-                error_msg = str(e)
-                if 'not found' in error_msg.lower() or 'could not find' in error_msg.lower():
-                    error_detail = f'群组不存在: {group}。请检查：\n1. 群组名称是否正确\n2. 是否已加入该群组\n3. 群组是否为公开群组'
-                else:
-                    error_detail = f'无法找到群组: {error_msg}'
-                print(f"[验证] ✗ 群组验证失败 ({group}): {error_detail}")
-                return False, error_detail, None
-                
-            except Exception as e:
-                # 其他错误
-                error_type = type(e).__name__
-                error_msg = str(e)
-                
-                # 根据错误类型提供更详细的提示
-                if 'Username' in error_type or 'username' in error_msg.lower():
-                    error_detail = f'群组名称无效: {group}。请确认群组名是否正确（包括大小写）'
-                elif 'Forbidden' in error_type or 'forbidden' in error_msg.lower():
-                    error_detail = f'无权限访问: {group}。请确认已加入该群组'
-                elif 'FloodWait' in error_type:
-                    error_detail = f'请求过于频繁，请稍后再试'
-                elif 'Timeout' in error_type or 'timeout' in error_msg.lower():
-                    error_detail = f'连接超时。请检查网络连接和代理设置'
-                else:
-                    error_detail = f'验证失败: {error_msg[:100]}'
-                
-                print(f"[验证] ✗ 群组验证失败 ({group}): {error_type} - {error_detail}")
-                return False, error_detail, None
+        if not LISTENER_IN_PROCESS:
+            # 监听器在其他进程：写入配置，由监听器在后台解析验证
+            config_store.add_groups([group])
+            return jsonify({'success': True, 'message': f'已添加群组: {group}，监听进程将在后台验证并开始监听'})
         
         # 验证群组（使用线程安全的方式，通过客户端的事件循环进行验证）
         try:
@@ -532,8 +2344,6 @@ def api_add_group():
                 })
             
             # 使用客户端的事件循环来执行验证（线程安全）
-            import concurrent.futures
-            
             # 获取客户端的事件循环（在主线程中获取，避免在新线程中访问）
             if client_loop_ref is None or client_loop_ref.is_closed():
                 return jsonify({
@@ -543,13 +2353,13 @@ def api_add_group():
             
             # 将验证协程提交到客户端的事件循环中执行（线程安全）
             future = asyncio.run_coroutine_threadsafe(
-                asyncio.wait_for(verify_group(), timeout=15),
+                asyncio.wait_for(verify_group(group), timeout=15),
                 client_loop_ref
             )
             
             try:
                 # 等待验证完成（最多20秒）
-                is_valid, error_detail, chat_title = future.result(timeout=20)
+                is_valid, error_detail, chat_title, chat_id = future.result(timeout=20)
             except concurrent.futures.TimeoutError:
                 return jsonify({
                     'success': False, 
@@ -580,13 +2390,11 @@ def api_add_group():
                 'message': f'验证群组失败: {error_msg[:100]}'
             })
         
-        # 添加到监控列表
-        monitored_groups.append(group)
-        save_config()
-        
-        # 如果客户端已连接，重新注册处理器
-        if client.is_connected():
-            register_handlers()
+        # 记录 chat_id 索引，并添加到监控列表
+        if chat_id is not None:
+            index_group(chat_id, group)
+        config_store.add_groups([group])
+        load_group_stats([group])
         
         success_msg = f'添加成功！群组: {group}'
         if chat_title:
@@ -598,6 +2406,104 @@ def api_add_group():
         traceback.print_exc()
         return jsonify({'success': False, 'message': f'添加群组时出错: {str(e)}'})
 
+@app.route('/api/add_groups', methods=['POST'])
+def api_add_groups():
+    """
+    批量添加群组API
+    
+    请求体: {"groups": ["@a", "b", ...]}（也可以是逗号或换行分隔的字符串）, 可选 "concurrency"
+    以 SSE 流逐个返回每个群组的验证结果，全部完成后只写一次配置
+    """
+    data = request.get_json(silent=True)
+    if data is None and not request.get_data():
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': '请求体必须是 JSON 对象'}), 400
+    raw_groups = data.get('groups') or []
+    if isinstance(raw_groups, str):
+        raw_groups = raw_groups.replace('\n', ',').split(',')
+    if not isinstance(raw_groups, list):
+        return jsonify({'success': False, 'message': 'groups 必须是列表或字符串'}), 400
+    try:
+        concurrency = min(max(int(data.get('concurrency', 5)), 1), 10)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'concurrency 必须是整数'}), 400
+    
+    groups = []
+    skipped = []
+    for group in raw_groups:
+        group = str(group).strip()
+        if not group:
+            continue
+        # 确保群组名以 @ 开头
+        if not group.startswith('@'):
+            group = '@' + group
+        if group in monitored_groups or group in groups:
+            skipped.append(group)
+        else:
+            groups.append(group)
+    
+    if not groups:
+        return jsonify({'success': False, 'message': '没有需要添加的新群组', 'skipped': skipped})
+    
+    if not LISTENER_IN_PROCESS:
+        # 监听器在其他进程：写入配置，由监听器在后台解析验证
+        config_store.add_groups(groups)
+        return jsonify({
+            'success': True,
+            'message': f'已添加 {len(groups)} 个群组，监听进程将在后台验证并开始监听',
+            'added': groups,
+            'skipped': skipped
+        })
+    
+    if not client_ready_event.wait(timeout=5) or not client.is_connected() \
+            or client_loop_ref is None or client_loop_ref.is_closed():
+        return jsonify({
+            'success': False,
+            'message': 'Telegram客户端未连接，请等待连接完成后再试（通常需要10-30秒）'
+        })
+    
+    results = queue.Queue()
+    
+    async def verify_and_add():
+        valid = await verify_groups_bulk(groups, results.put, concurrency=concurrency)
+        # 所有群组验证完成后一次性写入配置
+        if valid:
+            for result in valid:
+                index_group(result['chat_id'], result['group'])
+            config_store.add_groups([result['group'] for result in valid])
+            load_group_stats([result['group'] for result in valid])
+        return valid
+    
+    # 验证在客户端事件循环中进行，即使浏览器中途断开也会完成并写入配置
+    future = asyncio.run_coroutine_threadsafe(verify_and_add(), client_loop_ref)
+    
+    def generate():
+        yield f"data: {json.dumps({'type': 'start', 'total': len(groups), 'skipped': skipped}, ensure_ascii=False)}\n\n"
+        done = 0
+        while done < len(groups):
+            try:
+                result = results.get(timeout=15)
+            except queue.Empty:
+                if future.done():
+                    break
+                yield ': keepalive\n\n'
+                continue
+            if result.get('status') == 'flood_wait':
+                yield f"data: {json.dumps(dict(result, type='flood_wait'), ensure_ascii=False)}\n\n"
+                continue
+            done += 1
+            yield f"data: {json.dumps(dict(result, type='result'), ensure_ascii=False)}\n\n"
+        
+        try:
+            valid = future.result()
+        except Exception as e:
+            yield f"data: {json.dumps({'type': 'error', 'message': f'批量添加群组失败: {str(e)[:100]}'}, ensure_ascii=False)}\n\n"
+            return
+        yield f"data: {json.dumps({'type': 'done', 'added': [r['group'] for r in valid], 'failed': len(groups) - len(valid), 'skipped': skipped}, ensure_ascii=False)}\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
 @app.route('/api/remove_group', methods=['POST'])
 def api_remove_group():
     """删除群组API"""
@@ -605,20 +2511,33 @@ def api_remove_group():
         data = request.json
         group = data.get('group', '').strip()
         
-        if group not in monitored_groups:
+        if not config_store.remove_group(group):
             return jsonify({'success': False, 'message': '群组不存在'})
-        
-        monitored_groups.remove(group)
-        save_config()
-        
-        # 如果客户端已连接，重新注册处理器
-        if client.is_connected():
-            register_handlers()
+        unindex_group(group)
         
         return jsonify({'success': True, 'message': '删除成功！'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/groups/<group_name>/summary', methods=['GET'])
+def api_get_rolling_summary(group_name):
+    """获取群组最近一次增量总结API"""
+    from urllib.parse import unquote
+    group_name = unquote(group_name)
+    
+    rolling = chunk_store.get_rolling(group_name)
+    if not rolling:
+        return jsonify({
+            'success': False,
+            'message': '该群组暂无增量总结'
+        })
+    
+    return jsonify({
+        'success': True,
+        'group_name': group_name,
+        **rolling
+    })
+
 @app.route('/api/groups/<group_name>/summarize', methods=['POST'])
 def api_summarize_group(group_name):
     """总结群组消息API"""
@@ -642,72 +2561,41 @@ def api_summarize_group(group_name):
         else:
             username = group_name
         
+        # 计算时间范围（纪元秒），由数据库按时间过滤
+        since_ts = data.get('since')
+        until_ts = data.get('until')
+        if days and since_ts is None:
+            # 按天数的窗口起点向下取整到小时，一小时内的重复请求可以命中总结缓存
+            since_ts = int(time.time()) - int(days * 86400)
+            since_ts -= since_ts % SUMMARY_CHUNK_SECONDS
+        
+        # 检查是否使用流式（默认使用流式）
+        use_stream = data.get('stream', True)
+        
+        # 增量模式：合并已保存的小时分块总结和最新消息
+        if data.get('mode') == 'incremental' and since_ts is not None:
+            return summarize_incremental(group_name, username, days, limit, since_ts, use_stream)
+        
         # 获取消息
-        messages = db_manager.get_messages_by_chat_username(username, limit=limit * 2)  # 多取一些，后面会过滤
+        messages = fetch_messages_in_window(username, limit, since_ts=since_ts, until_ts=until_ts)
         
         if not messages:
             return jsonify({
                 'success': False,
-                'message': '该群组暂无消息'
+                'message': f'最近 {days} 天内该群组无消息' if days else '该群组暂无消息'
             })
         
         # 获取群组信息
         chat_title = messages[0].get('chat_title', group_name)
         
-        # 如果指定了天数，过滤消息
-        if days:
-            from datetime import timedelta, timezone
-            # 使用 UTC 时区创建 cutoff_date，确保是 offset-aware
-            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-            filtered_messages = []
-            for msg in messages:
-                msg_date = msg.get('message_date', '')
-                if isinstance(msg_date, str):
-                    try:
-                        # 尝试解析日期字符串
-                        if 'Z' in msg_date or '+' in msg_date or msg_date.count('-') > 2:
-                            # 有时区信息
-                            msg_date_obj = datetime.fromisoformat(msg_date.replace('Z', '+00:00'))
-                        else:
-                            # 没有时区信息，假设是 UTC
-                            msg_date_obj = datetime.fromisoformat(msg_date).replace(tzinfo=timezone.utc)
-                    except:
-                        continue
-                else:
-                    # 如果是 datetime 对象
-                    msg_date_obj = msg_date
-                    # 如果没有时区信息，添加 UTC 时区
-                    if msg_date_obj.tzinfo is None:
-                        msg_date_obj = msg_date_obj.replace(tzinfo=timezone.utc)
-                
-                # 确保 cutoff_date 和 msg_date_obj 都是 offset-aware
-                if cutoff_date.tzinfo is None:
-                    cutoff_date = cutoff_date.replace(tzinfo=timezone.utc)
-                if msg_date_obj.tzinfo is None:
-                    msg_date_obj = msg_date_obj.replace(tzinfo=timezone.utc)
-                
-                if msg_date_obj >= cutoff_date:
-                    filtered_messages.append(msg)
-            
-            messages = filtered_messages[:limit]  # 限制数量
-        
-        if not messages:
-            return jsonify({
-                'success': False,
-                'message': f'最近 {days} 天内该群组无消息'
-            })
-        
-        # 格式化消息用于总结
-        formatted_messages = []
-        for msg in messages:
-            sender = msg.get('sender_username') or msg.get('sender_name') or f"ID:{msg.get('sender_id')}"
-            text = msg.get('message_text', '[非文本消息]')
-            date = msg.get('message_date', '')
-            formatted_messages.append({
-                'date': date,
-                'sender': sender,
-                'text': text
-            })
+        # 分块并行总结（消息只够一个分块时按普通方式总结）
+        if data.get('mode') == 'map_reduce':
+            response = summarize_map_reduce(
+                group_name, chat_title, messages, days, since_ts, until_ts, limit, use_stream,
+                data.get('use_cache', True)
+            )
+            if response is not None:
+                return response
         
         # 调用总结器
         prompt_config = summarizer.prompts.get('group_summary', {})
@@ -715,66 +2603,73 @@ def api_summarize_group(group_name):
         system_prompt = prompt_config.get('system', '你是一个专业的总结助手。')
         max_tokens = prompt_config.get('max_tokens', 3000)
         
+        # 在模型上下文预算内挑选消息（去掉非文本、近似重复的消息）
+        token_budget = prompt_config.get('input_tokens') or (
+            prompt_config.get('context_tokens', 32000) - max_tokens
+            - estimate_tokens(system_prompt + user_template + chat_title)
+        )
+        all_messages = messages
+        messages, packing = pack_messages(messages, max(0, token_budget), format_message_line)
+        if not messages:
+            return jsonify({
+                'success': False,
+                'message': '没有可用于总结的文本消息'
+            })
+        
         # 格式化消息内容
-        content_lines = []
-        for msg in formatted_messages:
-            date_str = msg['date'][:10] if msg['date'] else ''  # 只取日期部分
-            content_lines.append(f"[{date_str}] {msg['sender']}: {msg['text']}")
-        content = '\n'.join(content_lines)
+        content = format_message_content(messages)
         
         # 格式化提示词
         user_prompt = user_template.format(group_name=chat_title, content=content)
+        messages_api = [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt}
+        ]
         
-        # 检查是否使用流式（默认使用流式）
-        use_stream = request.json.get('stream', True) if request.json else True
+        # 计算时间范围
+        first_msg_date = str(all_messages[-1].get('message_date') or '')
+        last_msg_date = str(all_messages[0].get('message_date') or '')
+        date_range = {
+            'start': first_msg_date[:10],
+            'end': last_msg_date[:10]
+        }
         
-        if use_stream and hasattr(summarizer.client, 'chat_stream'):
+        # 查询总结缓存（没有新消息时直接返回上次的结果）
+        cache_key = summary_cache.make_key(
+            group_name, since_ts, until_ts, limit, prompt_version(prompt_config), all_messages[0].get('message_id')
+        )
+        cached = summary_cache.get(cache_key) if data.get('use_cache', True) else None
+        
+        if use_stream and (cached or hasattr(summarizer.client, 'chat_stream')):
             # 流式模式
             def generate():
                 # 发送初始信息
-                yield f"data: {json.dumps({'type': 'start', 'group': chat_title, 'message_count': len(messages)}, ensure_ascii=False)}\n\n"
+                yield f"data: {json.dumps({'type': 'start', 'group': chat_title, 'message_count': len(messages), 'packing': packing, 'cached': bool(cached)}, ensure_ascii=False)}\n\n"
+                
+                if cached:
+                    # 命中缓存，直接回放
+                    yield f"data: {json.dumps({'type': 'chunk', 'content': cached['summary']}, ensure_ascii=False)}\n\n"
+                    yield f"data: {json.dumps({'type': 'done', 'summary': cached['summary'], 'message_count': cached['message_count'], 'date_range': cached['date_range'], 'days': days, 'cached': True}, ensure_ascii=False)}\n\n"
+                    return
                 
                 # 调用流式总结
                 full_summary = ""
                 try:
-                    # 调用总结器
-                    prompt_config = summarizer.prompts.get('group_summary', {})
-                    user_template = prompt_config.get('user_template', '请总结以下内容：\n\n{content}')
-                    system_prompt = prompt_config.get('system', '你是一个专业的总结助手。')
-                    max_tokens = prompt_config.get('max_tokens', 3000)
-                    
-                    # 格式化消息内容
-                    content_lines = []
-                    for msg in formatted_messages:
-                        date_str = msg['date'][:10] if msg['date'] else ''
-                        content_lines.append(f"[{date_str}] {msg['sender']}: {msg['text']}")
-                    content = '\n'.join(content_lines)
-                    
-                    # 格式化提示词
-                    user_prompt = user_template.format(group_name=chat_title, content=content)
-                    
-                    # 构建消息
-                    messages_api = [
-                        {'role': 'system', 'content': system_prompt},
-                        {'role': 'user', 'content': user_prompt}
-                    ]
-                    
                     # 流式调用
                     for chunk in summarizer.client.chat_stream(messages_api, max_tokens=max_tokens):
                         if chunk:
                             full_summary += chunk
                             yield f"data: {json.dumps({'type': 'chunk', 'content': chunk}, ensure_ascii=False)}\n\n"
                     
-                    # 计算时间范围
-                    if messages:
-                        first_msg_date = messages[-1].get('message_date', '')
-                        last_msg_date = messages[0].get('message_date', '')
-                    else:
-                        first_msg_date = ''
-                        last_msg_date = ''
+                    if full_summary:
+                        summary_cache.put(cache_key, group_name, {
+                            'summary': full_summary,
+                            'message_count': len(messages),
+                            'date_range': date_range
+                        })
                     
                     # 发送完成信息
-                    yield f"data: {json.dumps({'type': 'done', 'summary': full_summary, 'message_count': len(messages), 'date_range': {'start': first_msg_date[:10] if first_msg_date else '', 'end': last_msg_date[:10] if last_msg_date else ''}, 'days': days}, ensure_ascii=False)}\n\n"
+                    yield f"data: {json.dumps({'type': 'done', 'summary': full_summary, 'message_count': len(messages), 'packing': packing, 'date_range': date_range, 'days': days, 'cached': False}, ensure_ascii=False)}\n\n"
                 except Exception as e:
                     import traceback
                     traceback.print_exc()
@@ -783,27 +2678,23 @@ def api_summarize_group(group_name):
             return Response(stream_with_context(generate()), mimetype='text/event-stream')
         else:
             # 非流式模式（兼容旧版本）
-            # 调用 AI
-            messages_api = [
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ]
-            
-            summary = summarizer.client.chat(messages_api, max_tokens=max_tokens)
-            
-            if not summary:
-                return jsonify({
-                    'success': False,
-                    'message': 'AI 总结生成失败，请检查 API 配置'
-                })
-            
-            # 计算时间范围
-            if messages:
-                first_msg_date = messages[-1].get('message_date', '')
-                last_msg_date = messages[0].get('message_date', '')
+            if cached:
+                summary = cached['summary']
             else:
-                first_msg_date = ''
-                last_msg_date = ''
+                # 调用 AI
+                summary = summarizer.client.chat(messages_api, max_tokens=max_tokens)
+                
+                if not summary:
+                    return jsonify({
+                        'success': False,
+                        'message': 'AI 总结生成失败，请检查 API 配置'
+                    })
+                
+                summary_cache.put(cache_key, group_name, {
+                    'summary': summary,
+                    'message_count': len(messages),
+                    'date_range': date_range
+                })
             
             return jsonify({
                 'success': True,
@@ -811,11 +2702,10 @@ def api_summarize_group(group_name):
                 'group_name': group_name,
                 'summary': summary,
                 'message_count': len(messages),
-                'date_range': {
-                    'start': first_msg_date[:10] if first_msg_date else '',
-                    'end': last_msg_date[:10] if last_msg_date else ''
-                },
-                'days': days
+                'packing': packing,
+                'date_range': date_range,
+                'days': days,
+                'cached': bool(cached)
             })
     except Exception as e:
         import traceback
@@ -855,18 +2745,46 @@ def run_telegram_client():
                 client_connected = True
                 client_ready_event.set()
                 
-                # 自动注册消息处理器并开始监听
-                if monitored_groups:
+                # 启动批量写入器
+                message_writer.start(client_loop_ref)
+                
+                # 注册处理器之前读取补齐检查点（之后收到的新消息会推进检查点）
+                backfiller.seed_from_database(listener_groups())
+                gap_start = backfiller.snapshot()
+                
+                # 自动注册消息处理器并开始监听（群组过滤由索引决定）
+                register_handlers()
+                sys.stdout.flush()
+                
+                # 构建群组索引，并在后台定期刷新
+                resolved = await resolve_group_index()
+                print(f"✓ 已建立 {resolved} 个群组的 chat_id 索引")
+                sys.stdout.flush()
+                if GROUP_INDEX_REFRESH > 0:
+                    client.loop.create_task(refresh_group_index_periodically())
+                client.loop.create_task(retry_unresolved_groups())
+                client.loop.create_task(watch_config_changes())
+                
+                # 补齐进程停止期间错过的消息
+                client.loop.create_task(backfiller.run(gap_start))
+                
+                # 持续运行；连接断开后重新连接，并补齐断线期间的消息
+                retry_delay = 5
+                while True:
+                    await client.run_until_disconnected()
+                    gap_start = backfiller.snapshot()
+                    print(f"⚠ Telegram 连接已断开，{retry_delay} 秒后重新连接...")
+                    sys.stdout.flush()
+                    await asyncio.sleep(retry_delay)
                     try:
-                        client.add_event_handler(message_handler, events.NewMessage(chats=monitored_groups))
-                        print(f"✓ 已自动注册 {len(monitored_groups)} 个群组的消息处理器，开始监听...")
-                        sys.stdout.flush()
+                        await client.connect()
                     except Exception as e:
-                        print(f"⚠ 自动注册处理器失败: {e}")
-                        sys.stdout.flush()
-                
-                # 持续运行
-                await client.run_until_disconnected()
+                        print(f"✗ 重新连接失败: {e}")
+                        retry_delay = min(retry_delay * 2, 300)
+                        continue
+                    retry_delay = 5
+                    print("✓ Telegram客户端已重新连接")
+                    client.loop.create_task(backfiller.run(gap_start))
             except asyncio.TimeoutError:
                 print("✗ Telegram客户端连接超时（30秒）")
                 print("   请检查：")
@@ -902,6 +2820,11 @@ def run_telegram_client():
         try:
             loop.run_until_complete(main())
         finally:
+            try:
+                loop.run_until_complete(message_writer.flush())
+            except Exception as e:
+                print(f"⚠ 写入剩余消息失败: {e}")
+            message_writer.executor.shutdown(wait=True)
             try:
                 loop.run_until_complete(client.disconnect())
             except:
@@ -918,48 +2841,349 @@ def run_telegram_client():
         client_ready_event.clear()
         sys.stdout.flush()
 
+# ==================== 搜索索引重建 ====================
+def rebuild_search_index(batch_size=1000):
+    """
+    把数据库中已有的消息按群组分页补充到全文搜索索引（索引在消息写入时才更新，
+    启用之前保存的消息需要用这个命令补上）
+    
+    Returns:
+        新加入索引的消息数
+    """
+    total = 0
+    for group in list(monitored_groups):
+        username = group[1:] if group.startswith('@') else group
+        added = 0
+        before_id = None
+        while True:
+            # 按消息ID从新到旧分页，每页成本与第一页相同
+            messages = fetch_messages_page(username, batch_size, before_id=before_id)
+            if not messages:
+                break
+            added += search_index.add_messages(messages)
+            before_id = messages[-1]['message_id']
+            if len(messages) < batch_size:
+                break
+        total += added
+        print(f"  {group}: 新增索引 {added} 条")
+    print(f"✓ 搜索索引重建完成，新增 {total} 条，共 {search_index.get_stats()['indexed_messages']} 条")
+    return total
+
+# ==================== 应用工厂 ====================
+def require_credentials():
+    """监听器必须提供 Telegram API 凭据（只使用 Web 接口时不需要）"""
+    if not API_ID or not API_HASH:
+        print("\n错误: 必须提供 --api-id 和 --api-hash 参数，或设置环境变量 API_ID 和 API_HASH")
+        sys.exit(1)
+
+def require_retention_store():
+    """启用保留策略时，数据库管理器必须提供清理接口（缺少时报错退出，不静默跳过）"""
+    try:
+        retention_engine.check()
+    except RuntimeError as e:
+        print(f"\n错误: {e}")
+        sys.exit(1)
+
+def create_app():
+    """
+    构建 Web 应用：加载配置和群组统计，返回 Flask app
+    
+    不连接 Telegram、不导入 telethon；总结器、缓存等组件在第一次使用时才构建
+    """
+    global group_stats_loaded_at
+    init_config()
+    load_group_stats()
+    group_stats_loaded_at = time.monotonic()
+    return app
+
+def create_listener():
+    """
+    构建监听器：检查 API 凭据、加载配置并预热发送者缓存，返回 Telegram 客户端
+    
+    之后调用 run_telegram_client() 连接并开始监听
+    """
+    require_credentials()
+    init_config()
+    warm_sender_cache()
+    return client.instance()
+
+# ==================== 多进程部署 ====================
+def write_listener_status():
+    """监听进程：把连接状态和运行统计写入状态文件（先写临时文件再改名）"""
+    try:
+        is_connected = client.is_connected()
+    except Exception:
+        is_connected = False
+    status = {
+        'is_connected': is_connected,
+        'pid': os.getpid(),
+        'updated_at': time.time(),
+        'groups': len(group_index),
+        'dispatch': dispatch_counter.get_stats(),
+        'writer': message_writer.get_stats(),
+        'backfill': backfiller.get_stats(),
+        'retention': retention_engine.get_stats(),
+        'sender_cache': sender_cache.get_stats(),
+        'metrics': metrics.snapshot()
+    }
+    tmp_path = LISTENER_STATUS_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(tmp_path, LISTENER_STATUS_FILE)
+
+def read_listener_status(max_age=30, with_metrics=False):
+    """
+    Web 进程：读取监听进程的状态，超过 max_age 秒未更新视为未连接
+    
+    Args:
+        with_metrics: 是否保留监听进程导出的运行指标（/metrics 使用）
+    """
+    def read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return {'is_connected': False}
+        if not with_metrics:
+            status.pop('metrics', None)
+        if time.time() - status.get('updated_at', 0) > max_age:
+            status['is_connected'] = False
+        return status
+    
+    if not SHARD_SESSIONS:
+        return read(LISTENER_STATUS_FILE)
+    
+    # 分片模式：汇总各分片的状态
+    shards = [dict(read(f'{_status_base}_{i}.json'), shard=i) for i in range(len(SHARD_SESSIONS))]
+    return {
+        'is_connected': any(shard['is_connected'] for shard in shards),
+        'shards': shards
+    }
+
+def run_listener_process():
+    """独立监听进程：只运行 Telegram 客户端，并定期写入状态文件"""
+    def heartbeat():
+        while True:
+            try:
+                write_listener_status()
+            except Exception as e:
+                print(f"⚠ 写入监听器状态失败: {e}")
+            time.sleep(5)
+    
+    create_listener()
+    threading.Thread(target=heartbeat, daemon=True).start()
+    run_telegram_client()
+
+def start_shard_process(shard):
+    """启动一个分片监听进程（使用独立的会话文件）"""
+    command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+        '--role', 'listener',
+        '--session-name', SHARD_SESSIONS[shard],
+        '--shard-index', str(shard)
+    ]
+    print(f"[分片] 启动分片 {shard}（会话: {SHARD_SESSIONS[shard]}）")
+    return subprocess.Popen(command)
+
+def run_shard_supervisor(check_interval=2, max_failures=3, failure_window=300):
+    """
+    分片监督进程：启动所有分片，分片退出时重启；
+    在 failure_window 秒内退出 max_failures 次的分片视为失效，
+    它的群组会重新分配给其他存活的分片
+    """
+    alive_shards = list(range(len(SHARD_SESSIONS)))
+    write_shard_assignment(alive_shards)
+    processes = {shard: start_shard_process(shard) for shard in alive_shards}
+    failures = {shard: [] for shard in alive_shards}
+    seen_version = config_store.version
+    
+    try:
+        while True:
+            time.sleep(check_interval)
+            # 群组列表变化（由配置监视线程重新加载）时重新分配
+            rebalance = config_store.version != seen_version
+            seen_version = config_store.version
+            
+            for shard in list(alive_shards):
+                if processes[shard].poll() is None:
+                    continue
+                now = time.time()
+                failures[shard] = [t for t in failures[shard] if t > now - failure_window] + [now]
+                if len(failures[shard]) >= max_failures:
+                    print(f"[分片] ✗ 分片 {shard} 在 {failure_window} 秒内退出 {max_failures} 次，重新分配其群组")
+                    alive_shards.remove(shard)
+                    rebalance = True
+                else:
+                    print(f"[分片] ⚠ 分片 {shard} 已退出（返回码 {processes[shard].returncode}），正在重启")
+                    processes[shard] = start_shard_process(shard)
+            
+            if rebalance:
+                if not alive_shards:
+                    print("[分片] ✗ 所有分片均已失效")
+                    return
+                write_shard_assignment(alive_shards)
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+
+def start_listener_subprocess():
+    """启动独立的监听子进程（使用相同的命令行参数）"""
+    command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--role', 'listener']
+    print(f"启动监听进程: {' '.join(command)}")
+    return subprocess.Popen(command)
+
+def tail_messages_to_stream(interval=2):
+    """
+    Web 进程：轮询数据库中的新消息并推送给 SSE 订阅者
+    
+    监听器在其他进程时 stream_hub 收不到消息处理器的推送，改为按群组增量读取；
+    没有订阅者时不查询数据库
+    """
+    if not hasattr(db_manager, 'get_messages_page'):
+        print("⚠ 数据库管理器不支持游标分页（get_messages_page），跨进程的实时推送不可用")
+        return
+    last_ids = {}
+    while True:
+        time.sleep(interval)
+        if not stream_hub.get_stats()['subscribers']:
+            last_ids.clear()
+            continue
+        try:
+            for group in list(monitored_groups):
+                username = group[1:] if group.startswith('@') else group
+                if group not in last_ids:
+                    latest = fetch_messages_page(username, 1)
+                    last_ids[group] = latest[0]['message_id'] if latest else 0
+                    continue
+                new_messages = fetch_messages_page(username, 200, after_id=last_ids[group])
+                for msg in reversed(new_messages):
+                    stream_hub.publish('message', dict(msg, group=group), group=group)
+                if new_messages:
+                    last_ids[group] = new_messages[0]['message_id']
+        except Exception as e:
+            print(f"⚠ 读取新消息失败: {e}")
+
+def serve_web():
+    """按 --server 选项启动 Web 服务器"""
+    if SERVER == 'gunicorn':
+        from gunicorn.app.base import BaseApplication
+        
+        def post_fork(server, worker):
+            # fork 后只剩调用线程，后台线程需要在工作进程中重新启动
+            config_store.watch()
+            threading.Thread(target=tail_messages_to_stream, daemon=True).start()
+        
+        class WebApplication(BaseApplication):
+            """在 gunicorn 多进程中运行同一个 Flask app"""
+            
+            def load_config(self):
+                self.cfg.set('bind', f'{WEB_HOST}:{WEB_PORT}')
+                self.cfg.set('workers', WEB_WORKERS)
+                self.cfg.set('threads', WEB_THREADS)
+                self.cfg.set('worker_class', 'gthread')
+                # SSE 长连接不能被工作进程超时杀掉
+                self.cfg.set('timeout', 0)
+                self.cfg.set('post_fork', post_fork)
+            
+            def load(self):
+                return app
+        
+        WebApplication().run()
+    elif SERVER == 'waitress':
+        from waitress import serve
+        threading.Thread(target=tail_messages_to_stream, daemon=True).start()
+        serve(app, host=WEB_HOST, port=WEB_PORT, threads=WEB_THREADS)
+    else:
+        if not LISTENER_IN_PROCESS:
+            threading.Thread(target=tail_messages_to_stream, daemon=True).start()
+        app.run(host=WEB_HOST, port=WEB_PORT, debug=False, use_reloader=False, threaded=True)
+
 # ==================== 启动 ====================
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
     print("="*60)
     print("Telegram 群组监听器 - 新版网页版")
     print("="*60)
+    init_config()
     print(f"\n正在监控 {len(monitored_groups)} 个群组:")
     for i, group in enumerate(monitored_groups, 1):
         print(f"  {i}. {group}")
     
-    # 在后台线程启动Telegram客户端
-    print("\n启动Telegram客户端线程...")
-    sys.stdout.flush()
-    telegram_thread = threading.Thread(target=run_telegram_client, daemon=True)
-    telegram_thread.start()
-    
-    # 等待一下让线程启动
-    time.sleep(0.5)
-    sys.stdout.flush()
-    
-    # 等待客户端连接（最多等待10秒）
-    print("等待Telegram客户端连接...")
-    sys.stdout.flush()
-    if client_ready_event.wait(timeout=10):
-        print("✓ Telegram客户端已就绪")
+    if args.rebuild_search_index:
+        print(f"\n正在重建全文搜索索引: {SEARCH_INDEX_FILE}")
+        try:
+            rebuild_search_index()
+        except RuntimeError as e:
+            print(f"\n错误: {e}")
+            sys.exit(1)
+        sys.exit(0)
+    
+    # 保留策略只在一个进程中运行：独立监听进程（或分片监督进程），单进程模式下在本进程
+    if retention_engine.enabled and RETENTION_INTERVAL > 0 and SHARD_INDEX is None \
+            and (ROLE == 'listener' or LISTENER_IN_PROCESS):
+        require_retention_store()
+        retention_engine.start(RETENTION_INTERVAL)
+        print(f"✓ 保留策略已启动（每群组最多 {MAX_MESSAGES_PER_GROUP or '不限'} 条，"
+              f"最多 {RETENTION_DAYS or '不限'} 天，归档目录: {ARCHIVE_DIR}）")
+    
+    if ROLE == 'listener':
+        if SHARD_SESSIONS and SHARD_INDEX is None:
+            # 分片模式：本进程作为监督进程，监听由各分片进程完成
+            print(f"\n以分片监督进程运行，共 {len(SHARD_SESSIONS)} 个分片...")
+            sys.stdout.flush()
+            run_shard_supervisor()
+            sys.exit(0)
+        
+        # 独立监听进程，不启动 Web 服务器
+        print("\n以独立监听进程运行...")
         sys.stdout.flush()
-    else:
-        print("⚠ Telegram客户端连接超时（10秒），但程序会继续运行")
-        print("   客户端连接成功后会自动开始监听")
+        run_listener_process()
+        sys.exit(0)
+    
+    listener_process = None
+    create_app()
+    if LISTENER_IN_PROCESS:
+        # 在后台线程启动Telegram客户端
+        create_listener()
+        print("\n启动Telegram客户端线程...")
         sys.stdout.flush()
+        telegram_thread = threading.Thread(target=run_telegram_client, daemon=True)
+        telegram_thread.start()
+        
+        # 等待一下让线程启动
+        time.sleep(0.5)
+        sys.stdout.flush()
+        
+        # 等待客户端连接（最多等待10秒）
+        print("等待Telegram客户端连接...")
+        sys.stdout.flush()
+        if client_ready_event.wait(timeout=10):
+            print("✓ Telegram客户端已就绪")
+            sys.stdout.flush()
+        else:
+            print("⚠ Telegram客户端连接超时（10秒），但程序会继续运行")
+            print("   客户端连接成功后会自动开始监听")
+            sys.stdout.flush()
+    elif ROLE == 'all':
+        # 生产模式：监听器运行在独立进程
+        require_credentials()
+        listener_process = start_listener_subprocess()
     
     print("\n" + "="*60)
     print("Web服务器启动中...")
     print(f"访问地址: http://{WEB_HOST}:{WEB_PORT}")
     print("="*60 + "\n")
     
-    # 启动Flask服务器
+    # 启动Web服务器
     try:
-        app.run(host=WEB_HOST, port=WEB_PORT, debug=False, use_reloader=False, threaded=True)
+        serve_web()
     except OSError as e:
         if "Address already in use" in str(e):
             print(f"\n错误: 端口 {WEB_PORT} 已被占用")
             print("请关闭占用端口的程序，或使用 --web-port 参数指定其他端口")
         else:
             print(f"\n错误: {e}")
+    finally:
+        if listener_process:
+            listener_process.terminate()
 